@@ -12,6 +12,10 @@
 --     uris = ['gs://labs.roitraining.com/alaska-dept-of-snow/alaska-dept-of-snow-faqs.csv']
 -- );
  
+-- One-time setup only. To refresh the FAQ table after the CSV changes, run
+-- `python ingest.py`, which embeds only new or changed rows and tombstones
+-- removed ones (it also migrates a table built by the statement below).
+
 -- CREATE OR REPLACE TABLE `alaska.alaska_faq_embedded` AS
 -- SELECT *
 -- FROM ML.GENERATE_EMBEDDING(
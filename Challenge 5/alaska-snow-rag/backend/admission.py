@@ -0,0 +1,180 @@
+"""
+Admission control: bounded in-flight limits with bounded FIFO queues
+
+One gate admits /ask requests into the pipeline; one per upstream caps
+concurrent BigQuery, Gemini and validator calls at their quota. A request
+that cannot get a slot is turned away quickly with a Retry-After hint
+instead of piling up until it times out, so the requests that are admitted
+still finish within their deadline.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from config import (
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS, UPSTREAM_MAX_IN_FLIGHT
+)
+from metrics import time_stage, ADMISSION_SHED
+
+class OverloadedError(Exception):
+    """A request was shed by admission control"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """
+    At most `limit` holders; later callers wait in FIFO order
+
+    With max_queue, a caller that finds the queue full is shed at once
+    (429). With queue_timeout, a caller still waiting after that long is
+    shed (503). A released slot is handed straight to the oldest waiter.
+    A caller doing the work of several may take `weight` slots at once
+    (at most `limit`); waiters are served strictly in order, so a heavy
+    caller is not starved by lighter ones behind it. Used from the event
+    loop only.
+    """
+
+    def __init__(self, name, limit, max_queue=None, queue_timeout=None, stage="queue"):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.stage = stage
+        self.in_flight = 0
+        self.admitted = 0
+        # Smoothed seconds a slot is held, for Retry-After
+        self.hold_seconds = None
+        # (future, weight) in arrival order
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @property
+    def saturated(self):
+        return self.in_flight >= self.limit
+
+    def retry_after(self):
+        """Whole seconds until the queue ahead is likely to have drained"""
+        hold = self.hold_seconds or 1.0
+        return max(1, math.ceil((self.queued + 1) * hold / max(self.limit, 1)))
+
+    def _shed(self, reason, status_code, message):
+        ADMISSION_SHED.inc(gate=self.name, reason=reason)
+        raise OverloadedError(message, status_code, self.retry_after())
+
+    async def acquire(self, weight=1):
+        """Take `weight` slots, waiting in line if they are not free; raises OverloadedError when shed"""
+        weight = max(1, min(weight, self.limit))
+        if self.in_flight + weight <= self.limit and not self._waiters:
+            self.in_flight += weight
+            self.admitted += 1
+            return
+
+        if self.max_queue is not None and len(self._waiters) >= self.max_queue:
+            self._shed("queue_full", 429, f"{self.name} queue is full ({self.max_queue} waiting)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, weight))
+
+        try:
+            with time_stage(self.stage):
+                done, _ = await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slots were handed over just as the caller gave up
+                self.release(weight=weight)
+            else:
+                self._forget(waiter, weight)
+            raise
+
+        if not done:
+            self._forget(waiter, weight)
+            self._shed("queue_timeout", 503, f"{self.name} slot not free within {self.queue_timeout:.1f}s")
+
+        self.admitted += 1
+
+    def release(self, held_seconds=None, weight=1):
+        """Free `weight` slots, handing them to the oldest waiters that fit"""
+        if held_seconds is not None:
+            self.hold_seconds = held_seconds if self.hold_seconds is None else (
+                0.8 * self.hold_seconds + 0.2 * held_seconds
+            )
+
+        self.in_flight -= max(1, min(weight, self.limit))
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter, weight = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if self.in_flight + weight > self.limit:
+                return
+            self._waiters.popleft()
+            self.in_flight += weight
+            waiter.set_result(None)
+
+    def _forget(self, waiter, weight):
+        waiter.cancel()
+        try:
+            self._waiters.remove((waiter, weight))
+        except ValueError:
+            pass
+        # A heavy waiter leaving the head of the line may let lighter ones in
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, weight=1):
+        """Hold `weight` slots for the enclosed block"""
+        await self.acquire(weight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start, weight)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+        }
+
+    def reset(self):
+        """Forget every holder and waiter"""
+        for waiter, _ in self._waiters:
+            waiter.cancel()
+        self._waiters.clear()
+        self.in_flight = 0
+        self.hold_seconds = None
+
+ADMISSION = AdmissionGate(
+    "ask", ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_SECONDS
+)
+
+UPSTREAM_GATES = {
+    upstream: AdmissionGate(upstream, limit, stage=f"{upstream}_queue")
+    for upstream, limit in UPSTREAM_MAX_IN_FLIGHT.items()
+}
+
+# The upstream each pipeline stage calls
+STAGE_UPSTREAMS = {"validate": "gemini_validator", "search": "bigquery", "generate": "gemini"}
+
+def upstream_gate(stage):
+    return UPSTREAM_GATES.get(STAGE_UPSTREAMS.get(stage))
+
+def reset_admission():
+    """Empty every gate"""
+    ADMISSION.reset()
+    for gate in UPSTREAM_GATES.values():
+        gate.reset()
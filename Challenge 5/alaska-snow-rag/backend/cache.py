@@ -0,0 +1,212 @@
+"""
+In-memory caches for the Alaska FAQ RAG system
+"""
+
+import hashlib
+import itertools
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_question(text):
+    """Normalize question text so trivially different phrasings share a cache key"""
+    text = _WHITESPACE.sub(" ", text.lower()).strip()
+    return text.rstrip("?!. ")
+
+class LRUCache:
+    """Thread-safe LRU cache with a size bound, per-entry TTL and hit/miss counters"""
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, count_miss=True):
+        """Return the cached value for key, or None when absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                if count_miss:
+                    self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed on question-embedding similarity
+
+    An entry is reused when a new question's embedding is within the cosine
+    threshold of a cached question and was grounded on the same retrieved context.
+    Questions answered without an embedding (the lexical fast path) match on
+    their normalized text instead.
+    """
+
+    def __init__(self, max_size, ttl_seconds, similarity_threshold):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # entry id -> (context key, unit embedding or None, question key, value, expires_at), in LRU order
+        self._entries = OrderedDict()
+        # context key -> entry ids, so lookups only compare questions with the same grounding
+        self._by_context = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _context_key(context):
+        return hashlib.sha1(context.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id):
+        context_key = self._entries.pop(entry_id)[0]
+        ids = self._by_context[context_key]
+        ids.discard(entry_id)
+        if not ids:
+            del self._by_context[context_key]
+
+    def get(self, query_embedding, context, question_key=None, count_miss=True):
+        """
+        Return the cached answer for a similar question with the same context, or None
+
+        count_miss=False is for speculative lookups that are retried on a miss.
+        """
+        vector = self._unit(query_embedding) if query_embedding is not None else None
+        context_key = self._context_key(context)
+        now = time.monotonic()
+
+        with self._lock:
+            best_id = None
+            best_score = self.similarity_threshold
+
+            for entry_id in list(self._by_context.get(context_key, ())):
+                _, cached_vector, cached_question_key, _, expires_at = self._entries[entry_id]
+
+                if expires_at <= now:
+                    self._remove(entry_id)
+                    continue
+
+                if question_key is not None and cached_question_key == question_key:
+                    best_id = entry_id
+                    break
+
+                if vector is None or cached_vector is None:
+                    continue
+
+                score = float(cached_vector @ vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def set(self, query_embedding, context, value, question_key=None):
+        """Cache an answer, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+
+        context_key = self._context_key(context)
+
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (
+                context_key,
+                self._unit(query_embedding) if query_embedding is not None else None,
+                question_key,
+                value,
+                time.monotonic() + self.ttl_seconds,
+            )
+            self._by_context.setdefault(context_key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        """Drop every answer, e.g. after the FAQ table has been reloaded"""
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        """Return size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,154 @@
+"""
+Per-stage thread pools that keep blocking SDK calls off the event loop
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import STAGE_CONCURRENCY
+from metrics import time_stage, SINGLE_FLIGHT
+
+_executors = {}
+_executors_lock = threading.Lock()
+_END_OF_STREAM = object()
+
+def get_executor(stage):
+    """Return the executor for a pipeline stage, sized by its concurrency limit"""
+    with _executors_lock:
+        executor = _executors.get(stage)
+
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=STAGE_CONCURRENCY[stage],
+                thread_name_prefix=f"{stage}-stage"
+            )
+            _executors[stage] = executor
+
+        return executor
+
+async def run_stage(stage, func, *args, **kwargs):
+    """
+    Run a blocking call on its stage's executor
+
+    At most STAGE_CONCURRENCY[stage] calls of a stage run at once; the rest
+    queue on the executor while the event loop keeps serving other requests.
+    The call runs in a copy of the caller's context, so request-scoped state
+    such as stage timings follows it onto the executor thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(stage), call)
+
+async def stream_stage(stage, func, *args, timeout=None, **kwargs):
+    """
+    Iterate a blocking generator on its stage's executor
+
+    The generator holds one executor thread for its whole run, and its items
+    are handed back to the event loop as they are produced. Closing the
+    stream early (e.g. a disconnected client) stops the iteration. With
+    timeout, raises asyncio.TimeoutError once the whole stream has taken
+    that many seconds; a call blocked in the upstream cannot be interrupted,
+    so its later items are dropped.
+    """
+    loop = asyncio.get_running_loop()
+    expires_at = None if timeout is None else loop.time() + timeout
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for item in func(*args, **kwargs):
+                if stopped.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            loop.call_soon_threadsafe(queue.put_nowait, (_END_OF_STREAM, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END_OF_STREAM, e))
+
+    loop.run_in_executor(get_executor(stage), contextvars.copy_context().run, produce)
+
+    try:
+        while True:
+            if expires_at is None:
+                item, error = await queue.get()
+            else:
+                item, error = await asyncio.wait_for(queue.get(), max(0.0, expires_at - loop.time()))
+            if item is _END_OF_STREAM:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def discard_task(task):
+    """
+    Cancel a pipeline task whose result is no longer needed
+
+    A call already running on an executor thread cannot be interrupted; its
+    result is simply dropped. Errors from finished tasks are consumed so they
+    are not reported as unretrieved.
+    """
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key onto one running task
+
+    The first caller (the leader) starts the work as a task of its own, so a
+    leader that disconnects does not cancel it for the others. Callers that
+    arrive while it runs share its result or its exception, waiting at most
+    wait_seconds before running the work themselves. A key is released as soon
+    as its work finishes, so a failure is never handed to later callers.
+    """
+
+    def __init__(self, wait_seconds):
+        self.wait_seconds = wait_seconds
+        self._in_flight = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def _release(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Nobody may be left to read the error
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, func, *args):
+        """Await func(*args), or the identical call already in flight for key"""
+        task = self._in_flight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._in_flight[key] = task
+            task.add_done_callback(functools.partial(self._release, key))
+            SINGLE_FLIGHT.inc(result="leader")
+            return await asyncio.shield(task)
+
+        try:
+            with time_stage("coalesce"):
+                result = await asyncio.wait_for(asyncio.shield(task), self.wait_seconds)
+        except asyncio.TimeoutError:
+            SINGLE_FLIGHT.inc(result="wait_timeout")
+            return await func(*args)
+        except Exception:
+            SINGLE_FLIGHT.inc(result="coalesced_error")
+            raise
+
+        SINGLE_FLIGHT.inc(result="coalesced")
+        return result
+
+def shutdown_executors():
+    """Stop every stage executor without waiting for queued calls"""
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False)
+        _executors.clear()
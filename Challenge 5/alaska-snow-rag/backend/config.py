@@ -13,6 +13,208 @@ DATASET_NAME = "alaska"
 TABLE_NAME = "alaska_faq_embedded"
 EMBEDDING_MODEL = "alaska.Embeddings"
 
+# Knowledge bases (tenants) served by one instance. /ask picks one with
+# "knowledge_base"; requests without it use DEFAULT_KNOWLEDGE_BASE, which is
+# loaded at startup. KNOWLEDGE_BASES_FILE may point to a JSON object of
+# further tenants or overrides, keyed by id, with the same fields. With
+# "tombstones", rows ingest.py marked deleted are excluded from search once the
+# table is found to have the deleted column when the tenant loads; tables built
+# by a CREATE TABLE ... AS script (Dataset.sql) only get it when ingest.py
+# first runs against them.
+DEFAULT_KNOWLEDGE_BASE = os.getenv("DEFAULT_KNOWLEDGE_BASE", "alaska")
+KNOWLEDGE_BASES_FILE = os.getenv("KNOWLEDGE_BASES_FILE", "")
+KNOWLEDGE_BASES = {
+    "alaska": {
+        "dataset": DATASET_NAME,
+        "table": TABLE_NAME,
+        "embedding_model": EMBEDDING_MODEL,
+        "assistant": "Alaska Department",
+        "faq_name": "Alaska FAQ",
+        "tombstones": True,
+        "index_path": os.getenv("VECTOR_INDEX_PATH", ""),
+    },
+    "aurora_bay": {
+        "dataset": "my_data_faq",
+        "table": "aurora_bay_faq_embedded",
+        "embedding_model": "my_data_faq.Embeddings",
+        "assistant": "Aurora Bay town",
+        "faq_name": "Aurora Bay FAQ",
+        "tombstones": False,
+        "index_path": os.getenv("AURORA_BAY_INDEX_PATH", ""),
+    },
+}
+# Indexes of tenants loaded on first use are evicted least recently used
+# (with their caches) once together they exceed this many megabytes
+TENANT_MEMORY_LIMIT_MB = float(os.getenv("TENANT_MEMORY_LIMIT_MB", "512"))
+
+# Retrieval settings
+# "local" snapshots the embedded FAQ table into memory at startup and only
+# embeds the question remotely; "bigquery" runs VECTOR_SEARCH for every question.
+# The local backend falls back to BigQuery when the snapshot cannot be loaded.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "local")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+FRACTION_LISTS_TO_SEARCH = float(os.getenv("FRACTION_LISTS_TO_SEARCH", "0.01"))
+
+# Hybrid retrieval: BM25 over the FAQ text is fused with vector results by
+# reciprocal-rank fusion. A lexical match scoring at least LEXICAL_FAST_PATH_SCORE
+# of the query's maximum, and LEXICAL_FAST_PATH_MARGIN times the runner-up,
+# is answered without embedding the question.
+LEXICAL_SEARCH_ENABLED = os.getenv("LEXICAL_SEARCH_ENABLED", "true").lower() == "true"
+LEXICAL_BM25_K1 = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+LEXICAL_BM25_B = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+LEXICAL_FAST_PATH_SCORE = float(os.getenv("LEXICAL_FAST_PATH_SCORE", "0.8"))
+LEXICAL_FAST_PATH_MARGIN = float(os.getenv("LEXICAL_FAST_PATH_MARGIN", "2.0"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Generation model cascade: a question whose best retrieved passage covers at
+# least CASCADE_MIN_MATCH of its terms, with a short context and a simple
+# question, is answered by the flash tier; everything else goes to pro.
+# CASCADE_FORCE_PRO sends every question to pro.
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "true").lower() == "true"
+FLASH_MODEL = os.getenv("FLASH_MODEL", "gemini-1.5-flash")
+PRO_MODEL = os.getenv("PRO_MODEL", "gemini-1.5-pro")
+CASCADE_MIN_MATCH = float(os.getenv("CASCADE_MIN_MATCH", "0.6"))
+CASCADE_MAX_CONTEXT_TOKENS = int(os.getenv("CASCADE_MAX_CONTEXT_TOKENS", "400"))
+CASCADE_MAX_QUESTION_WORDS = int(os.getenv("CASCADE_MAX_QUESTION_WORDS", "25"))
+CASCADE_FORCE_PRO = os.getenv("CASCADE_FORCE_PRO", "false").lower() == "true"
+
+# Context assembly: retrieved passages are deduplicated (word overlap at or
+# above the threshold) and packed best-first into the prompt token budget
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+# Query embedding cache (normalized question text -> embedding vector)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+
+# Semantic answer cache (paraphrased questions grounded on the same FAQ context)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+
+# Startup warm-up: one embedding and one tiny generation per model, so the first
+# real questions do not pay for connection setup
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_QUESTION = os.getenv("WARMUP_QUESTION", "When are roads cleared after snowfall?")
+
+# Per-stage concurrency limits: threads running blocking SDK calls for each /ask
+# stage. Requests beyond the limit queue without blocking the event loop.
+VALIDATE_CONCURRENCY = int(os.getenv("VALIDATE_CONCURRENCY", "32"))
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "32"))
+GENERATE_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", "32"))
+
+STAGE_CONCURRENCY = {
+    "validate": VALIDATE_CONCURRENCY,
+    "search": SEARCH_CONCURRENCY,
+    "generate": GENERATE_CONCURRENCY,
+}
+
+# End-to-end /ask deadline, split across stages: validation and search run
+# side by side and may each use their fraction of it; generation gets what is
+# left. A stage still running past the recent p95 of its own latency gets one
+# hedged duplicate call, once HEDGE_MIN_SAMPLES latencies have been seen.
+ASK_DEADLINE_SECONDS = float(os.getenv("ASK_DEADLINE_SECONDS", "20"))
+STAGE_DEADLINE_FRACTIONS = {
+    "validate": float(os.getenv("VALIDATE_DEADLINE_FRACTION", "0.3")),
+    "search": float(os.getenv("SEARCH_DEADLINE_FRACTION", "0.3")),
+    "generate": float(os.getenv("GENERATE_DEADLINE_FRACTION", "1.0")),
+}
+HEDGE_STAGES = [stage for stage in os.getenv("HEDGE_STAGES", "validate,search,generate").split(",") if stage]
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+
+# Per-upstream circuit breakers: after CIRCUIT_FAILURE_THRESHOLD consecutive
+# failures calls fail fast for CIRCUIT_RESET_SECONDS, then one probe call
+# decides whether the circuit closes again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Single-flight /ask: identical normalized questions arriving while one is in
+# flight share its result. A follower waits at most SINGLE_FLIGHT_WAIT_SECONDS
+# before running the pipeline itself.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "30"))
+
+# Direct answers: a question whose normalized text matches an FAQ question
+# with character similarity of at least DIRECT_ANSWER_THRESHOLD (and the same
+# terms, give or take a typo or plural) gets the stored FAQ answer without
+# retrieval, validation or generation. Measure coverage with direct_answers.py.
+DIRECT_ANSWER_ENABLED = os.getenv("DIRECT_ANSWER_ENABLED", "true").lower() == "true"
+DIRECT_ANSWER_THRESHOLD = float(os.getenv("DIRECT_ANSWER_THRESHOLD", "0.92"))
+
+# Admission control for /ask and /ask/stream: at most ADMISSION_MAX_IN_FLIGHT
+# requests run the pipeline at once and at most ADMISSION_MAX_QUEUE wait for a
+# slot. A request that finds the queue full is shed at once with 429; one that
+# cannot start within ADMISSION_QUEUE_TIMEOUT_SECONDS gets 503. Both carry
+# Retry-After. Answers servable from the answer cache with the in-memory
+# indexes alone skip the queue.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+
+# Concurrent calls per upstream (quota / slot limits). Further calls wait for
+# a free slot within their stage's share of the request deadline.
+UPSTREAM_MAX_IN_FLIGHT = {
+    "bigquery": int(os.getenv("BIGQUERY_MAX_IN_FLIGHT", "32")),
+    "gemini": int(os.getenv("GEMINI_MAX_IN_FLIGHT", "16")),
+    "gemini_validator": int(os.getenv("VALIDATOR_MAX_IN_FLIGHT", "32")),
+}
+
+# Conversation sessions (/ask with session_id). A session keeps its last
+# SESSION_RECENT_TURNS turns verbatim and folds older ones into a summary, so
+# the history added to the prompt stays within SESSION_HISTORY_TOKENS. Idle
+# sessions expire; the least recently used are evicted beyond the session or
+# memory limit.
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MEMORY_LIMIT_MB = float(os.getenv("SESSION_MEMORY_LIMIT_MB", "64"))
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "3"))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "400"))
+SESSION_TURN_MAX_CHARS = int(os.getenv("SESSION_TURN_MAX_CHARS", "600"))
+
+# Traffic capture for replay.py (off by default): /ask and /ask/stream
+# requests are written as JSON lines to TRAFFIC_CAPTURE_DIR/traffic.jsonl,
+# rotated at TRAFFIC_CAPTURE_MAX_MB into at most TRAFFIC_CAPTURE_FILES gzipped
+# files. TRAFFIC_CAPTURE_SAMPLE_RATE is the share of requests captured.
+TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true"
+TRAFFIC_CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR", "traffic")
+TRAFFIC_CAPTURE_MAX_MB = float(os.getenv("TRAFFIC_CAPTURE_MAX_MB", "50"))
+TRAFFIC_CAPTURE_FILES = int(os.getenv("TRAFFIC_CAPTURE_FILES", "10"))
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+
+# POST /knowledge-base/reload re-reads every FAQ embedding from BigQuery, so
+# it requires ADMIN_TOKEN in an X-Admin-Token header and is disabled while no
+# token is set. A reload less than RELOAD_MIN_INTERVAL_SECONDS after the last
+# one, or while one is running, gets 429.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+RELOAD_MIN_INTERVAL_SECONDS = float(os.getenv("RELOAD_MIN_INTERVAL_SECONDS", "60"))
+
+# Batch questions (/ask/batch)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+BATCH_GENERATE_CONCURRENCY = int(os.getenv("BATCH_GENERATE_CONCURRENCY", "8"))
+
+# Incremental FAQ ingestion (ingest.py) and the local index file it can write
+INGEST_SOURCE_URI = os.getenv(
+    "INGEST_SOURCE_URI", "gs://labs.roitraining.com/alaska-dept-of-snow/alaska-dept-of-snow-faqs.csv"
+)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "250"))
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "")
+# Precision of embedding store directories: float32, float16 or int8 (per-row scales)
+VECTOR_STORE_PRECISION = os.getenv("VECTOR_STORE_PRECISION", "int8")
+
+# Evaluation runs: parallel generation, checkpointed so interrupted runs resume
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "8"))
+EVAL_CHECKPOINT_PATH = os.getenv("EVAL_CHECKPOINT_PATH", "eval_checkpoint.jsonl")
+
+# Local prompt screening in front of the Gemini validator. Rule weights are
+# summed; clearly unsafe prompts are blocked without the model call. Nothing
+# is approved locally.
+PROMPT_SCREEN_ENABLED = os.getenv("PROMPT_SCREEN_ENABLED", "true").lower() == "true"
+PROMPT_SCREEN_BLOCK_THRESHOLD = float(os.getenv("PROMPT_SCREEN_BLOCK_THRESHOLD", "1.0"))
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "4096"))
+VERDICT_CACHE_TTL_SECONDS = float(os.getenv("VERDICT_CACHE_TTL_SECONDS", "3600"))
+
 # Safety settings for prompt validation
 SAFETY_SETTINGS = {
     'HARM_CATEGORY_HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE',
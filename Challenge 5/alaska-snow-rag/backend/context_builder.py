@@ -0,0 +1,69 @@
+"""
+Token-budgeted context assembly for the Alaska FAQ RAG system
+"""
+
+import re
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+
+_WORD = re.compile(r"\w+")
+
+# Gemini tokenizers average roughly four characters of English per token
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Cheap token estimate used for budgeting prompts"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def _word_set(text):
+    return set(_WORD.findall(text.lower()))
+
+def _overlap(words_a, words_b):
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+def assemble_context(passages, token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """
+    Pack retrieved passages into a prompt context
+
+    Passages are taken best score first. A passage whose word overlap with an
+    already chosen one reaches dedup_threshold is dropped, as is any passage
+    that would push the context past token_budget. The best passage is always
+    kept, truncated if it alone exceeds the budget.
+
+    Args:
+        passages: (content, score) tuples
+
+    Returns:
+        str: passages separated by blank lines, or None when nothing was retrieved
+    """
+    chosen = []
+    chosen_words = []
+    used_tokens = 0
+
+    for content, score in sorted(passages, key=lambda passage: passage[1], reverse=True):
+        content = content.strip()
+        if not content:
+            continue
+
+        words = _word_set(content)
+        if any(_overlap(words, seen) >= dedup_threshold for seen in chosen_words):
+            continue
+
+        tokens = estimate_tokens(content)
+
+        if not chosen and tokens > token_budget:
+            chosen.append(content[:token_budget * CHARS_PER_TOKEN])
+            break
+
+        if used_tokens + tokens > token_budget:
+            continue
+
+        chosen.append(content)
+        chosen_words.append(words)
+        used_tokens += tokens
+
+    if not chosen:
+        return None
+
+    return "\n\n".join(chosen)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Direct answers for questions that match an FAQ entry almost word for word
+
+The knowledge base rows are question/answer pairs ("Question: ... Answer: ..."),
+so a user who types an FAQ question gets its stored answer straight away,
+without retrieval or generation. Questions are compared after normalization:
+an exact match is a dictionary lookup, otherwise the few FAQ questions
+sharing the most terms are scored by character similarity. Character
+similarity alone would equate "main roads" with "side roads", so a candidate
+also has to use the same terms, give or take a typo or plural, and exactly
+the same stopwords: "where" and "when" change the question. Run this module
+to measure how much of a question log the fast path would cover.
+"""
+
+import argparse
+import difflib
+import json
+import re
+from collections import Counter
+from cache import normalize_question
+from config import DIRECT_ANSWER_THRESHOLD
+from knowledge_base import active_knowledge_base
+from lexical_index import tokenize, contents_sql, STOPWORDS
+
+# Content layout written by Dataset.sql and ingest.faq_content
+_FAQ_CONTENT = re.compile(r"^\s*Question:\s*(.*?)\s+Answer:\s*(.*)$", re.S)
+
+# FAQ questions scored per lookup, by number of shared terms
+CANDIDATES = 8
+
+# Character similarity at which two terms count as the same word ("road"/"roads")
+TERM_SIMILARITY = 0.8
+
+def parse_faq_content(content):
+    """Split a "Question: ... Answer: ..." row; None for rows in any other layout"""
+    match = _FAQ_CONTENT.match(content)
+    if match is None or not match.group(1) or not match.group(2):
+        return None
+    return match.group(1), match.group(2).strip()
+
+def _similarity(a, b):
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+def _has_counterpart(term, terms):
+    # Question words and other stopwords only count when identical
+    if term in STOPWORDS:
+        return False
+    return any(_similarity(term, other) >= TERM_SIMILARITY for other in terms)
+
+def terms_align(terms, other_terms):
+    """
+    Whether every term on either side has an identical term on the other,
+    or a near-identical one for terms that are not stopwords
+    """
+    return (
+        all(_has_counterpart(term, other_terms) for term in terms - other_terms)
+        and all(_has_counterpart(term, terms) for term in other_terms - terms)
+    )
+
+class DirectAnswerIndex:
+    """Normalized FAQ questions -> stored answers"""
+
+    def __init__(self, contents, threshold=DIRECT_ANSWER_THRESHOLD):
+        self.threshold = threshold
+        # (normalized question, all terms including stopwords, original question, answer)
+        self.entries = []
+        self.by_question = {}
+        # term -> entry positions
+        self.postings = {}
+
+        for content in contents:
+            parsed = parse_faq_content(content)
+            if parsed is None:
+                continue
+
+            question, answer = parsed
+            key = normalize_question(question)
+            if key in self.by_question:
+                continue
+
+            position = len(self.entries)
+            self.entries.append((key, frozenset(tokenize(key, keep_stopwords=True)), question, answer))
+            self.by_question[key] = position
+            for term in tokenize(key):
+                self.postings.setdefault(term, []).append(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        """Rough size: the stored text plus postings"""
+        text = sum(len(key) + len(question) + len(answer) for key, _, question, answer in self.entries)
+        return text + 8 * sum(len(positions) for positions in self.postings.values())
+
+    def best_match(self, question):
+        """
+        The most similar FAQ entry whose terms align with the question's
+
+        Returns:
+            tuple: (faq question, answer, similarity in [0, 1]), or None
+        """
+        key = normalize_question(question)
+        position = self.by_question.get(key)
+        if position is not None:
+            _, _, faq_question, answer = self.entries[position]
+            return faq_question, answer, 1.0
+
+        shared = Counter()
+        for term in tokenize(key):
+            shared.update(self.postings.get(term, ()))
+
+        terms = frozenset(tokenize(key, keep_stopwords=True))
+        best = None
+        for position, _ in shared.most_common(CANDIDATES):
+            faq_key, faq_terms, faq_question, answer = self.entries[position]
+            if not terms_align(terms, faq_terms):
+                continue
+            score = _similarity(key, faq_key)
+            if best is None or score > best[2]:
+                best = (faq_question, answer, score)
+        return best
+
+    def match(self, question, threshold=None):
+        """The stored answer when the question matches an FAQ question closely enough, else None"""
+        best = self.best_match(question)
+        if best is None or best[2] < (self.threshold if threshold is None else threshold):
+            return None
+        return best[1]
+
+def load_direct_answer_index(bq_client, loaded_index=None, kb=None):
+    """
+    Build the direct answer index over a knowledge base's live FAQ rows (the active one by default)
+
+    Reuses the contents of an already loaded vector or lexical index; otherwise
+    reads them from BigQuery. Returns None if the contents cannot be read or
+    no row has the question/answer layout.
+    """
+    kb = kb or active_knowledge_base()
+    try:
+        if loaded_index is not None:
+            contents = loaded_index.contents
+        else:
+            contents = [row.content for row in bq_client.query_and_wait(contents_sql(kb))]
+
+        index = DirectAnswerIndex(contents)
+        if not len(index):
+            print("⚠️ No question/answer rows found; direct answers disabled")
+            return None
+        print(f"✅ Direct answer index built: {len(index)} FAQ questions")
+        return index
+
+    except Exception as e:
+        print(f"❌ Direct answer index build failed, answering every question through the pipeline: {e}")
+        return None
+
+def read_questions(path):
+    """
+    Questions from a log: one per line, or JSON lines with a "question" field
+
+    JSON lines without a question (e.g. other record types) are skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                question = json.loads(line).get("question")
+                if question:
+                    yield question
+            else:
+                yield line
+
+def coverage(index, questions, thresholds=(0.8, 0.85, 0.9, 0.95, 1.0)):
+    """
+    Share of questions the fast path would answer at each threshold
+
+    Returns:
+        dict: questions seen, and per threshold the number and share covered
+    """
+    scores = [best[2] if best is not None else 0.0 for best in map(index.best_match, questions)]
+    return {
+        "questions": len(scores),
+        "thresholds": {
+            threshold: {
+                "covered": sum(score >= threshold for score in scores),
+                "share": round(sum(score >= threshold for score in scores) / len(scores), 4) if scores else 0.0,
+            }
+            for threshold in thresholds
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how much of a question log direct FAQ answers would cover")
+    parser.add_argument("questions", help="question log: one per line, or JSON lines with a \"question\" field")
+    parser.add_argument("--index-file", help="float32 .npz index written by ingest.py (default: read BigQuery)")
+    parser.add_argument("--local", action="store_true", help="use the sample FAQ rows of the local BigQuery stand-in")
+    parser.add_argument("--thresholds", default="0.8,0.85,0.9,0.95,1.0", help="comma-separated similarities")
+    args = parser.parse_args()
+
+    if args.index_file:
+        from vector_index import VectorIndex
+        index = load_direct_answer_index(None, VectorIndex.load(args.index_file))
+    elif args.local:
+        from local_backends import LocalBigQueryClient
+        index = load_direct_answer_index(LocalBigQueryClient())
+    else:
+        from google_sdk import bigquery
+        from config import PROJECT_ID
+        index = load_direct_answer_index(bigquery.Client(project=PROJECT_ID))
+
+    if index is None:
+        raise SystemExit(1)
+
+    thresholds = [float(threshold) for threshold in args.thresholds.split(",")]
+    report = coverage(index, list(read_questions(args.questions)), thresholds)
+
+    print(f"🚀 {report['questions']} questions against {len(index)} FAQ questions "
+          f"(serving threshold {DIRECT_ANSWER_THRESHOLD})\n")
+    print(f"   {'threshold':<10} {'covered':>8} {'share':>8}")
+    for threshold, row in report["thresholds"].items():
+        print(f"   {threshold:<10} {row['covered']:>8} {row['share']:>8.1%}")
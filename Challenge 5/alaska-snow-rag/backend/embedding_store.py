@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Quantized, memory-mapped embedding store for the Alaska FAQ knowledge base
+
+A store is a directory of plain files, reached through a symlink to its
+current version (.<name>.version-*) so a rewrite is swapped in atomically:
+
+    meta.json     format version, precision, row count, dimensions
+    vectors.npy   unit-length embeddings as float32, float16 or int8
+    scales.npy    per-row float32 scale (int8 only): vector = int8 * scale
+    offsets.npy   int64 byte offsets of each row's content (rows + 1 entries)
+    content.bin   UTF-8 contents, concatenated
+
+Serving processes map every file read-only, so uvicorn workers on one host
+share the same pages instead of each holding a float32 copy. Run this module
+to measure recall@k of each precision against exact float32 search.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import numpy as np
+from vector_index import TopKSearch, VectorIndex
+
+STORE_FORMAT = 1
+PRECISIONS = ("float32", "float16", "int8")
+
+# Rows dequantized per block while scoring, bounding the temporary float32 copy
+SCORE_BLOCK_ROWS = 4096
+
+def _normalize(embeddings):
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize(matrix, precision):
+    """
+    Quantize unit-length rows
+
+    Returns:
+        tuple: (vectors, scales) where scales is None except for int8
+    """
+    if precision == "float32":
+        return matrix.astype(np.float32), None
+    if precision == "float16":
+        return matrix.astype(np.float16), None
+    if precision == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        vectors = np.round(matrix / scales[:, None]).astype(np.int8)
+        return vectors, scales.astype(np.float32)
+    raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}")
+
+def write_embedding_store(path, contents, embeddings, precision="int8"):
+    """
+    Write a store directory, replacing any existing store at path
+
+    The files are written to a new sibling version directory, then path, a
+    symlink, is pointed at it with one atomic os.replace: readers see either
+    the old store or the new one, never a partial or missing store. The
+    version just replaced is kept for readers still opening it and removed
+    on the next write; processes that already mapped its files keep them
+    until they reload.
+    """
+    if len(contents):
+        matrix = _normalize(embeddings).reshape(len(contents), -1)
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    vectors, scales = quantize(matrix, precision)
+
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    version_prefix = f".{name}.version-"
+    staging = tempfile.mkdtemp(prefix=version_prefix, dir=parent)
+
+    encoded = [content.encode("utf-8") for content in contents]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(blob) for blob in encoded])
+
+    np.save(os.path.join(staging, "vectors.npy"), vectors)
+    np.save(os.path.join(staging, "offsets.npy"), offsets)
+    if scales is not None:
+        np.save(os.path.join(staging, "scales.npy"), scales)
+    with open(os.path.join(staging, "content.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump({
+            "format": STORE_FORMAT,
+            "precision": precision,
+            "rows": len(contents),
+            "dimensions": int(matrix.shape[1]),
+        }, f)
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and previous is None:
+        # A store written before versioning is a plain directory, which a
+        # symlink cannot replace: move it aside first (a brief gap, once)
+        previous = tempfile.mkdtemp(prefix=version_prefix, dir=parent)
+        os.rmdir(previous)
+        os.rename(path, previous)
+
+    link = os.path.join(parent, f".{name}.link-{os.getpid()}-{time.monotonic_ns()}")
+    os.symlink(os.path.basename(staging), link)
+    os.replace(link, path)
+
+    for entry in os.listdir(parent):
+        version = os.path.join(parent, entry)
+        if entry.startswith(version_prefix) and version not in (staging, previous):
+            shutil.rmtree(version, ignore_errors=True)
+
+class StoreContents:
+    """Read-only sequence of contents decoded from the mapped blob on access"""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("content index out of range")
+        i %= len(self)
+        return self._blob[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+class EmbeddingStore(TopKSearch):
+    """Memory-mapped store answering the same top-k queries as VectorIndex"""
+
+    def __init__(self, path):
+        # Resolve the symlink once, so every file comes from the same version
+        # even if a new one is swapped in while loading
+        path = os.path.realpath(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["format"] != STORE_FORMAT:
+            raise ValueError(f"Unsupported embedding store format {meta['format']}")
+
+        self.path = path
+        self.precision = meta["precision"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.scales = (
+            np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+            if self.precision == "int8" else None
+        )
+
+        with open(os.path.join(path, "content.bin"), "rb") as f:
+            # mmap cannot map an empty file
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+        self.contents = StoreContents(self._blob, self.offsets)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dimensions(self):
+        return self.vectors.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes of vectors, scales, offsets and contents on disk"""
+        total = self.vectors.nbytes + self.offsets.nbytes + len(self._blob)
+        return total + (self.scales.nbytes if self.scales is not None else 0)
+
+    def score(self, queries):
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block = slice(start, start + SCORE_BLOCK_ROWS)
+            scores[:, block] = queries @ np.asarray(self.vectors[block], dtype=np.float32).T
+            if self.scales is not None:
+                scores[:, block] *= self.scales[block]
+
+        return scores
+
+def sample_queries(matrix, count, noise, seed=0):
+    """Perturbed copies of random rows, standing in for real question embeddings"""
+    rng = np.random.default_rng(seed)
+    rows = matrix[rng.integers(0, len(matrix), size=count)]
+    return rows + rng.normal(0.0, noise / np.sqrt(matrix.shape[1]), size=rows.shape).astype(np.float32)
+
+def recall_at_k(exact_index, candidate_index, queries, top_k):
+    """Mean share of the exact top-k rows that the candidate index also returns"""
+    exact = exact_index.rank_batch(queries, top_k)
+    candidate = candidate_index.rank_batch(queries, top_k)
+
+    hits = [
+        len({i for i, _ in want} & {i for i, _ in got}) / len(want)
+        for want, got in zip(exact, candidate) if want
+    ]
+    return sum(hits) / len(hits) if hits else 1.0
+
+def compare_precisions(contents, embeddings, queries=200, top_k=4, noise=0.5, precisions=PRECISIONS):
+    """
+    Build a store at each precision and measure it against exact float32 search
+
+    Returns:
+        list: one dict per precision with recall@k, bytes on disk and median search time
+    """
+    exact_index = VectorIndex(contents, embeddings)
+    query_matrix = sample_queries(exact_index.matrix, queries, noise)
+    results = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for precision in precisions:
+            path = os.path.join(workdir, precision)
+            write_embedding_store(path, contents, embeddings, precision)
+            store = EmbeddingStore(path)
+
+            timings = []
+            for query in query_matrix[:50]:
+                start = time.perf_counter()
+                store.search(query, top_k)
+                timings.append(time.perf_counter() - start)
+
+            results.append({
+                "precision": precision,
+                "recall_at_k": round(recall_at_k(exact_index, store, query_matrix, top_k), 4),
+                "bytes": store.nbytes,
+                "search_ms": round(statistics.median(timings) * 1000, 3),
+            })
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure embedding store recall against exact float32 search")
+    parser.add_argument("--index-file", help="float32 .npz index written by ingest.py (default: snapshot BigQuery)")
+    parser.add_argument("--queries", type=int, default=200, help="perturbed corpus rows used as queries")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--noise", type=float, default=0.5, help="query perturbation relative to a unit vector")
+    args = parser.parse_args()
+
+    if args.index_file:
+        source = VectorIndex.load(args.index_file)
+    else:
+        from google_sdk import bigquery
+        from config import PROJECT_ID
+        from vector_index import snapshot_vector_index
+        source = snapshot_vector_index(bigquery.Client(project=PROJECT_ID))
+
+    print(f"🚀 Comparing precisions over {len(source)} rows, {args.queries} queries, k={args.top_k}...\n")
+    print(f"   {'precision':<10} {'recall@k':>9} {'MB':>9} {'search ms':>10}")
+    for row in compare_precisions(source.contents, source.matrix, args.queries, args.top_k, args.noise):
+        print(f"   {row['precision']:<10} {row['recall_at_k']:>9} {row['bytes'] / 1e6:>9.2f} {row['search_ms']:>10}")
@@ -1,30 +1,43 @@
 """
 Google Evaluation Service for Alaska FAQ RAG system
 Evaluates the quality of real RAG responses
+
+Clients are built once per run and responses are generated in parallel.
+Finished rows are appended to a checkpoint file, so an interrupted run
+resumes where it stopped, and each row records its latency so every run
+doubles as a performance report.
 """
 
 import os
+import json
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-import vertexai
-from vertexai.evaluation import EvalTask, MetricPromptTemplateExamples
-from google.cloud import aiplatform
 
 # Import our RAG system
-from rag_system import initialize_services, search_knowledge_base, generate_response
+from rag_system import initialize_services, search_knowledge_base, generate_response, GENERATION_ERROR_MESSAGE
 from prompt_validator import initialize_validator, validate_prompt
 from test_data import EVALUATION_QUESTIONS, ALASKA_SYSTEM_PROMPT, MOCK_FAQ_CONTENT
-from config import PROJECT_ID
+from config import PROJECT_ID, EVAL_CONCURRENCY, EVAL_CHECKPOINT_PATH
+from google_sdk import lazy_import
+from metrics import percentile
+
+# Vertex AI is only needed by the full evaluation, not for generating responses
+vertexai = lazy_import("vertexai")
+vertexai_evaluation = lazy_import("vertexai.evaluation")
 
-# Initialize Vertex AI
-vertexai.init(project=PROJECT_ID, location="us-central1")
+def build_clients():
+    """Initialize BigQuery, Gemini and the validator once for a whole run"""
+    bq_client, genai_model = initialize_services()
+    validator_model = initialize_validator()
+    return bq_client, genai_model, validator_model
 
-def generate_rag_response(question):
+def generate_rag_response(question, clients=None):
     """Generate actual RAG response for evaluation"""
     try:
-        # Initialize services
-        bq_client, genai_model = initialize_services()
-        validator_model = initialize_validator()
+        # Initialize services unless the run already did
+        bq_client, genai_model, validator_model = clients or build_clients()
         
         if not all([bq_client, genai_model, validator_model]):
             return "Error: Failed to initialize services"
@@ -46,16 +59,117 @@ def generate_rag_response(question):
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
-def create_evaluation_dataset():
+def is_failed_response(response):
+    """Whether a response reports a pipeline failure rather than an answer"""
+    return response.startswith("Error") or response == GENERATION_ERROR_MESSAGE
+
+def load_checkpoint(checkpoint_path):
+    """Read rows finished by an earlier run, keyed on question"""
+    rows = {}
+    
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return rows
+    
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            rows[row["question"]] = row
+    
+    return rows
+
+def evaluate_question(clients, item):
+    """Generate one response, timing it"""
+    start = time.perf_counter()
+    response = generate_rag_response(item["question"], clients)
+    
+    return {
+        "question": item["question"],
+        "response": response,
+        "latency_seconds": round(time.perf_counter() - start, 3),
+    }
+
+def generate_responses(questions, clients, concurrency=EVAL_CONCURRENCY, checkpoint_path=EVAL_CHECKPOINT_PATH):
+    """
+    Generate responses for evaluation questions with bounded parallelism
+    
+    Questions already in the checkpoint are skipped. Each successful row is
+    appended to the checkpoint as soon as it finishes; failed rows are not,
+    so they are retried by the next run.
+    
+    Returns:
+        list: rows aligned with questions
+    """
+    finished = load_checkpoint(checkpoint_path)
+    pending = [item for item in questions if item["question"] not in finished]
+    
+    print(f"📊 {len(questions) - len(pending)} responses from checkpoint, {len(pending)} to generate...")
+    
+    checkpoint = open(checkpoint_path, "a") if checkpoint_path else None
+    
+    # Start appending on a fresh line after a partial line from a killed run
+    if checkpoint is not None and checkpoint.tell() > 0:
+        with open(checkpoint_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                checkpoint.write("\n")
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(evaluate_question, clients, item) for item in pending]
+            
+            for future in as_completed(futures):
+                row = future.result()
+                finished[row["question"]] = row
+                
+                if is_failed_response(row["response"]):
+                    print(f"⚠️ Failed: {row['question'][:50]}... ({row['response'][:80]})")
+                    continue
+                
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(row) + "\n")
+                    checkpoint.flush()
+                
+                print(f"✅ Generated response for: {row['question'][:50]}... ({row['latency_seconds']:.2f}s)")
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    
+    return [finished[item["question"]] for item in questions]
+
+def latency_summary(rows):
+    """Per-question latency percentiles for a run"""
+    latencies = [row["latency_seconds"] for row in rows]
+    
+    if not latencies:
+        return {}
+    
+    return {
+        "questions": len(latencies),
+        "failed": sum(is_failed_response(row["response"]) for row in rows),
+        "p50_seconds": percentile(latencies, 0.50),
+        "p95_seconds": percentile(latencies, 0.95),
+        "max_seconds": max(latencies),
+    }
+
+def print_latency_summary(summary):
+    """Print a run's latency percentiles"""
+    print(f"\n⏱️ Latency over {summary['questions']} questions ({summary['failed']} failed): "
+          f"p50 {summary['p50_seconds']:.2f}s, p95 {summary['p95_seconds']:.2f}s, max {summary['max_seconds']:.2f}s")
+
+def create_evaluation_dataset(concurrency=EVAL_CONCURRENCY, checkpoint_path=EVAL_CHECKPOINT_PATH):
     """Create evaluation dataset with real RAG responses"""
     print("📊 Creating evaluation dataset...")
     
+    clients = build_clients()
+    rows = generate_responses(EVALUATION_QUESTIONS, clients, concurrency, checkpoint_path)
+    
     eval_data = []
     
-    for item in EVALUATION_QUESTIONS:
-        # Generate actual RAG response
-        rag_response = generate_rag_response(item["question"])
-        
+    for item, row in zip(EVALUATION_QUESTIONS, rows):
         # For evaluation, we'll use mock context since we can't guarantee BigQuery results
         # In production, this would use actual retrieved context
         context = MOCK_FAQ_CONTENT.get(item["context_key"], "No context found")
@@ -63,36 +177,59 @@ def create_evaluation_dataset():
         eval_data.append({
             "instruction": ALASKA_SYSTEM_PROMPT,
             "context": f"Question: {item['question']}\nRetrieved Information: {context}",
-            "response": rag_response,
-            "reference": item["reference_answer"]
+            "response": row["response"],
+            "reference": item["reference_answer"],
+            "question": item["question"],
+            "latency_seconds": row["latency_seconds"]
         })
-        
-        print(f"✅ Generated response for: {item['question'][:50]}...")
     
     return pd.DataFrame(eval_data)
 
-def run_evaluation():
+def write_report(run_timestamp, summary_metrics, eval_dataset):
+    """Save quality metrics and per-question latency for comparing runs"""
+    report_path = f"eval_report_{run_timestamp}.json"
+    rows = eval_dataset.to_dict("records")
+    
+    with open(report_path, "w") as f:
+        json.dump({
+            "run": run_timestamp,
+            "quality": summary_metrics,
+            "latency": latency_summary(rows),
+            "questions": [
+                {"question": row["question"], "latency_seconds": row["latency_seconds"]}
+                for row in rows
+            ]
+        }, f, indent=2, default=float)
+    
+    print(f"\n📝 Report written to {report_path}")
+
+def run_evaluation(concurrency=EVAL_CONCURRENCY, checkpoint_path=EVAL_CHECKPOINT_PATH):
     """Run Google Evaluation Service on RAG responses"""
     print("\n🚀 Starting Alaska FAQ RAG Evaluation\n")
     
     # Create evaluation dataset
-    eval_dataset = create_evaluation_dataset()
+    eval_dataset = create_evaluation_dataset(concurrency, checkpoint_path)
     
     # Dataset shape
     print(f"📝 Dataset shape: {eval_dataset.shape}")
+    print_latency_summary(latency_summary(eval_dataset.to_dict("records")))
+    
+    # Initialize Vertex AI
+    vertexai.init(project=PROJECT_ID, location="us-central1")
     
     # Create timestamp for this run
     run_timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
     
     # Create evaluation task
     print("\n📐 Setting up evaluation metrics...")
-    eval_task = EvalTask(
+    templates = vertexai_evaluation.MetricPromptTemplateExamples.Pointwise
+    eval_task = vertexai_evaluation.EvalTask(
         dataset=eval_dataset,
         metrics=[
-            MetricPromptTemplateExamples.Pointwise.GROUNDEDNESS,
-            MetricPromptTemplateExamples.Pointwise.INSTRUCTION_FOLLOWING,
-            MetricPromptTemplateExamples.Pointwise.SAFETY,
-            MetricPromptTemplateExamples.Pointwise.SUMMARIZATION_QUALITY
+            templates.GROUNDEDNESS,
+            templates.INSTRUCTION_FOLLOWING,
+            templates.SAFETY,
+            templates.SUMMARIZATION_QUALITY
         ],
         experiment=f"alaska-faq-rag-evaluation-{run_timestamp}"
     )
@@ -110,9 +247,15 @@ def run_evaluation():
         print(f"{'='*60}")
         
         # Display results
-        if hasattr(result, 'summary_metrics'):
-            for metric, value in result.summary_metrics.items():
-                print(f"{metric}: {value:.3f}")
+        summary_metrics = getattr(result, 'summary_metrics', {})
+        for metric, value in summary_metrics.items():
+            print(f"{metric}: {value:.3f}")
+        
+        write_report(run_timestamp, summary_metrics, eval_dataset)
+        
+        # The run is complete; the next one starts fresh
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
 
     except Exception as e:
         print(f"\n❌ Evaluation error: {str(e)}")
@@ -125,27 +268,42 @@ def run_quick_evaluation():
     """Run a quick evaluation without Google Evaluation Service"""
     print("\n🚀 Running Quick Local Evaluation\n")
     
+    questions = EVALUATION_QUESTIONS[:3]  # Test first 3 questions
+    rows = generate_responses(questions, build_clients(), checkpoint_path=None)
+    
     results = []
-    for item in EVALUATION_QUESTIONS[:3]:  # Test first 3 questions
+    for item, row in zip(questions, rows):
         print(f"\n{'='*60}")
         print(f"❓ Question: {item['question']}")
-        
-        response = generate_rag_response(item['question'])
-        print(f"🤖 RAG Response: {response[:200]}...")
+        print(f"🤖 RAG Response: {row['response'][:200]}...")
         print(f"📚 Reference: {item['reference_answer'][:200]}...")
         
         results.append({
             "question": item['question'],
-            "rag_response": response,
-            "reference": item['reference_answer']
+            "rag_response": row['response'],
+            "reference": item['reference_answer'],
+            "latency_seconds": row['latency_seconds']
         })
+    
+    print_latency_summary(latency_summary(rows))
+    return results
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Evaluate the Alaska FAQ RAG system")
+    parser.add_argument("--quick", action="store_true", help="quick local evaluation without Google Evaluation Service")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY, help="responses generated in parallel")
+    parser.add_argument("--checkpoint", default=EVAL_CHECKPOINT_PATH, help="file that finished rows are appended to")
+    parser.add_argument("--fresh", action="store_true", help="discard the checkpoint from an interrupted run")
+    args = parser.parse_args()
+    
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
     
-    if len(sys.argv) > 1 and sys.argv[1] == "--quick":
+    if args.quick:
         # Run quick evaluation without Google Evaluation Service
         run_quick_evaluation()
     else:
         # Run full evaluation with Google Evaluation Service
-        run_evaluation()
\ No newline at end of file
+        run_evaluation(args.concurrency, args.checkpoint)
\ No newline at end of file
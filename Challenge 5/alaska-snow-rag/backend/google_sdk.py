@@ -0,0 +1,57 @@
+"""
+Lazily imported Google SDK modules shared by the backend
+
+Importing google.cloud.bigquery and google.generativeai takes a large share of
+cold-start time. The modules below are only imported on first attribute
+access, so importing the API is cheap and the SDKs load in whichever startup
+thread first uses them.
+"""
+
+import importlib
+import sys
+import threading
+from config import GEMINI_API_KEY
+
+class LazyModule:
+    """
+    Module proxy that imports the real module on first attribute access
+
+    importlib.util.LazyLoader is not thread-safe before Python 3.12: threads
+    touching a half-loaded module see missing attributes. The import here
+    runs under a lock, so concurrent first uses are safe.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return getattr(module, attribute)
+
+def lazy_import(name):
+    """Return a module that is imported on first attribute access"""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+bigquery = lazy_import("google.cloud.bigquery")
+genai = lazy_import("google.generativeai")
+
+_genai_configured = False
+_genai_lock = threading.Lock()
+
+def configure_genai():
+    """Configure the Gemini SDK once per process"""
+    global _genai_configured
+
+    with _genai_lock:
+        if not _genai_configured:
+            genai.configure(api_key=GEMINI_API_KEY)
+            _genai_configured = True
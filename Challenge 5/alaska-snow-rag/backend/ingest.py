@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Incremental ingestion of the Alaska FAQ CSV into the embedded FAQ table
+
+Replaces the one-shot Dataset.sql rebuild. The source CSV is streamed and
+each row's content is hashed; only new or changed rows are embedded, in
+batches, and merged into the table. Rows that disappeared from the source
+are tombstoned (deleted = TRUE) rather than dropped. Reports rows and
+seconds per stage, and can write the live rows to a local index for the
+serving process (VECTOR_INDEX_PATH): a quantized, memory-mapped embedding
+store directory, or a float32 .npz file.
+"""
+
+import argparse
+import csv
+import functools
+import hashlib
+import io
+import time
+import urllib.request
+from types import SimpleNamespace
+from google_sdk import bigquery
+from config import (
+    PROJECT_ID, INGEST_SOURCE_URI, INGEST_BATCH_SIZE, VECTOR_STORE_PRECISION
+)
+from rag_system import run_query
+from vector_index import snapshot_vector_index
+from embedding_store import write_embedding_store
+from knowledge_base import get_knowledge_base, active_knowledge_base, table_columns
+
+@functools.lru_cache(maxsize=None)
+def ingest_sql(kb):
+    """Ingestion statements for one knowledge base's embedded FAQ table"""
+    table = kb.table_ref
+    return SimpleNamespace(
+        # Creates the table on first use and adds the ingestion columns to a table
+        # built by Dataset.sql; existing rows get their keys and hashes backfilled so
+        # they are not re-embedded.
+        ensure_table=f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                row_id STRING,
+                content_hash STRING,
+                question STRING,
+                answer STRING,
+                content STRING,
+                ml_generate_embedding_result ARRAY<FLOAT64>,
+                ml_generate_embedding_status STRING,
+                deleted BOOL,
+                updated_at TIMESTAMP
+            );
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS row_id STRING,
+                ADD COLUMN IF NOT EXISTS content_hash STRING,
+                ADD COLUMN IF NOT EXISTS deleted BOOL,
+                ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+            UPDATE {table}
+            SET
+                row_id = TO_HEX(SHA256(TRIM(question))),
+                content_hash = TO_HEX(SHA256(content)),
+                deleted = FALSE,
+                updated_at = CURRENT_TIMESTAMP()
+            WHERE
+                row_id IS NULL;
+            """,
+
+        existing_rows=f"""
+            SELECT
+                row_id,
+                content_hash
+            FROM
+                {table}
+            WHERE
+                deleted IS NOT TRUE
+                AND ARRAY_LENGTH(ml_generate_embedding_result) > 0;
+            """,
+
+        # The same keys and hashes for a table ensure_table has not migrated yet,
+        # computed the way it backfills them (for --dry-run, which leaves the table alone)
+        existing_rows_unmigrated=f"""
+            SELECT
+                TO_HEX(SHA256(TRIM(question))) AS row_id,
+                TO_HEX(SHA256(content)) AS content_hash
+            FROM
+                {table}
+            WHERE
+                ARRAY_LENGTH(ml_generate_embedding_result) > 0;
+            """,
+
+        embed_rows=f"""
+            SELECT
+                row_id,
+                ml_generate_embedding_result,
+                ml_generate_embedding_status
+            FROM
+                ML.GENERATE_EMBEDDING(
+                    MODEL `{kb.embedding_model}`,
+                    (SELECT row_id, content FROM UNNEST(@rows))
+                );
+            """,
+
+        upsert_rows=f"""
+            MERGE {table} AS target
+            USING UNNEST(@rows) AS source
+            ON target.row_id = source.row_id
+            WHEN MATCHED THEN UPDATE SET
+                content_hash = source.content_hash,
+                question = source.question,
+                answer = source.answer,
+                content = source.content,
+                ml_generate_embedding_result = source.embedding,
+                ml_generate_embedding_status = '',
+                deleted = FALSE,
+                updated_at = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT
+                (row_id, content_hash, question, answer, content,
+                 ml_generate_embedding_result, ml_generate_embedding_status, deleted, updated_at)
+            VALUES
+                (source.row_id, source.content_hash, source.question, source.answer, source.content,
+                 source.embedding, '', FALSE, CURRENT_TIMESTAMP());
+            """,
+
+        tombstone_rows=f"""
+            UPDATE {table}
+            SET
+                deleted = TRUE,
+                updated_at = CURRENT_TIMESTAMP()
+            WHERE
+                row_id IN UNNEST(@row_ids);
+            """,
+    )
+
+def faq_content(question, answer):
+    """The text that is embedded for an FAQ row, as in Dataset.sql"""
+    return f"Question: {question} Answer: {answer}"
+
+def faq_row_id(question):
+    """Stable row key: an edited answer updates the row, an edited question replaces it"""
+    return hashlib.sha256(question.strip().encode("utf-8")).hexdigest()
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def open_source(uri):
+    """Open a local path, http(s) URL or public gs:// object as a text stream"""
+    if uri.startswith("gs://"):
+        uri = "https://storage.googleapis.com/" + uri[len("gs://"):]
+
+    if uri.startswith(("http://", "https://")):
+        return io.TextIOWrapper(urllib.request.urlopen(uri), encoding="utf-8", newline="")
+
+    return open(uri, encoding="utf-8", newline="")
+
+def read_faq_rows(stream):
+    """
+    Yield FAQ rows from a question,answer CSV, one at a time
+
+    A header row is skipped if present.
+    """
+    for i, record in enumerate(csv.reader(stream)):
+        if len(record) < 2:
+            continue
+
+        question, answer = record[0].strip(), record[1].strip()
+        if i == 0 and (question.lower(), answer.lower()) == ("question", "answer"):
+            continue
+        if not question:
+            continue
+
+        content = faq_content(question, answer)
+        yield {
+            "row_id": faq_row_id(question),
+            "content_hash": content_hash(content),
+            "question": question,
+            "answer": answer,
+            "content": content,
+        }
+
+def _struct(values):
+    fields = []
+    for name, value in values.items():
+        if isinstance(value, list):
+            fields.append(bigquery.ArrayQueryParameter(name, "FLOAT64", value))
+        else:
+            fields.append(bigquery.ScalarQueryParameter(name, "STRING", value))
+    return bigquery.StructQueryParameter(None, *fields)
+
+def _rows_parameter(rows):
+    return bigquery.ArrayQueryParameter("rows", "STRUCT", [_struct(row) for row in rows])
+
+class IngestionReport:
+    """Rows and seconds per ingestion stage"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, rows, seconds):
+        entry = self.stages.setdefault(stage, {"rows": 0, "seconds": 0.0})
+        entry["rows"] += rows
+        entry["seconds"] += seconds
+
+    def count(self, stage):
+        return self.stages.get(stage, {}).get("rows", 0)
+
+    def print(self):
+        print(f"\n{'='*60}")
+        print(f"   {'stage':<12} {'rows':>8} {'seconds':>9}")
+        for stage, entry in self.stages.items():
+            print(f"   {stage:<12} {entry['rows']:>8} {entry['seconds']:>9.2f}")
+
+def embed_rows(bq_client, rows, report, kb=None):
+    """Embed a batch of rows; returns {row_id: embedding} for the rows that succeeded"""
+    start = time.perf_counter()
+    results = run_query(
+        bq_client,
+        ingest_sql(kb or active_knowledge_base()).embed_rows,
+        [_rows_parameter([{"row_id": row["row_id"], "content": row["content"]} for row in rows])]
+    )
+
+    embeddings = {}
+    for result in results:
+        if getattr(result, "ml_generate_embedding_status", "") or not result.ml_generate_embedding_result:
+            print(f"⚠️ Embedding failed for row {result.row_id}: {result.ml_generate_embedding_status}")
+            continue
+        embeddings[result.row_id] = list(result.ml_generate_embedding_result)
+
+    report.add("embed", len(embeddings), time.perf_counter() - start)
+    report.add("embed_failed", len(rows) - len(embeddings), 0.0)
+    return embeddings
+
+def upsert_rows(bq_client, rows, embeddings, report, kb=None):
+    """Merge embedded rows into the table, reviving any that were tombstoned"""
+    merged = [dict(row, embedding=embeddings[row["row_id"]]) for row in rows if row["row_id"] in embeddings]
+    if not merged:
+        return
+
+    start = time.perf_counter()
+    run_query(bq_client, ingest_sql(kb or active_knowledge_base()).upsert_rows, [_rows_parameter(merged)])
+    report.add("upsert", len(merged), time.perf_counter() - start)
+
+def write_index(index, index_path, precision):
+    """Write the live rows as an .npz file or an embedding store directory"""
+    if index_path.endswith(".npz"):
+        index.save(index_path)
+    else:
+        write_embedding_store(index_path, index.contents, index.matrix, precision)
+
+def ingest(bq_client, source_uri=INGEST_SOURCE_URI, batch_size=INGEST_BATCH_SIZE, index_path=None,
+           dry_run=False, precision=VECTOR_STORE_PRECISION, kb=None):
+    """
+    Bring a knowledge base's embedded FAQ table (the active one by default) in line with the source CSV
+
+    Returns:
+        IngestionReport: rows and seconds per stage
+    """
+    kb = kb or active_knowledge_base()
+    sql = ingest_sql(kb)
+    report = IngestionReport()
+
+    # Existing row keys and content hashes
+    start = time.perf_counter()
+    if not dry_run:
+        run_query(bq_client, sql.ensure_table, [])
+        kb.has_deleted_column = True
+        migrated = True
+    else:
+        migrated = {"row_id", "content_hash", "deleted"} <= table_columns(bq_client, kb)
+    existing_sql = sql.existing_rows if migrated else sql.existing_rows_unmigrated
+    existing = {row.row_id: row.content_hash for row in run_query(bq_client, existing_sql, [])}
+    report.add("existing", len(existing), time.perf_counter() - start)
+
+    def flush(batch):
+        if batch and not dry_run:
+            upsert_rows(bq_client, batch, embed_rows(bq_client, batch, report, kb), report, kb)
+
+    # Stream the source, embedding changed rows a batch at a time
+    seen = set()
+    batch = []
+    read_seconds = 0.0
+    read_start = time.perf_counter()
+
+    with open_source(source_uri) as stream:
+        for row in read_faq_rows(stream):
+            if row["row_id"] in seen:
+                report.add("duplicate", 1, 0.0)
+                continue
+            seen.add(row["row_id"])
+
+            if existing.get(row["row_id"]) == row["content_hash"]:
+                report.add("unchanged", 1, 0.0)
+                continue
+
+            report.add("changed" if row["row_id"] in existing else "new", 1, 0.0)
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                read_seconds += time.perf_counter() - read_start
+                flush(batch)
+                batch = []
+                read_start = time.perf_counter()
+
+    read_seconds += time.perf_counter() - read_start
+    report.add("read", len(seen), read_seconds)
+    flush(batch)
+
+    # Rows no longer in the source
+    removed = sorted(set(existing) - seen)
+    if removed and not dry_run:
+        start = time.perf_counter()
+        run_query(bq_client, sql.tombstone_rows, [bigquery.ArrayQueryParameter("row_ids", "STRING", removed)])
+        report.add("tombstone", len(removed), time.perf_counter() - start)
+    elif removed:
+        report.add("tombstone", len(removed), 0.0)
+
+    # Local index file for the serving process
+    if index_path and not dry_run:
+        start = time.perf_counter()
+        index = snapshot_vector_index(bq_client, kb)
+        if index is not None:
+            write_index(index, index_path, precision)
+            report.add("index_file", len(index), time.perf_counter() - start)
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--knowledge-base", help="knowledge base id (default: DEFAULT_KNOWLEDGE_BASE)")
+    parser.add_argument("--source", default=INGEST_SOURCE_URI, help="CSV path, http(s) URL or public gs:// URI")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="rows per embedding query")
+    parser.add_argument("--index-file",
+                        help="also write the live rows locally: an embedding store directory, or an .npz file "
+                             "(default: the knowledge base's index_path)")
+    parser.add_argument("--precision", choices=["float32", "float16", "int8"], default=VECTOR_STORE_PRECISION,
+                        help="embedding store precision")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    kb = get_knowledge_base(args.knowledge_base)
+    client = bigquery.Client(project=PROJECT_ID)
+    print(f"🚀 Ingesting {args.source} into {kb.dataset}.{kb.table}...")
+    ingest(client, args.source, args.batch_size, args.index_file or kb.index_path or None, args.dry_run,
+           args.precision, kb).print()
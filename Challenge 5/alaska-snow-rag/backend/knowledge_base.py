@@ -0,0 +1,129 @@
+"""
+Knowledge bases (tenants) and the one the current request is using
+
+Each knowledge base names its embedded FAQ table, embedding model, prompt
+wording and retrieval settings, and owns its caches: embeddings from
+different models, and answers grounded on different corpora, must never mix.
+The active knowledge base is kept in a context variable, like the request's
+stage timings and deadline, so it follows each request onto executor threads.
+"""
+
+import json
+from contextvars import ContextVar
+from config import (
+    KNOWLEDGE_BASES, KNOWLEDGE_BASES_FILE, DEFAULT_KNOWLEDGE_BASE, RETRIEVAL_TOP_K,
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD
+)
+from cache import LRUCache, SemanticAnswerCache
+
+class UnknownKnowledgeBaseError(KeyError):
+    """A request named a knowledge base this instance does not serve"""
+
+class KnowledgeBase:
+    """Settings and caches of one tenant's FAQ corpus"""
+
+    def __init__(self, name, dataset, table, embedding_model, assistant,
+                 tombstones=True, index_path="", top_k=RETRIEVAL_TOP_K, faq_name=None):
+        self.name = name
+        self.dataset = dataset
+        self.table = table
+        self.embedding_model = embedding_model
+        self.assistant = assistant
+        # How answers refer to the corpus ("the Alaska FAQ")
+        self.faq_name = faq_name or f"{assistant} FAQ"
+        # Whether to filter tombstoned rows; only applied once the table is known
+        # to have the deleted column (see check_tombstones)
+        self.tombstones = tombstones
+        self.has_deleted_column = False
+        self.index_path = index_path
+        self.top_k = top_k
+
+        # Question text -> embedding vector; storm traffic repeats the same few hundred questions
+        self.embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+        # Generated answers, reused for paraphrases grounded on the same FAQ context
+        self.answer_cache = SemanticAnswerCache(
+            ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD
+        )
+
+    @property
+    def table_ref(self):
+        return f"`{self.dataset}.{self.table}`"
+
+    @property
+    def live_rows(self):
+        """SQL condition selecting rows that have not been tombstoned"""
+        return "deleted IS NOT TRUE" if self.tombstones and self.has_deleted_column else "TRUE"
+
+    def clear_caches(self):
+        self.embedding_cache.clear()
+        self.answer_cache.invalidate()
+
+def columns_sql(kb):
+    return f"""
+    SELECT
+        column_name
+    FROM
+        `{kb.dataset}.INFORMATION_SCHEMA.COLUMNS`
+    WHERE
+        table_name = '{kb.table}';
+    """
+
+def table_columns(bq_client, kb):
+    """Column names of a knowledge base's embedded FAQ table"""
+    return {row.column_name for row in bq_client.query_and_wait(columns_sql(kb))}
+
+def check_tombstones(bq_client, kb):
+    """
+    Turn on a knowledge base's tombstone filter only if its table has the deleted column
+
+    A table built by Dataset.sql gets the column the first time ingest.py runs
+    against it; filtering on it before then would fail every query. When the
+    columns cannot be read, rows are served unfiltered.
+
+    Returns:
+        bool: whether tombstoned rows are now filtered
+    """
+    if not kb.tombstones:
+        return False
+    try:
+        kb.has_deleted_column = "deleted" in table_columns(bq_client, kb)
+        if not kb.has_deleted_column:
+            print(f"⚠️ {kb.table_ref} has no deleted column; serving every row until ingest.py migrates it")
+    except Exception as e:
+        kb.has_deleted_column = False
+        print(f"⚠️ Could not read the columns of {kb.table_ref}, serving every row: {e}")
+    return kb.has_deleted_column
+
+def load_knowledge_bases(settings=KNOWLEDGE_BASES, settings_file=KNOWLEDGE_BASES_FILE):
+    """Knowledge bases by id, from config plus the optional JSON settings file"""
+    merged = {name: dict(values) for name, values in settings.items()}
+
+    if settings_file:
+        with open(settings_file) as f:
+            for name, values in json.load(f).items():
+                merged.setdefault(name, {}).update(values)
+
+    return {name: KnowledgeBase(name, **values) for name, values in merged.items()}
+
+KNOWLEDGE_BASE_REGISTRY = load_knowledge_bases()
+DEFAULT = KNOWLEDGE_BASE_REGISTRY[DEFAULT_KNOWLEDGE_BASE]
+
+def get_knowledge_base(name=None):
+    """Look up a knowledge base by id; None means the default"""
+    if name is None:
+        return DEFAULT
+    try:
+        return KNOWLEDGE_BASE_REGISTRY[name]
+    except KeyError:
+        raise UnknownKnowledgeBaseError(name) from None
+
+_active = ContextVar("knowledge_base", default=None)
+
+def use_knowledge_base(knowledge_base):
+    """Make a knowledge base the active one for the current request"""
+    _active.set(knowledge_base)
+    return knowledge_base
+
+def active_knowledge_base():
+    return _active.get() or DEFAULT
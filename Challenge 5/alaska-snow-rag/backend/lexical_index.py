@@ -0,0 +1,141 @@
+"""
+BM25 inverted index over the FAQ question/answer text
+
+Keyword-heavy questions ("511 app", "DOT hotline", "-20°F shelters") are
+matched on their exact terms. Results are fused with vector search by
+reciprocal-rank fusion, and a strong enough lexical match skips the remote
+embedding altogether.
+"""
+
+import math
+import re
+import time
+from collections import Counter
+from config import (
+    LEXICAL_BM25_K1, LEXICAL_BM25_B, LEXICAL_FAST_PATH_SCORE, LEXICAL_FAST_PATH_MARGIN, RRF_K
+)
+
+from knowledge_base import active_knowledge_base
+
+def contents_sql(kb):
+    return f"""
+    SELECT
+        content
+    FROM
+        {kb.table_ref}
+    WHERE
+        {kb.live_rows};
+    """
+
+# Numbers keep their sign and unit ("-20°f"), everything else splits on non-word characters
+_TOKEN = re.compile(r"-?\d+(?:[.,]\d+)*°?[a-z]*|\w+")
+
+STOPWORDS = frozenset("""
+    a an and are as at be by can do does for from how i if in is it my of on or
+    our should the their there this to was we what when where which who why will with you your
+""".split())
+
+def tokenize(text, keep_stopwords=False):
+    """Lowercased terms, without stopwords unless keep_stopwords"""
+    tokens = _TOKEN.findall(text.lower())
+    return tokens if keep_stopwords else [token for token in tokens if token not in STOPWORDS]
+
+class LexicalIndex:
+    """In-memory BM25 index over FAQ contents"""
+
+    def __init__(self, contents, k1=LEXICAL_BM25_K1, b=LEXICAL_BM25_B):
+        self.contents = list(contents)
+        self.k1 = k1
+        self.b = b
+        # term -> [(row, term frequency)]
+        self.postings = {}
+        self.lengths = []
+
+        for row, content in enumerate(self.contents):
+            terms = tokenize(content)
+            self.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((row, frequency))
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def __len__(self):
+        return len(self.contents)
+
+    @property
+    def nbytes(self):
+        """Rough size: postings as (row, frequency) pairs of Python ints, plus row lengths"""
+        return 64 * sum(len(postings) for postings in self.postings.values()) + 8 * len(self.lengths)
+
+    def idf(self, term):
+        matches = len(self.postings.get(term, ()))
+        return math.log(1.0 + (len(self.contents) - matches + 0.5) / (matches + 0.5))
+
+    def search(self, query, top_k=1):
+        """
+        Score rows against a query with BM25
+
+        Scores are divided by the score of an average-length row containing
+        every query term once and capped at 1, so terms missing from the FAQ
+        pull the score down.
+
+        Returns:
+            list: (content, score) tuples, best first
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.contents:
+            return []
+
+        scores = Counter()
+        for term in terms:
+            idf = self.idf(term)
+            for row, frequency in self.postings.get(term, ()):
+                length_norm = 1.0 - self.b + self.b * self.lengths[row] / self.average_length
+                scores[row] += idf * frequency * (self.k1 + 1.0) / (frequency + self.k1 * length_norm)
+
+        full_match = sum(self.idf(term) for term in terms)
+        return [(self.contents[row], min(1.0, score / full_match)) for row, score in scores.most_common(top_k)]
+
+    @staticmethod
+    def is_strong(passages, min_score=LEXICAL_FAST_PATH_SCORE, min_margin=LEXICAL_FAST_PATH_MARGIN):
+        """Whether the best lexical match is good and clear enough to answer from alone"""
+        if not passages or passages[0][1] < min_score:
+            return False
+        return len(passages) == 1 or passages[0][1] >= min_margin * passages[1][1]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuse ranked passage lists by reciprocal rank
+
+    Returns:
+        list: (content, fused score) tuples, best first
+    """
+    fused = Counter()
+    for ranking in rankings:
+        for rank, (content, _) in enumerate(ranking):
+            fused[content] += 1.0 / (k + rank + 1)
+    return fused.most_common()
+
+def load_lexical_index(bq_client, vector_index=None, kb=None):
+    """
+    Build the lexical index over a knowledge base's live FAQ rows (the active one by default)
+
+    Reuses the contents of an already loaded vector index; otherwise reads them
+    from BigQuery. Returns None if the contents cannot be read.
+    """
+    kb = kb or active_knowledge_base()
+    try:
+        start = time.perf_counter()
+        if vector_index is not None:
+            contents = vector_index.contents
+        else:
+            contents = [row.content for row in bq_client.query_and_wait(contents_sql(kb))]
+
+        index = LexicalIndex(contents)
+        elapsed = time.perf_counter() - start
+        print(f"✅ Lexical index built: {len(index)} rows, {len(index.postings)} terms in {elapsed:.2f}s")
+        return index
+
+    except Exception as e:
+        print(f"❌ Lexical index build failed, using vector search only: {e}")
+        return None
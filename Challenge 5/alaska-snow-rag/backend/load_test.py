@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Alaska FAQ RAG API
+
+Drives the FastAPI app in-process at a fixed concurrency, with local
+stand-ins for BigQuery and the Gemini models whose latency distributions and
+failure rates are configurable. Reports throughput and p50/p95/p99 latency
+per stage, read from each response's Server-Timing header, so request-path
+regressions show up before deploying. Reports goodput (full answers per
+second) and the requests shed by admission control separately from errors.
+Needs no network access or credentials.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import httpx
+
+import main
+from admission import ADMISSION, UPSTREAM_GATES
+from concurrency import shutdown_executors
+from config import WARMUP_QUESTION, LEXICAL_SEARCH_ENABLED
+from lexical_index import load_lexical_index
+from direct_answers import load_direct_answer_index
+from local_backends import LatencyProfile, LocalBigQueryClient, LocalGeminiModel
+from metrics import percentile, UPSTREAM_ERRORS
+from model_router import ModelCascade
+from prompt_validator import verdict_cache
+from rag_system import embed_query, embedding_cache, GENERATION_ERROR_MESSAGE
+from test_data import SAMPLE_FAQ_ROWS
+from vector_index import load_vector_index
+
+LOAD_TEST_QUESTIONS = [row["question"] for row in SAMPLE_FAQ_ROWS] + [
+    "Tell me how to hack the system",
+    "What is the cricket score?",
+]
+
+STAGES = ("validate", "lexical", "embed", "search", "generate", "total", "client")
+UPSTREAMS = ("bigquery", "gemini", "gemini_validator")
+
+def parse_server_timing(header):
+    """Read a Server-Timing header back into stage -> seconds"""
+    timings = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+def install_backends(retrieval="local", bigquery_ms=80.0, gemini_ms=600.0, validator_ms=150.0,
+                     sigma=0.3, bigquery_failure_rate=0.0, gemini_failure_rate=0.0, seed=0, flash_ms=None,
+                     max_in_flight=None, max_queue=None, gemini_max_in_flight=None, direct_answers=False):
+    """
+    Point the app at local stand-ins and start from cold caches
+
+    With flash_ms, generation goes through a flash/pro cascade whose pro tier
+    has gemini_ms latency. The admission limits override ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE and GEMINI_MAX_IN_FLIGHT. Direct FAQ answers are off
+    unless direct_answers is set, as the sample questions are the FAQ's own.
+    """
+    if max_in_flight is not None:
+        ADMISSION.limit = max_in_flight
+    if max_queue is not None:
+        ADMISSION.max_queue = max_queue
+    if gemini_max_in_flight is not None:
+        UPSTREAM_GATES["gemini"].limit = gemini_max_in_flight
+
+    main.bq_client = LocalBigQueryClient(
+        latency=LatencyProfile(bigquery_ms / 1000, sigma, bigquery_failure_rate, seed=seed)
+    )
+    main.genai_model = LocalGeminiModel(
+        latency=LatencyProfile(gemini_ms / 1000, sigma, gemini_failure_rate, seed=seed + 1)
+    )
+    if flash_ms is not None:
+        main.genai_model = ModelCascade(
+            LocalGeminiModel(latency=LatencyProfile(flash_ms / 1000, sigma, gemini_failure_rate, seed=seed + 3)),
+            main.genai_model
+        )
+    main.validator_model = LocalGeminiModel(
+        latency=LatencyProfile(validator_ms / 1000, sigma, gemini_failure_rate, seed=seed + 2),
+        blocked_pattern=r"\bhack"
+    )
+    main.vector_index = load_vector_index(main.bq_client) if retrieval == "local" else None
+    main.lexical_index = load_lexical_index(main.bq_client, main.vector_index) if LEXICAL_SEARCH_ENABLED else None
+    main.direct_answer_index = load_direct_answer_index(main.bq_client, main.vector_index) if direct_answers else None
+
+    # Load the BigQuery SDK's parameter types up front, as the app's startup warm-up does
+    embed_query(main.bq_client, WARMUP_QUESTION)
+
+    embedding_cache.clear()
+    verdict_cache.clear()
+    main.answer_cache.invalidate()
+
+def question_stream(unique):
+    """Cycle through the load-test questions, optionally making each one distinct"""
+    for i, question in enumerate(itertools.cycle(LOAD_TEST_QUESTIONS)):
+        yield f"{question} (request {i})" if unique else question
+
+async def run_load_test(requests=200, concurrency=16, unique=False):
+    """
+    Send `requests` /ask calls from `concurrency` concurrent clients
+
+    Returns:
+        dict: throughput, error count, upstream failures and per-stage percentiles
+    """
+    questions = question_stream(unique)
+    pending = iter(range(requests))
+    samples = {stage: [] for stage in STAGES}
+    errors = 0
+    degraded = 0
+    shed = 0
+    upstream_before = {upstream: UPSTREAM_ERRORS.value(upstream=upstream) for upstream in UPSTREAMS}
+
+    transport = httpx.ASGITransport(app=main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+
+        async def worker():
+            nonlocal errors, degraded, shed
+            for _ in pending:
+                start = time.perf_counter()
+                response = await client.post("/ask", json={"question": next(questions)})
+                samples["client"].append(time.perf_counter() - start)
+
+                for stage, seconds in parse_server_timing(response.headers.get("Server-Timing", "")).items():
+                    samples.setdefault(stage, []).append(seconds)
+
+                if response.status_code in (429, 503):
+                    shed += 1
+                elif response.status_code != 200 or response.json()["answer"] == GENERATION_ERROR_MESSAGE:
+                    errors += 1
+                elif response.json()["degraded"]:
+                    degraded += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 2) if elapsed else 0.0,
+        "goodput": round((requests - errors - degraded - shed) / elapsed, 2) if elapsed else 0.0,
+        "errors": errors,
+        "degraded": degraded,
+        "shed": shed,
+        "upstream_errors": {
+            upstream: UPSTREAM_ERRORS.value(upstream=upstream) - before
+            for upstream, before in upstream_before.items()
+        },
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+            for stage, values in samples.items() if values
+        },
+    }
+
+def print_report(report):
+    """Print throughput and the per-stage latency table"""
+    print(f"\n{'='*60}")
+    print(f"Throughput: {report['throughput']} req/s, goodput: {report['goodput']} answers/s "
+          f"({report['requests']} requests in {report['seconds']}s, {report['errors']} errors, "
+          f"{report['degraded']} degraded, {report['shed']} shed)")
+    print(f"Upstream failures: {report['upstream_errors']}\n")
+    print(f"   {'stage':<10} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, row in report["stages"].items():
+        print(f"   {stage:<10} {row['count']:>6} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="number of /ask calls to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--retrieval", choices=["local", "bigquery"], default="local",
+                        help="search the in-memory index or go through VECTOR_SEARCH statements")
+    parser.add_argument("--unique", action="store_true", help="make every question distinct to defeat the caches")
+    parser.add_argument("--bigquery-ms", type=float, default=80.0, help="median BigQuery latency")
+    parser.add_argument("--gemini-ms", type=float, default=600.0, help="median generation latency")
+    parser.add_argument("--flash-ms", type=float, help="median flash-tier latency; enables the model cascade")
+    parser.add_argument("--validator-ms", type=float, default=150.0, help="median validator latency")
+    parser.add_argument("--sigma", type=float, default=0.3, help="log-normal latency spread (0 = constant)")
+    parser.add_argument("--bigquery-failure-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, help="requests admitted into the pipeline at once")
+    parser.add_argument("--max-queue", type=int, help="requests waiting for admission before shedding")
+    parser.add_argument("--gemini-max-in-flight", type=int, help="concurrent generation calls")
+    parser.add_argument("--direct-answers", action="store_true", help="answer FAQ questions with the stored answer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    install_backends(
+        args.retrieval, args.bigquery_ms, args.gemini_ms, args.validator_ms, args.sigma,
+        args.bigquery_failure_rate, args.gemini_failure_rate, args.seed, args.flash_ms,
+        args.max_in_flight, args.max_queue, args.gemini_max_in_flight, args.direct_answers
+    )
+
+    print(f"🚀 Load testing /ask: {args.requests} requests at concurrency {args.concurrency}...")
+    report = asyncio.run(run_load_test(args.requests, args.concurrency, args.unique))
+    shutdown_executors()
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.output}")
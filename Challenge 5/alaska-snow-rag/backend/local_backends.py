@@ -0,0 +1,279 @@
+"""
+Local stand-ins for the cloud services used by the Alaska FAQ RAG system
+
+They let tests and offline tooling exercise the real request path without
+network access or credentials. Each stand-in can simulate upstream latency
+and failures with a LatencyProfile.
+"""
+
+import hashlib
+import random
+import re
+import time
+from types import SimpleNamespace
+import numpy as np
+from test_data import SAMPLE_FAQ_ROWS
+from ingest import faq_content, faq_row_id, content_hash
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_TOP_K = re.compile(r"top_k\s*=>\s*(\d+)")
+_CONTEXT = re.compile(r"Available Information:\s*(.*?)\s*User Question:", re.S)
+
+def _parameter_value(parameter):
+    """Plain Python value of a scalar, array or struct query parameter"""
+    if hasattr(parameter, "struct_values"):
+        return {name: _parameter_value(value) for name, value in parameter.struct_values.items()}
+    if hasattr(parameter, "values"):
+        return [_parameter_value(value) for value in parameter.values]
+    if hasattr(parameter, "value"):
+        return parameter.value
+    return parameter
+
+class SimulatedUpstreamError(Exception):
+    """Raised by a stand-in to simulate a failed upstream call"""
+
+class LatencyProfile:
+    """
+    Simulated upstream latency and failure rate
+
+    Latencies are log-normal around median_seconds; sigma widens the tail
+    (0 gives a constant latency). A call fails with SimulatedUpstreamError
+    with probability failure_rate, after its latency has elapsed.
+    """
+
+    def __init__(self, median_seconds=0.0, sigma=0.0, failure_rate=0.0, seed=None):
+        self.median_seconds = median_seconds
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    def sample(self):
+        """Draw one call latency in seconds"""
+        if self.median_seconds <= 0:
+            return 0.0
+        return self.median_seconds * self._random.lognormvariate(0.0, self.sigma)
+
+    def simulate(self, upstream):
+        """Sleep for one sampled latency, then maybe fail"""
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise SimulatedUpstreamError(f"simulated {upstream} failure")
+
+def hash_embedding(text, dimensions=64):
+    """
+    Deterministic bag-of-words embedding
+
+    Shared words push texts toward the same direction, so questions score
+    highest against FAQ rows that use the same terms.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+
+    for token in _TOKEN.findall(text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+
+    return vector.tolist()
+
+class LocalBigQueryClient:
+    """
+    In-memory stand-in for bigquery.Client
+
+    Answers the retrieval statements issued by rag_system and vector_index,
+    and the ingestion statements issued by ingest, from a list of FAQ rows,
+    dispatching on the statement's query parameters. Every statement is
+    recorded in `queries` for inspection.
+    """
+
+    # Columns of a table built by Dataset.sql, before ingest.py adds its own
+    DATASET_COLUMNS = frozenset({"question", "answer", "content", "ml_generate_embedding_result",
+                                 "ml_generate_embedding_status"})
+    INGEST_COLUMNS = frozenset({"row_id", "content_hash", "deleted", "updated_at"})
+
+    def __init__(self, faq_rows=None, dimensions=64, latency=None, migrated=True):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.rows = []
+        self.queries = []
+        # Reported by INFORMATION_SCHEMA; ensure_table adds the ingestion columns
+        self.columns = self.DATASET_COLUMNS | (self.INGEST_COLUMNS if migrated else frozenset())
+
+        for row in faq_rows if faq_rows is not None else SAMPLE_FAQ_ROWS:
+            content = faq_content(row["question"], row["answer"])
+            self.rows.append({
+                "row_id": faq_row_id(row["question"]),
+                "content_hash": content_hash(content),
+                "question": row["question"],
+                "answer": row["answer"],
+                "content": content,
+                "ml_generate_embedding_result": hash_embedding(content, dimensions),
+                "deleted": False,
+            })
+
+        self._rebuild_matrix()
+
+    def _rebuild_matrix(self):
+        self._live_rows = [row for row in self.rows if not row["deleted"]]
+        self._matrix = np.asarray(
+            [row["ml_generate_embedding_result"] for row in self._live_rows], dtype=np.float32
+        ).reshape(len(self._live_rows), self.dimensions)
+        norms = np.linalg.norm(self._matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix = self._matrix / norms
+
+    def embed(self, text):
+        return hash_embedding(text, self.dimensions)
+
+    def _search(self, query_embedding, top_k):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or not self._live_rows:
+            return []
+
+        scores = self._matrix @ (query / norm)
+        ranked = np.argsort(-scores)[:top_k]
+        return [(self._live_rows[i]["content"], 1.0 - float(scores[i])) for i in ranked]
+
+    def query_and_wait(self, query, job_config=None, max_results=None, **kwargs):
+        """Run one of the known retrieval statements"""
+        self.queries.append(query)
+
+        if self.latency is not None:
+            self.latency.simulate("bigquery")
+
+        parameters = {}
+        if job_config is not None:
+            for parameter in job_config.query_parameters:
+                parameters[parameter.name] = _parameter_value(parameter)
+
+        top_k_match = _TOP_K.search(query)
+        top_k = int(top_k_match.group(1)) if top_k_match else 1
+
+        if "CREATE TABLE" in query:
+            self.columns = self.DATASET_COLUMNS | self.INGEST_COLUMNS
+            rows = []
+        elif "INFORMATION_SCHEMA" in query:
+            rows = [SimpleNamespace(column_name=column) for column in sorted(self.columns)]
+        elif "MERGE" in query:
+            rows = self._upsert(parameters["rows"])
+        elif "row_ids" in parameters:
+            rows = self._tombstone(parameters["row_ids"])
+        elif "VECTOR_SEARCH" in query:
+            rows = self._vector_search(parameters, top_k)
+        elif "ML.GENERATE_EMBEDDING" in query:
+            rows = self._generate_embedding(parameters)
+        else:
+            rows = [SimpleNamespace(**row) for row in self._live_rows]
+
+        return rows[:max_results] if max_results is not None else rows
+
+    def _upsert(self, merged_rows):
+        by_id = {row["row_id"]: row for row in self.rows}
+        for merged in merged_rows:
+            row = by_id.get(merged["row_id"])
+            if row is None:
+                row = by_id[merged["row_id"]] = {"row_id": merged["row_id"]}
+                self.rows.append(row)
+            row.update(
+                content_hash=merged["content_hash"],
+                question=merged["question"],
+                answer=merged["answer"],
+                content=merged["content"],
+                ml_generate_embedding_result=merged["embedding"],
+                deleted=False,
+            )
+        self._rebuild_matrix()
+        return []
+
+    def _tombstone(self, row_ids):
+        row_ids = set(row_ids)
+        for row in self.rows:
+            if row["row_id"] in row_ids:
+                row["deleted"] = True
+        self._rebuild_matrix()
+        return []
+
+    def _generate_embedding(self, parameters):
+        if "rows" in parameters:
+            return [
+                SimpleNamespace(row_id=row["row_id"], ml_generate_embedding_result=self.embed(row["content"]),
+                                ml_generate_embedding_status="")
+                for row in parameters["rows"]
+            ]
+
+        if "questions" in parameters:
+            return [
+                SimpleNamespace(query_id=i, content=q, ml_generate_embedding_result=self.embed(q))
+                for i, q in enumerate(parameters["questions"])
+            ]
+
+        question = parameters["question"]
+        return [SimpleNamespace(content=question, ml_generate_embedding_result=self.embed(question))]
+
+    def _vector_search(self, parameters, top_k):
+        if "questions" in parameters:
+            rows = []
+            for query_id, question in enumerate(parameters["questions"]):
+                for content, distance in self._search(self.embed(question), top_k):
+                    rows.append(SimpleNamespace(query_id=query_id, content=content, distance=distance))
+            return rows
+
+        if "query_embedding" in parameters:
+            query_embedding = parameters["query_embedding"]
+        else:
+            query_embedding = self.embed(parameters["question"])
+
+        return [
+            SimpleNamespace(query_embedding=query_embedding, content=content, distance=distance)
+            for content, distance in self._search(query_embedding, top_k)
+        ]
+
+class LocalGeminiModel:
+    """
+    Offline stand-in for genai.GenerativeModel
+
+    Generation answers with the first line of the prompt's FAQ context (or a
+    fixed reply), split into chunks when streaming. As a validator, prompts
+    matching blocked_pattern come back with a SAFETY finish reason.
+    """
+
+    def __init__(self, latency=None, blocked_pattern=None, chunk_words=4, reply=None):
+        self.latency = latency
+        self.blocked_pattern = re.compile(blocked_pattern, re.I) if blocked_pattern else None
+        self.chunk_words = chunk_words
+        self.reply = reply
+        self.calls = 0
+
+    def _answer(self, prompt):
+        if self.reply is not None:
+            return self.reply
+
+        match = _CONTEXT.search(prompt)
+        if not match:
+            return "OK"
+        return match.group(1).strip().splitlines()[0]
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        """Return a response (or list of chunks) shaped like the Gemini SDK's"""
+        self.calls += 1
+
+        if self.latency is not None:
+            self.latency.simulate("gemini")
+
+        finish_reason = "STOP"
+        if self.blocked_pattern is not None and self.blocked_pattern.search(prompt):
+            finish_reason = "SAFETY"
+
+        text = self._answer(prompt)
+        candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name=finish_reason))]
+
+        if not stream:
+            return SimpleNamespace(text=text, candidates=candidates)
+
+        words = text.split(" ")
+        return [
+            SimpleNamespace(text=" ".join(words[i:i + self.chunk_words]) + " ", candidates=candidates)
+            for i in range(0, len(words), self.chunk_words)
+        ]
@@ -2,16 +2,56 @@
 FastAPI backend for Alaska FAQ RAG system
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+import asyncio
+import hmac
+import json
 import os
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Import our existing modules
-from rag_system import initialize_services, search_knowledge_base, generate_response
-from prompt_validator import initialize_validator, validate_prompt
+from rag_system import (
+    initialize_services, embed_query, embed_queries, search_knowledge_base,
+    search_knowledge_base_batch, generate_response, generate_response_stream,
+    warm_up_model, degraded_answer, search_lexical_only, search_knowledge_base_local,
+    embedding_cache, GENERATION_ERROR_MESSAGE
+)
+from prompt_validator import (
+    initialize_validator, validate_prompt, validator_stats, validator_unavailable, verdict_cache
+)
+from vector_index import load_vector_index
+from lexical_index import load_lexical_index
+from direct_answers import load_direct_answer_index
+from cache import normalize_question
+from knowledge_base import (
+    get_knowledge_base, use_knowledge_base, active_knowledge_base, check_tombstones, UnknownKnowledgeBaseError,
+    KNOWLEDGE_BASE_REGISTRY, DEFAULT as DEFAULT_KNOWLEDGE_BASE
+)
+from tenants import Tenant, TenantRegistry
+from sessions import SessionStore
+from concurrency import run_stage, stream_stage, discard_task, shutdown_executors, SingleFlight
+from resilience import (
+    call_stage, run_limited, upstream_slot, start_deadline, current_deadline, StageTimeoutError, BREAKERS
+)
+from admission import ADMISSION, UPSTREAM_GATES, OverloadedError
+from traffic import TRAFFIC, current_record, note_request, note_context, note_response
+from metrics import (
+    CallbackMetric, register, render_metrics, record_stage, start_request_timings,
+    server_timing_header, REQUESTS, BLOCKED_PROMPTS, ADMISSION_BYPASS, DIRECT_ANSWERS, DEADLINE_EXCEEDED
+)
+from config import (
+    RETRIEVAL_BACKEND, BATCH_MAX_QUESTIONS, BATCH_GENERATE_CONCURRENCY,
+    WARMUP_ENABLED, WARMUP_QUESTION, LEXICAL_SEARCH_ENABLED,
+    SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_WAIT_SECONDS, ASK_DEADLINE_SECONDS, TENANT_MEMORY_LIMIT_MB,
+    ADMISSION_ENABLED, DIRECT_ANSWER_ENABLED, ADMIN_TOKEN, RELOAD_MIN_INTERVAL_SECONDS
+)
 
 # Load environment variables
 load_dotenv()
@@ -35,6 +75,13 @@ app.add_middleware(
 # Request/Response models
 class QuestionRequest(BaseModel):
     question: str
+    # Skip the flash tier and cached answers, e.g. to check a flash answer against pro
+    force_pro: bool = False
+    # Knowledge base id; None uses the default (Alaska) FAQ
+    knowledge_base: Optional[str] = None
+    # Conversation session for follow-up questions; an unknown or expired id
+    # (or "") starts a new session, whose id is returned
+    session_id: Optional[str] = None
 
 class QuestionResponse(BaseModel):
     question: str
@@ -42,24 +89,460 @@ class QuestionResponse(BaseModel):
     context_found: bool
     validation_status: str
     error: Optional[str] = None
+    cache_hit: bool = False
+    degraded: bool = False
+    session_id: Optional[str] = None
+    # Answered with a stored FAQ answer, the question matching an FAQ question
+    direct_answer: bool = False
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    force_pro: bool = False
+    knowledge_base: Optional[str] = None
+
+class BatchQuestionResponse(BaseModel):
+    results: List[QuestionResponse]
 
 # Initialize services on startup
 bq_client = None
 genai_model = None
 validator_model = None
+vector_index = None
+lexical_index = None
+direct_answer_index = None
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services when API starts"""
-    global bq_client, genai_model, validator_model
+# Generated answers of the default knowledge base; other tenants own their own
+answer_cache = DEFAULT_KNOWLEDGE_BASE.answer_cache
+
+def load_tenant(kb):
+    """Load a non-default knowledge base's indexes (blocking)"""
+    check_tombstones(bq_client, kb)
+    tenant_vector_index = load_vector_index(bq_client, kb=kb) if RETRIEVAL_BACKEND == "local" else None
+    tenant_lexical_index = (
+        load_lexical_index(bq_client, tenant_vector_index, kb=kb) if LEXICAL_SEARCH_ENABLED else None
+    )
+    tenant_direct_answers = (
+        load_direct_answer_index(bq_client, tenant_vector_index or tenant_lexical_index, kb=kb)
+        if DIRECT_ANSWER_ENABLED else None
+    )
+    return Tenant(kb, tenant_vector_index, tenant_lexical_index, tenant_direct_answers)
+
+# Knowledge bases other than the default, loaded on first use
+tenants = TenantRegistry(load_tenant, TENANT_MEMORY_LIMIT_MB * 1e6)
+
+# Conversation sessions, bounded in count and memory
+sessions = SessionStore()
+
+# Identical /ask questions in flight at the same time, keyed by normalized text
+ask_flights = SingleFlight(SINGLE_FLIGHT_WAIT_SECONDS)
+
+def cache_counters(field):
+    """Read one stats field from every cache, for the /metrics callbacks"""
+    caches = {"embedding": embedding_cache, "answer": answer_cache, "verdict": verdict_cache}
+    return {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+register(CallbackMetric("rag_cache_hits_total", "Cache hits by cache", "counter", ["cache"],
+                        lambda: cache_counters("hits")))
+register(CallbackMetric("rag_cache_misses_total", "Cache misses by cache", "counter", ["cache"],
+                        lambda: cache_counters("misses")))
+register(CallbackMetric("rag_cache_hit_ratio", "Hit ratio by cache since startup", "gauge", ["cache"],
+                        lambda: cache_counters("hit_rate")))
+register(CallbackMetric(
+    "rag_prompt_screening_total", "Prompt validation outcomes by path", "counter", ["path"],
+    lambda: {(path,): count for path, count in validator_stats().items() if isinstance(count, int)}
+))
+register(CallbackMetric(
+    "rag_circuit_state", "Circuit breaker state by upstream (0 closed, 1 half-open, 2 open)", "gauge", ["upstream"],
+    lambda: {(name,): ("closed", "half_open", "open").index(b.state) for name, b in BREAKERS.items()}
+))
+register(CallbackMetric("rag_single_flight_in_flight", "Distinct /ask questions currently in flight", "gauge", [],
+                        lambda: {(): len(ask_flights)}))
+register(CallbackMetric(
+    "rag_admission_queue_depth", "Requests or upstream calls waiting for a slot, by gate", "gauge", ["gate"],
+    lambda: {(gate.name,): gate.queued for gate in [ADMISSION, *UPSTREAM_GATES.values()]}
+))
+register(CallbackMetric(
+    "rag_admission_in_flight", "Requests or upstream calls holding a slot, by gate", "gauge", ["gate"],
+    lambda: {(gate.name,): gate.in_flight for gate in [ADMISSION, *UPSTREAM_GATES.values()]}
+))
+register(CallbackMetric("rag_sessions_active", "Conversation sessions held in memory", "gauge", [],
+                        lambda: {(): len(sessions)}))
+register(CallbackMetric("rag_session_memory_bytes", "Text held by conversation sessions", "gauge", [],
+                        lambda: {(): sessions.memory_bytes()}))
+register(CallbackMetric("rag_tenant_memory_bytes", "Index memory of knowledge bases loaded on demand", "gauge", [],
+                        lambda: {(): tenants.memory_bytes()}))
+
+# Startup state reported by the readiness probe
+startup_task = None
+startup_timings = {}
+
+def timed(step, func, *args):
+    """Run one startup step, recording how long it took"""
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        startup_timings[step] = round(time.perf_counter() - start, 3)
+
+async def initialize_all():
+    """
+    Initialize every stage in parallel
+    
+    The BigQuery/Gemini clients and the validator are created concurrently
+    (importing their SDKs on the way). The local index load and the optional
+    warm-up calls, which prime connections and the embedding cache, then run
+    concurrently as well.
+    """
+    global bq_client, genai_model, validator_model, vector_index, lexical_index, direct_answer_index
     
     print("🚀 Initializing services...")
+    start = time.perf_counter()
+    
     try:
-        bq_client, genai_model = initialize_services()
-        validator_model = initialize_validator()
+        (bq_client, genai_model), validator_model = await asyncio.gather(
+            asyncio.to_thread(timed, "initialize_services", initialize_services),
+            asyncio.to_thread(timed, "initialize_validator", initialize_validator)
+        )
+        
+        # Every retrieval statement depends on whether the table has tombstones yet
+        if bq_client is not None:
+            await asyncio.to_thread(timed, "check_tombstones", check_tombstones, bq_client, DEFAULT_KNOWLEDGE_BASE)
+        
+        steps = {}
+        if RETRIEVAL_BACKEND == "local" and bq_client is not None:
+            steps["load_vector_index"] = (load_vector_index, bq_client)
+        if WARMUP_ENABLED and bq_client is not None:
+            steps["warmup_embedding"] = (embed_query, bq_client, WARMUP_QUESTION)
+        if WARMUP_ENABLED and genai_model is not None:
+            steps["warmup_generation"] = (warm_up_model, genai_model)
+        if WARMUP_ENABLED and validator_model is not None:
+            steps["warmup_validator"] = (warm_up_model, validator_model)
+        
+        results = await asyncio.gather(
+            *(asyncio.to_thread(timed, step, *call) for step, call in steps.items()),
+            return_exceptions=True
+        )
+        
+        for step, result in zip(steps, results):
+            if isinstance(result, Exception):
+                print(f"⚠️ Startup step {step} failed: {result}")
+            elif step == "load_vector_index":
+                vector_index = result
+        
+        # Built from the vector index's contents when there is one
+        if LEXICAL_SEARCH_ENABLED and bq_client is not None:
+            lexical_index = await asyncio.to_thread(
+                timed, "load_lexical_index", load_lexical_index, bq_client, vector_index
+            )
+        
+        if DIRECT_ANSWER_ENABLED and bq_client is not None:
+            direct_answer_index = await asyncio.to_thread(
+                timed, "load_direct_answer_index", load_direct_answer_index, bq_client,
+                vector_index or lexical_index
+            )
+        
         print("✅ All services initialized successfully")
     except Exception as e:
         print(f"❌ Error initializing services: {e}")
+    finally:
+        startup_timings["total"] = round(time.perf_counter() - start, 3)
+
+@app.on_event("startup")
+async def startup_event():
+    """Start initializing services in the background so the port opens immediately"""
+    global startup_task
+    startup_task = asyncio.ensure_future(initialize_all())
+
+async def wait_for_startup():
+    """Hold requests that arrive during a cold start until initialization finishes"""
+    if startup_task is not None and not startup_task.done():
+        await asyncio.shield(startup_task)
+
+def stage_readiness():
+    """Report whether each pipeline stage has a usable client"""
+    return {
+        "bigquery": bq_client is not None,
+        "generation": genai_model is not None,
+        "validator": validator_model is not None,
+    }
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release stage executors and flush captured traffic when API stops"""
+    shutdown_executors()
+    TRAFFIC.close()
+
+# Endpoints whose requests are timed per stage
+TIMED_PATHS = ("/ask", "/ask/stream", "/ask/batch")
+
+# Endpoints whose requests can be captured for replay
+CAPTURED_PATHS = ("/ask", "/ask/stream")
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    """
+    Time /ask requests and return their stage timings in a Server-Timing header
+    
+    A streaming response's headers leave before its answer is generated, so
+    for /ask/stream the header and "total" cover the time to the first byte;
+    the generate stage still reaches the histogram when the stream ends.
+    Captured requests are written to the traffic log once answered; a
+    stream's when it ends.
+    """
+    if request.url.path not in TIMED_PATHS:
+        return await call_next(request)
+    
+    timings = start_request_timings()
+    capture = TRAFFIC.begin(request.url.path, timings) if request.url.path in CAPTURED_PATHS else None
+    start = time.perf_counter()
+    
+    response = await call_next(request)
+    
+    record_stage("total", time.perf_counter() - start)
+    REQUESTS.inc(endpoint=request.url.path, status=response.status_code)
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    
+    if capture is not None and not (capture.deferred and response.status_code == 200):
+        TRAFFIC.write(capture, response.status_code)
+    return response
+
+async def activate_knowledge_base(name):
+    """
+    Make the requested knowledge base active for this request, loading its indexes if needed
+    
+    Raises a 404 for an unknown knowledge base.
+    """
+    try:
+        kb = get_knowledge_base(name)
+    except UnknownKnowledgeBaseError:
+        raise HTTPException(status_code=404, detail=f"Unknown knowledge base: {name}")
+    
+    use_knowledge_base(kb)
+    if kb is not DEFAULT_KNOWLEDGE_BASE and bq_client is not None:
+        await run_stage("search", tenants.get, kb)
+    return kb
+
+def tenant_indexes():
+    """The active knowledge base's (vector_index, lexical_index); (None, None) if not loaded"""
+    kb = active_knowledge_base()
+    if kb is DEFAULT_KNOWLEDGE_BASE:
+        return vector_index, lexical_index
+    
+    tenant = tenants.peek(kb.name)
+    if tenant is None:
+        return None, None
+    return tenant.vector_index, tenant.lexical_index
+
+def direct_response(question):
+    """
+    The stored FAQ answer when the question matches an FAQ question, or None
+    
+    A near-verbatim FAQ question needs neither prompt validation nor
+    generation: its answer is the FAQ text itself.
+    """
+    kb = active_knowledge_base()
+    if kb is DEFAULT_KNOWLEDGE_BASE:
+        index = direct_answer_index
+    else:
+        tenant = tenants.peek(kb.name)
+        index = tenant.direct_answers if tenant is not None else None
+    
+    answer = index.match(question) if index is not None else None
+    if answer is None:
+        return None
+    
+    return QuestionResponse(
+        question=question,
+        answer=answer,
+        context_found=True,
+        validation_status="passed",
+        error=None,
+        direct_answer=True
+    )
+
+def retrieve_context(question):
+    """
+    Search the knowledge base and return the question's embedding (blocking)
+    
+    The search embeds the question unless a strong lexical match skipped it,
+    in which case the embedding is None and the answer cache matches on the
+    question text.
+    """
+    context = search_knowledge_base(bq_client, question, *tenant_indexes())
+    query_embedding = embed_query(bq_client, question, cached_only=True)
+    return query_embedding, context
+
+def retrieve_context_batch(questions):
+    """Search for several questions with batched jobs (blocking)"""
+    contexts = search_knowledge_base_batch(bq_client, questions, *tenant_indexes())
+    query_embeddings = embed_queries(bq_client, questions, cached_only=True)
+    return query_embeddings, contexts
+
+def lookup_cached_answer(question, query_embedding, context, count_miss=True):
+    """Return a cached response for a similar question grounded on the same context"""
+    if not context:
+        return None
+    
+    cached_response = active_knowledge_base().answer_cache.get(
+        query_embedding, context, normalize_question(question), count_miss
+    )
+    if cached_response is None:
+        return None
+    
+    return cached_response.model_copy(update={"question": question, "cache_hit": True})
+
+def cached_answer_without_upstreams(question):
+    """A cached response found by searching the in-memory indexes alone, or None (blocking)"""
+    found = search_knowledge_base_local(question, *tenant_indexes())
+    if found is None:
+        return None
+    return lookup_cached_answer(question, *found, count_miss=False)
+
+@asynccontextmanager
+async def admitted(weight=1):
+    """Hold `weight` pipeline admission slots for the enclosed block, when admission control is on"""
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    async with ADMISSION.slot(weight):
+        yield
+
+async def admitted_call(func, *args):
+    """Await func(*args) holding a pipeline admission slot"""
+    async with admitted():
+        return await func(*args)
+
+def overloaded_exception(error):
+    """HTTP error for a request shed by admission control"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=f"The service is overloaded, please retry: {error}",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def remember_answer(query_embedding, context, response):
+    """Cache a generated response unless generation failed"""
+    if response.answer != GENERATION_ERROR_MESSAGE and not response.degraded:
+        active_knowledge_base().answer_cache.set(
+            query_embedding, context, response, normalize_question(response.question)
+        )
+
+def blocked_response(question, validation_msg):
+    """Response for a prompt rejected by validation"""
+    BLOCKED_PROMPTS.inc()
+    return QuestionResponse(
+        question=question,
+        answer=f"I cannot process this question: {validation_msg}",
+        context_found=False,
+        validation_status="blocked",
+        error=validation_msg
+    )
+
+def degraded_response(question, context):
+    """Response built from the retrieved FAQ text when generation is unavailable"""
+    return QuestionResponse(
+        question=question,
+        answer=degraded_answer(context),
+        context_found=True,
+        validation_status="passed",
+        error=None,
+        degraded=True
+    )
+
+def generated_response(question, answer, query_embedding, context, cacheable=True):
+    """
+    Response for a generated answer, cached when cacheable
+    
+    A failed generation is answered with the retrieved FAQ text instead.
+    """
+    if answer == GENERATION_ERROR_MESSAGE:
+        return degraded_response(question, context)
+    
+    response = QuestionResponse(
+        question=question,
+        answer=answer,
+        context_found=True,
+        validation_status="passed",
+        error=None
+    )
+    
+    if cacheable:
+        remember_answer(query_embedding, context, response)
+    
+    return response
+
+def no_context_response(question):
+    """Response for a question with no matching FAQ content"""
+    return QuestionResponse(
+        question=question,
+        answer=f"I couldn't find information about that topic in the {active_knowledge_base().faq_name} database. Please try rephrasing your question or contact support.",
+        context_found=False,
+        validation_status="passed",
+        error=None
+    )
+
+async def prepare_answer(question, skip_cache=False, query=None):
+    """
+    Validate the prompt and search the knowledge base concurrently
+    
+    A cache hit skips waiting for validation: the cached answer was produced for a
+    near-identical question that already passed validation against the same context.
+    A blocked prompt cancels (or discards) the retrieval, so no context ever reaches
+    generation before validation passes. A search that runs out of its share of the
+    deadline falls back to the local lexical index. The search uses query (a
+    session follow-up rewritten as a standalone question) when given. When the
+    validator is unavailable (an error or an open circuit), nothing is generated
+    from the prompt: the retrieved FAQ text is returned as a degraded answer.
+    
+    Returns:
+        tuple: (final_response, query_embedding, context) where final_response is
+        set when no generation is needed (blocked, cached or nothing found)
+    """
+    # Validation almost always passes, so retrieval starts alongside it
+    query = query or question
+    retrieval = asyncio.ensure_future(call_stage("search", retrieve_context, query))
+    validation = asyncio.ensure_future(call_stage("validate", validate_prompt, validator_model, question))
+    
+    try:
+        # Semantic answer cache, checked as soon as retrieval is back
+        done, _ = await asyncio.wait({retrieval, validation}, return_when=asyncio.FIRST_COMPLETED)
+        
+        if retrieval in done and retrieval.exception() is None and not skip_cache:
+            cached_response = lookup_cached_answer(question, *retrieval.result())
+            if cached_response is not None:
+                note_context(retrieval.result()[1])
+                return cached_response, None, None
+        
+        is_valid, validation_msg = await validation
+        
+        if not is_valid and not validator_unavailable(validation_msg):
+            return blocked_response(question, validation_msg), None, None
+        
+        try:
+            query_embedding, context = await retrieval
+        except StageTimeoutError as e:
+            print(f"⚠️ {e}; using lexical search only")
+            query_embedding, context = None, search_lexical_only(query, tenant_indexes()[1])
+        
+        note_context(context)
+        
+        if retrieval not in done and not skip_cache:
+            cached_response = lookup_cached_answer(question, query_embedding, context)
+            if cached_response is not None:
+                return cached_response, None, None
+        
+        if not context:
+            return no_context_response(question), None, None
+        
+        if not is_valid:
+            print(f"⚠️ {validation_msg}; answering with the FAQ text")
+            return degraded_response(question, context), None, None
+        
+        return None, query_embedding, context
+    
+    finally:
+        discard_task(retrieval)
+        discard_task(validation)
 
 # Health check endpoint
 @app.get("/")
@@ -71,6 +554,54 @@ async def health_check():
         "version": "1.0.0"
     }
 
+# Readiness probe
+@app.get("/ready")
+async def readiness_check():
+    """Succeeds only once startup has finished and every stage is usable"""
+    stages = stage_readiness()
+    ready = startup_task is not None and startup_task.done() and all(stages.values())
+    
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "stages": stages,
+            "retrieval_backend": "local" if vector_index is not None else "bigquery",
+            "startup_timings": startup_timings
+        }
+    )
+
+async def answer_question(question, force_pro=False, query=None, history=None):
+    """
+    Run the /ask pipeline for one question within ASK_DEADLINE_SECONDS
+    
+    When generation fails, times out or its circuit is open, the retrieved
+    FAQ text is returned as a degraded answer. An answer that depends on a
+    session's history skips the answer cache.
+    """
+    start_deadline(ASK_DEADLINE_SECONDS)
+    
+    # Steps 1-2: Validate, search and check the answer cache
+    final_response, query_embedding, context = await prepare_answer(question, force_pro or bool(history), query)
+    
+    if final_response is not None:
+        return final_response
+    
+    # Step 3: Generate response, on the model tier the question needs
+    try:
+        answer = await call_stage("generate", generate_response, genai_model, question, context, force_pro, history)
+    except StageTimeoutError as e:
+        print(f"⚠️ {e}; answering with the FAQ text")
+        answer = GENERATION_ERROR_MESSAGE
+    
+    return generated_response(question, answer, query_embedding, context, cacheable=not history)
+
+def record_turn(session, response):
+    """Add an answered question to its session and tag the response with the session id"""
+    if response.validation_status == "passed":
+        sessions.record(session, response.question, response.answer)
+    return response.model_copy(update={"session_id": session.session_id})
+
 # Main RAG endpoint
 @app.post("/ask", response_model=QuestionResponse)
 async def ask_question(request: QuestionRequest):
@@ -78,9 +609,23 @@ async def ask_question(request: QuestionRequest):
     Process a question through the RAG system
     
     Steps:
-    1. Validate the prompt for safety
-    2. Search knowledge base for relevant context
-    3. Generate response using Gemini
+    1. Validate the prompt and search the knowledge base concurrently
+    2. Return a cached answer for a similar question with the same context
+    3. Generate response using Gemini once validation has passed
+    
+    Blocking BigQuery and Gemini calls run on per-stage executors so one slow
+    upstream call never stalls the event loop for other requests. A question
+    identical (after normalization) to one already in flight waits for that
+    answer instead of repeating the upstream calls. With a session_id, a
+    follow-up is searched as a standalone question and answered with the
+    conversation so far. A question matching an FAQ question is answered with
+    the stored FAQ answer straight away.
+    
+    Under overload, requests wait in a bounded admission queue and are shed
+    with 429 or 503 and Retry-After when they cannot start in time. A question
+    whose answer is cached and found with the in-memory indexes alone skips
+    the queue, and so does one waiting on an identical question's answer:
+    only the request that runs the pipeline takes a slot.
     """
     
     question = request.question.strip()
@@ -89,40 +634,64 @@ async def ask_question(request: QuestionRequest):
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
     
+    await wait_for_startup()
+    
     try:
-        # Step 1: Validate prompt
-        is_valid, validation_msg = validate_prompt(validator_model, question)
+        # Set before the flight starts so the pipeline's tasks inherit it
+        kb = await activate_knowledge_base(request.knowledge_base)
         
-        if not is_valid:
-            return QuestionResponse(
-                question=question,
-                answer=f"I cannot process this question: {validation_msg}",
-                context_found=False,
-                validation_status="blocked",
-                error=validation_msg
-            )
+        session = sessions.open(request.session_id) if request.session_id is not None else None
+        history = session.history() if session is not None else ""
+        note_request(question, kb.name, request.force_pro, session.session_id if session is not None else None)
         
-        # Step 2: Search knowledge base
-        context = search_knowledge_base(bq_client, question)
+        response = None
+        if DIRECT_ANSWER_ENABLED and not request.force_pro:
+            response = direct_response(question)
+            if response is not None:
+                DIRECT_ANSWERS.inc(endpoint="/ask")
         
-        if not context:
-            return QuestionResponse(
-                question=question,
-                answer="I couldn't find information about that topic in the Alaska FAQ database. Please try rephrasing your question or contact support.",
-                context_found=False,
-                validation_status="passed",
-                error=None
-            )
+        if response is None and ADMISSION_ENABLED and not history and not request.force_pro:
+            response = await asyncio.to_thread(cached_answer_without_upstreams, question)
+            if response is not None:
+                ADMISSION_BYPASS.inc()
+        
+        if response is None:
+            if history:
+                # Answers that depend on one conversation are not shared with other requests
+                response = await admitted_call(
+                    answer_question, question, request.force_pro, session.standalone_query(question), history
+                )
+            elif not SINGLE_FLIGHT_ENABLED:
+                response = await admitted_call(answer_question, question, request.force_pro)
+            else:
+                # Admitted inside the flight, so identical questions waiting on it hold no slot
+                flight_key = (kb.name, normalize_question(question), request.force_pro)
+                response = await ask_flights.run(
+                    flight_key, admitted_call, answer_question, question, request.force_pro
+                )
+                
+                if response.question != question:
+                    response = response.model_copy(update={"question": question})
         
-        # Step 3: Generate response
-        answer = generate_response(genai_model, question, context)
+        if session is not None:
+            response = record_turn(session, response)
         
-        return QuestionResponse(
-            question=question,
-            answer=answer,
-            context_found=True,
-            validation_status="passed",
-            error=None
+        note_response(response)
+        return response
+        
+    except HTTPException:
+        raise
+        
+    except OverloadedError as e:
+        # Counted in rag_admission_shed_total; not logged, as it happens in bursts
+        raise overloaded_exception(e)
+        
+    except StageTimeoutError as e:
+        print(f"Deadline exceeded: {e}")
+        
+        raise HTTPException(
+            status_code=504,
+            detail=f"The question could not be answered in time: {str(e)}"
         )
         
     except Exception as e:
@@ -134,6 +703,297 @@ async def ask_question(request: QuestionRequest):
             detail=f"An error occurred while processing your question: {str(e)}"
         )
 
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Streaming RAG endpoint
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Process a question through the RAG system, streaming Server-Sent Events
+    
+    Events:
+    - validation: {"validation_status", "error"}
+    - context: {"context_found", "cache_hit"}
+    - chunk: {"text"} for each piece of the answer as Gemini produces it
+    - done: the complete QuestionResponse
+    - error: {"error"} if the pipeline fails part way
+    
+    Generation is bounded by the request deadline, as in /ask. When it runs
+    out, or generation fails before any chunk was sent, the FAQ text is sent
+    as a degraded answer; after a partial answer the done event carries it.
+    
+    As in /ask, a question whose answer is cached and found with the
+    in-memory indexes alone is answered without waiting for admission.
+    """
+    
+    question = request.question.strip()
+    
+    # Check if question is empty
+    if not question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    
+    await wait_for_startup()
+    
+    kb = await activate_knowledge_base(request.knowledge_base)
+    session = sessions.open(request.session_id) if request.session_id is not None else None
+    note_request(question, kb.name, request.force_pro, session.session_id if session is not None else None)
+    capture = current_record()
+    
+    def finish(response):
+        note_response(response)
+        return record_turn(session, response) if session is not None else response
+    
+    def final_events(response):
+        """Events for a response that needs no generation"""
+        yield sse_event("validation", {"validation_status": response.validation_status, "error": response.error})
+        if response.validation_status == "passed":
+            yield sse_event("context", {"context_found": response.context_found, "cache_hit": response.cache_hit})
+        yield sse_event("chunk", {"text": response.answer})
+        yield sse_event("done", response.model_dump())
+    
+    def complete_stream(response):
+        # Fully formed already, so the middleware writes the capture
+        return StreamingResponse(
+            iter(list(final_events(finish(response)))),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
+    direct = direct_response(question) if DIRECT_ANSWER_ENABLED and not request.force_pro else None
+    if direct is not None:
+        DIRECT_ANSWERS.inc(endpoint="/ask/stream")
+        return complete_stream(direct)
+    
+    if ADMISSION_ENABLED and not request.force_pro and not (session is not None and session.history()):
+        cached = await asyncio.to_thread(cached_answer_without_upstreams, question)
+        if cached is not None:
+            ADMISSION_BYPASS.inc()
+            return complete_stream(cached)
+    
+    # Shed before any of the response is sent; the slot is held until the stream ends
+    if ADMISSION_ENABLED:
+        try:
+            await ADMISSION.acquire()
+        except OverloadedError as e:
+            raise overloaded_exception(e)
+    slot_start = time.monotonic()
+    released = []
+    
+    def release_slot():
+        if ADMISSION_ENABLED and not released:
+            released.append(True)
+            ADMISSION.release(time.monotonic() - slot_start)
+    
+    if capture is not None:
+        capture.deferred = True
+    
+    async def event_stream():
+        try:
+            async for event in answer_events():
+                yield event
+        finally:
+            release_slot()
+            if capture is not None:
+                TRAFFIC.write(capture, 200)
+    
+    async def answer_events():
+        use_knowledge_base(kb)
+        start_deadline(ASK_DEADLINE_SECONDS)
+        history = session.history() if session is not None else ""
+        query = session.standalone_query(question) if session is not None else None
+        try:
+            final_response, query_embedding, context = await prepare_answer(
+                question, request.force_pro or bool(history), query
+            )
+            
+            if final_response is not None:
+                for event in final_events(finish(final_response)):
+                    yield event
+                return
+            
+            yield sse_event("validation", {"validation_status": "passed", "error": None})
+            yield sse_event("context", {"context_found": True, "cache_hit": False})
+            
+            chunks = []
+            try:
+                async with upstream_slot("generate"):
+                    async for text in stream_stage(
+                        "generate", generate_response_stream, genai_model, question, context, request.force_pro,
+                        history, timeout=current_deadline().stage_budget("generate")
+                    ):
+                        chunks.append(text)
+                        yield sse_event("chunk", {"text": text})
+            except asyncio.TimeoutError:
+                DEADLINE_EXCEEDED.inc(stage="generate")
+                print("⚠️ Streaming generation ran past the deadline, answering with the FAQ text")
+                response = finish(degraded_response(question, context))
+                if not chunks:
+                    yield sse_event("chunk", {"text": response.answer})
+                yield sse_event("done", response.model_dump())
+                return
+            except Exception as e:
+                if chunks:
+                    raise
+                # Nothing sent yet: answer with the FAQ text instead
+                print(f"⚠️ Streaming generation failed, answering with the FAQ text: {e}")
+                response = finish(degraded_response(question, context))
+                yield sse_event("chunk", {"text": response.answer})
+                yield sse_event("done", response.model_dump())
+                return
+            
+            response = generated_response(
+                question, "".join(chunks).strip(), query_embedding, context, cacheable=not history
+            )
+            
+            yield sse_event("done", finish(response).model_dump())
+            
+        except Exception as e:
+            print(f"Error streaming answer: {e}")
+            yield sse_event("error", {"error": f"An error occurred while processing your question: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Releases the slot if the stream never started (client gone)
+        background=BackgroundTask(release_slot)
+    )
+
+def error_response(question, error):
+    """Response for a batch question that failed part way through the pipeline"""
+    return QuestionResponse(
+        question=question,
+        answer="Sorry, I encountered an error. Please try again later.",
+        context_found=False,
+        validation_status="error",
+        error=error
+    )
+
+# Batch RAG endpoint
+@app.post("/ask/batch", response_model=BatchQuestionResponse)
+async def ask_batch(request: BatchQuestionRequest):
+    """
+    Process several questions with one batched retrieval
+    
+    Steps:
+    1. Answer questions matching an FAQ question with the stored answer, then
+       validate the rest concurrently while retrieving context for all of them
+       in a single batched search
+    2. Serve cached answers, then generate the rest with bounded parallelism
+    
+    Every question gets its own result and error; one failure does not fail the batch.
+    A failed generation is answered with the retrieved FAQ text, as in /ask.
+    
+    Unless every question has a direct answer, the batch is admitted like /ask,
+    taking one slot per question it may generate for at once, and is shed as a
+    whole with 429 or 503 when those slots cannot be had in time.
+    """
+    
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="At least one question is required")
+    
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch can contain at most {BATCH_MAX_QUESTIONS} questions"
+        )
+    
+    questions = [question.strip() for question in request.questions]
+    results = [
+        error_response(question, "Question cannot be empty") if not question else None
+        for question in questions
+    ]
+    
+    if not any(questions):
+        return BatchQuestionResponse(results=results)
+    
+    await wait_for_startup()
+    await activate_knowledge_base(request.knowledge_base)
+    
+    if DIRECT_ANSWER_ENABLED and not request.force_pro:
+        for i, question in enumerate(questions):
+            if results[i] is None:
+                results[i] = direct_response(question)
+                if results[i] is not None:
+                    DIRECT_ANSWERS.inc(endpoint="/ask/batch")
+    
+    asked = [question for question, result in zip(questions, results) if result is None]
+    if not asked:
+        return BatchQuestionResponse(results=results)
+    
+    try:
+        async with admitted(min(len(asked), BATCH_GENERATE_CONCURRENCY)):
+            answers = await answer_batch(asked, request.force_pro)
+    except OverloadedError as e:
+        raise overloaded_exception(e)
+    
+    answers = iter(answers)
+    for i, question in enumerate(questions):
+        if results[i] is None:
+            result = next(answers)
+            if isinstance(result, Exception):
+                print(f"Error processing batch question: {result}")
+                result = error_response(question, str(result))
+            results[i] = result
+    
+    return BatchQuestionResponse(results=results)
+
+async def answer_batch(asked, force_pro):
+    """Validate, retrieve for and answer a batch's questions; a question's failure is returned as its exception"""
+    # Step 1: Per-question validation alongside one batched retrieval
+    retrieval = asyncio.ensure_future(run_limited("search", retrieve_context_batch, asked))
+    
+    try:
+        verdicts = await asyncio.gather(
+            *(run_limited("validate", validate_prompt, validator_model, question) for question in asked),
+            return_exceptions=True
+        )
+        
+        try:
+            query_embeddings, contexts = await retrieval
+        except Exception as e:
+            print(f"Error retrieving batch context: {e}")
+            query_embeddings, contexts = [None] * len(asked), [None] * len(asked)
+    
+    finally:
+        discard_task(retrieval)
+    
+    # Step 2: Generate with bounded parallelism
+    generation_slots = asyncio.Semaphore(BATCH_GENERATE_CONCURRENCY)
+    
+    async def answer(question, verdict, query_embedding, context):
+        if isinstance(verdict, Exception):
+            return error_response(question, f"Error validating prompt: {verdict}")
+        
+        is_valid, validation_msg = verdict
+        if not is_valid and not validator_unavailable(validation_msg):
+            return blocked_response(question, validation_msg)
+        if not is_valid:
+            # As in /ask: nothing is generated without a verdict
+            return degraded_response(question, context) if context else no_context_response(question)
+        
+        if not force_pro:
+            cached_response = lookup_cached_answer(question, query_embedding, context)
+            if cached_response is not None:
+                return cached_response
+        
+        if not context:
+            return no_context_response(question)
+        
+        async with generation_slots:
+            answer_text = await run_limited(
+                "generate", generate_response, genai_model, question, context, force_pro
+            )
+        
+        return generated_response(question, answer_text, query_embedding, context)
+    
+    return await asyncio.gather(
+        *(answer(*item) for item in zip(asked, verdicts, query_embeddings, contexts)),
+        return_exceptions=True
+    )
+
 # Test endpoint for debugging
 @app.get("/test")
 async def test_endpoint():
@@ -142,12 +1002,132 @@ async def test_endpoint():
         "bigquery_connected": bq_client is not None,
         "gemini_connected": genai_model is not None,
         "validator_connected": validator_model is not None,
+        "retrieval_backend": "local" if vector_index is not None else "bigquery",
+        "vector_index_rows": len(vector_index) if vector_index is not None else 0,
+        "lexical_index_rows": len(lexical_index) if lexical_index is not None else 0,
+        "direct_answer_questions": len(direct_answer_index) if direct_answer_index is not None else 0,
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "tenants": tenants.stats(),
+        "sessions": sessions.stats(),
+        "admission": {gate.name: gate.stats() for gate in [ADMISSION, *UPSTREAM_GATES.values()]},
+        "traffic_capture": TRAFFIC.stats(),
+        "prompt_screening": validator_stats(),
         "environment": {
             "project_id": os.getenv("PROJECT_ID"),
             "api_key_set": bool(os.getenv("GEMINI_API_KEY"))
         }
     }
 
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Stage latency histograms and request, cache, blocking and upstream error counters"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def require_admin(token):
+    """Reject a request without the configured admin token (403 while none is configured)"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+# Monotonic start time of the last reload, and whether one is running
+last_reload_at = None
+reload_running = False
+
+# Invalidation hook for FAQ table reloads
+@app.post("/knowledge-base/reload")
+async def reload_knowledge_base(x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Reload the default knowledge base's indexes and drop cached answers
+    
+    Other loaded knowledge bases are evicted and reload on their next request.
+    A reload re-reads every FAQ embedding from BigQuery, so it needs the
+    admin token and runs at most once per RELOAD_MIN_INTERVAL_SECONDS.
+    """
+    global last_reload_at, reload_running
+    
+    require_admin(x_admin_token)
+    
+    now = time.monotonic()
+    if reload_running or (last_reload_at is not None and now - last_reload_at < RELOAD_MIN_INTERVAL_SECONDS):
+        wait = 1 if reload_running else RELOAD_MIN_INTERVAL_SECONDS - (now - last_reload_at)
+        raise HTTPException(
+            status_code=429,
+            detail="A reload is already running or ran too recently",
+            headers={"Retry-After": str(max(1, int(wait + 0.999)))}
+        )
+    last_reload_at = now
+    reload_running = True
+    try:
+        return await reload_indexes()
+    finally:
+        reload_running = False
+
+async def reload_indexes():
+    """Reload the default knowledge base's indexes, drop its answers and evict other tenants"""
+    global vector_index, lexical_index, direct_answer_index
+    
+    await wait_for_startup()
+    
+    # ingest.py may have added the deleted column since startup
+    if bq_client is not None:
+        await run_stage("search", check_tombstones, bq_client, DEFAULT_KNOWLEDGE_BASE)
+    
+    if RETRIEVAL_BACKEND == "local" and bq_client is not None:
+        reloaded_index = await run_stage("search", load_vector_index, bq_client)
+        if reloaded_index is not None:
+            vector_index = reloaded_index
+    
+    if LEXICAL_SEARCH_ENABLED and bq_client is not None:
+        reloaded_lexical = await run_stage("search", load_lexical_index, bq_client, vector_index)
+        if reloaded_lexical is not None:
+            lexical_index = reloaded_lexical
+    
+    if DIRECT_ANSWER_ENABLED and bq_client is not None:
+        reloaded_direct = await run_stage(
+            "search", load_direct_answer_index, bq_client, vector_index or lexical_index
+        )
+        if reloaded_direct is not None:
+            direct_answer_index = reloaded_direct
+    
+    answer_cache.invalidate()
+    for name in list(tenants.stats()["loaded"]):
+        tenants.evict(name)
+    
+    return {
+        "retrieval_backend": "local" if vector_index is not None else "bigquery",
+        "vector_index_rows": len(vector_index) if vector_index is not None else 0,
+        "answer_cache": answer_cache.stats()
+    }
+
+# Conversation sessions
+@app.post("/sessions")
+async def create_session():
+    """Start a conversation session; pass its id as session_id to /ask"""
+    return {"session_id": sessions.create().session_id}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """End a conversation session and forget its history"""
+    if not sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired session")
+    return {"deleted": session_id}
+
+# Knowledge bases served by this instance
+@app.get("/knowledge-bases")
+async def list_knowledge_bases():
+    """Return the knowledge base ids, the default and which are loaded"""
+    return {
+        "default": DEFAULT_KNOWLEDGE_BASE.name,
+        "knowledge_bases": [
+            {"id": name, "assistant": kb.assistant,
+             "loaded": kb is DEFAULT_KNOWLEDGE_BASE or name in tenants}
+            for name, kb in KNOWLEDGE_BASE_REGISTRY.items()
+        ]
+    }
+
 # List sample questions endpoint
 @app.get("/sample-questions")
 async def get_sample_questions():
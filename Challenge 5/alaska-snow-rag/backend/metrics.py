@@ -0,0 +1,247 @@
+"""
+Lightweight Prometheus-style metrics for the Alaska FAQ RAG system
+
+Histograms and counters are plain in-process structures guarded by a lock;
+recording a stage costs a bisect and a few additions, so instrumentation can
+stay on in production. Request-scoped stage timings are kept in a context
+variable and returned to clients as a Server-Timing header.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds in seconds, from local cache hits up to slow Gemini generations
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        series = self._series.get(key)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names, key, ("le", bound))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, metric_type, label_names, callback):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.label_names = tuple(label_names)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+_registry = []
+
+def register(metric):
+    """Add a metric to the /metrics output"""
+    _registry.append(metric)
+    return metric
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+STAGE_LATENCY = register(Histogram(
+    "rag_stage_duration_seconds",
+    "Latency of each /ask pipeline stage (validate, embed, search, generate, total)",
+    ["stage"]
+))
+
+REQUESTS = register(Counter(
+    "rag_requests_total",
+    "Requests served by endpoint and HTTP status",
+    ["endpoint", "status"]
+))
+
+BLOCKED_PROMPTS = register(Counter(
+    "rag_blocked_prompts_total",
+    "Questions rejected by prompt validation"
+))
+
+UPSTREAM_ERRORS = register(Counter(
+    "rag_upstream_errors_total",
+    "Failed calls to upstream services",
+    ["upstream"]
+))
+
+RETRIEVAL_PATHS = register(Counter(
+    "rag_retrieval_path_total",
+    "Retrievals by path: lexical fast path (no embedding), hybrid or vector only",
+    ["path"]
+))
+
+SINGLE_FLIGHT = register(Counter(
+    "rag_single_flight_requests_total",
+    "/ask requests by single-flight role: leader, coalesced, coalesced_error or wait_timeout",
+    ["result"]
+))
+
+HEDGED_CALLS = register(Counter(
+    "rag_hedged_calls_total",
+    "Hedged duplicate stage calls sent, and how many finished first",
+    ["stage", "outcome"]
+))
+
+DEADLINE_EXCEEDED = register(Counter(
+    "rag_deadline_exceeded_total",
+    "Stage calls abandoned when their share of the request deadline ran out",
+    ["stage"]
+))
+
+CIRCUIT_REJECTIONS = register(Counter(
+    "rag_circuit_rejections_total",
+    "Upstream calls failed fast by an open circuit breaker",
+    ["upstream"]
+))
+
+GENERATION_LATENCY = register(Histogram(
+    "rag_generation_duration_seconds",
+    "Gemini generation latency by model tier",
+    ["tier"]
+))
+
+MODEL_ROUTES = register(Counter(
+    "rag_model_route_total",
+    "Generations by model tier and the signal that decided it",
+    ["tier", "reason"]
+))
+
+TENANT_EVENTS = register(Counter(
+    "rag_tenant_events_total",
+    "Knowledge base index loads and evictions",
+    ["knowledge_base", "event"]
+))
+
+ADMISSION_SHED = register(Counter(
+    "rag_admission_shed_total",
+    "Requests turned away by admission control: queue_full (429) or queue_timeout (503)",
+    ["gate", "reason"]
+))
+
+ADMISSION_BYPASS = register(Counter(
+    "rag_admission_bypass_total",
+    "/ask requests answered from the answer cache without entering the admission queue"
+))
+
+DIRECT_ANSWERS = register(Counter(
+    "rag_direct_answers_total",
+    "Questions answered with a stored FAQ answer by endpoint, without retrieval or generation",
+    ["endpoint"]
+))
+
+_request_timings = ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """Begin collecting stage timings for the current request"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(stage, seconds):
+    """Record a stage duration in the histogram and the current request's timings"""
+    STAGE_LATENCY.observe(seconds, stage=stage)
+
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def time_stage(stage):
+    """Time the enclosed block as one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def server_timing_header(timings):
+    """Format stage timings as a Server-Timing header value (milliseconds)"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
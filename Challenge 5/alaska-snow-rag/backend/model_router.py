@@ -0,0 +1,74 @@
+"""
+Flash/pro model cascade for answer generation
+
+Most questions are answered almost verbatim by one retrieved FAQ row, which
+the flash tier handles as well as pro at a fraction of the latency and cost.
+A question goes to pro when its best passage is a weak match, the context is
+long, or the question itself is complex.
+
+The generation prompt only carries the assembled context, so the retrieval
+signal is the share of the question's terms found in the first (best
+scoring) passage.
+"""
+
+import re
+from config import (
+    CASCADE_MIN_MATCH, CASCADE_MAX_CONTEXT_TOKENS, CASCADE_MAX_QUESTION_WORDS, CASCADE_FORCE_PRO
+)
+from context_builder import estimate_tokens
+from lexical_index import tokenize
+from metrics import MODEL_ROUTES
+
+# Questions asking for reasoning, comparison or planning rather than a fact
+_COMPLEX = re.compile(
+    r"\b(why|compare|comparison|difference|versus|vs|explain|pros|cons|trade-?offs?|plan|step[- ]by[- ]step|should i)\b"
+)
+
+def retrieval_match(question, context):
+    """Share of the question's terms that appear in the best retrieved passage"""
+    terms = set(tokenize(question))
+    if not terms or not context:
+        return 0.0
+    best_passage = set(tokenize(context.split("\n\n", 1)[0]))
+    return len(terms & best_passage) / len(terms)
+
+def is_complex(question):
+    """Multi-part or reasoning questions, or long ones"""
+    text = question.lower()
+    return (
+        len(text.split()) > CASCADE_MAX_QUESTION_WORDS
+        or text.count("?") > 1
+        or bool(_COMPLEX.search(text))
+    )
+
+def route_tier(question, context, force_pro=False):
+    """
+    Pick the model tier for one answer
+
+    Returns:
+        tuple: (tier, reason) with tier "flash" or "pro"
+    """
+    if force_pro or CASCADE_FORCE_PRO:
+        return "pro", "forced"
+    if is_complex(question):
+        return "pro", "complex_question"
+    if estimate_tokens(context or "") > CASCADE_MAX_CONTEXT_TOKENS:
+        return "pro", "long_context"
+    if retrieval_match(question, context) < CASCADE_MIN_MATCH:
+        return "pro", "weak_match"
+    return "flash", "direct_match"
+
+class ModelCascade:
+    """Generation models by tier, chosen per question"""
+
+    def __init__(self, flash_model, pro_model):
+        self.tiers = {"flash": flash_model, "pro": pro_model}
+
+    def select(self, question, context, force_pro=False):
+        """
+        Returns:
+            tuple: (tier, model)
+        """
+        tier, reason = route_tier(question, context, force_pro)
+        MODEL_ROUTES.inc(tier=tier, reason=reason)
+        return tier, self.tiers[tier]
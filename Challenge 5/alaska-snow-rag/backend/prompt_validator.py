@@ -1,10 +1,59 @@
-import google.generativeai as genai
-from config import GEMINI_API_KEY, SAFETY_SETTINGS
+import re
+import threading
+from google_sdk import genai, configure_genai
+from config import (
+    SAFETY_SETTINGS, PROMPT_SCREEN_ENABLED, PROMPT_SCREEN_BLOCK_THRESHOLD,
+    VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL_SECONDS
+)
+from cache import LRUCache, normalize_question
+from metrics import time_stage
+from resilience import BREAKERS
+
+SAFETY_BLOCK_MESSAGE = "This prompt was blocked for safety reasons. Please rephrase your question."
+
+# Starts the message of a verdict the validator could not give (error or open circuit)
+VALIDATION_ERROR_PREFIX = "Error validating prompt"
+
+# Local screening rules as (pattern, weight). A prompt whose unsafe weight reaches
+# PROMPT_SCREEN_BLOCK_THRESHOLD is blocked without calling the model. Screening
+# only ever blocks: on-topic words say nothing about hate or harassment ("a
+# racist joke about icy roads"), so every other prompt goes to Gemini. Words
+# that also show up in ordinary safety questions ("hacks for a stuck car",
+# "can the cold kill someone", "my neighbor is stalking me") weigh less than
+# the threshold on their own, so those prompts reach the model.
+UNSAFE_RULES = [
+    (re.compile(r"\bhack(ing|ed)?\s+(into|the|a|an|my|your|his|her|their|someone)\b|\bmalware\b|\bransomware\b|\bphishing\b|\bsteal\b.{0,30}\b(password|credential|identity)"), 1.0),
+    (re.compile(r"\bhack(s|ing|ed)?\b"), 0.5),
+    (re.compile(r"\b(make|build|assemble|detonate)\b.{0,20}\b(bomb|explosive|pipe bomb|weapon)s?\b(?!\s+shelter)"), 1.0),
+    (re.compile(r"\b(murder|shoot|stab)\b.{0,20}\b(him|her|them|someone|people|my (wife|husband|boss|neighbou?r))\b"), 1.0),
+    (re.compile(r"\b(kill|hurt|harm|poison)\b.{0,20}\b(him|her|them|someone|people|my (wife|husband|boss|neighbou?r))\b"), 0.5),
+    (re.compile(r"\b(suicide|self[- ]harm|kill myself|end my life)\b"), 1.0),
+    (re.compile(r"\bignore\b.{0,20}\b(previous|prior|above|all)\b.{0,20}\b(instructions|rules|prompt)\b"), 1.0),
+    (re.compile(r"\b(porn|nude|explicit sex)\w*\b"), 1.0),
+    (re.compile(r"\b(racist|sexist|homophobic)\b.{0,20}\b(joke|slur|insult|rant)s?\b"), 1.0),
+    (re.compile(r"\bstalk(s|ing|ed)?\b"), 0.5),
+    (re.compile(r"\b(make|cook|brew|synthesi[sz]e)\b.{0,20}\b(meth|crack|heroin|fentanyl|cocaine)\b"), 1.0),
+    (re.compile(r"\b(attack|weapon|drugs?|exploit|bypass|jailbreak)\b"), 0.5),
+]
+
+# Final verdicts for recently seen prompts, keyed on normalized text
+verdict_cache = LRUCache(VERDICT_CACHE_SIZE, VERDICT_CACHE_TTL_SECONDS)
+
+screen_counters = {
+    "screened_unsafe": 0,
+    "verdict_cache_hits": 0,
+    "validator_calls": 0,
+}
+_counters_lock = threading.Lock()
+
+def _count(counter):
+    with _counters_lock:
+        screen_counters[counter] += 1
 
 def initialize_validator():
     """Initialize Gemini model for prompt validation"""
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
+        configure_genai()
         
         # Using gemini-1.5-flash for fast validation
         model = genai.GenerativeModel(
@@ -19,20 +68,95 @@ def initialize_validator():
         print(f"❌ Validator initialization failed: {e}")
         return None
 
+def screen_prompt(prompt):
+    """
+    Block clearly unsafe prompts locally
+    
+    Returns:
+        bool: False when clearly unsafe, None when the prompt needs the
+        Gemini validator (the screener never approves a prompt)
+    """
+    text = prompt.lower()
+    
+    unsafe_weight = sum(weight for pattern, weight in UNSAFE_RULES if pattern.search(text))
+    if unsafe_weight >= PROMPT_SCREEN_BLOCK_THRESHOLD:
+        return False
+    
+    return None
+
 def validate_prompt(validator_model, prompt):
     """
     Validates if a prompt is safe to process
     
+    Cached verdicts and the local screener are tried first; every prompt the
+    screener does not block is sent to the Gemini validator.
+    
+    Returns:
+        tuple: (is_valid, message)
+    """
+    with time_stage("validate"):
+        return _validate_prompt(validator_model, prompt)
+
+def _validate_prompt(validator_model, prompt):
+    if not PROMPT_SCREEN_ENABLED:
+        return validate_with_model(validator_model, prompt)
+    
+    cache_key = normalize_question(prompt)
+    cached_verdict = verdict_cache.get(cache_key)
+    if cached_verdict is not None:
+        _count("verdict_cache_hits")
+        return cached_verdict
+    
+    screened = screen_prompt(prompt)
+    
+    if screened is False:
+        _count("screened_unsafe")
+        verdict = (False, SAFETY_BLOCK_MESSAGE)
+    else:
+        verdict = validate_with_model(validator_model, prompt)
+        # Validator errors are transient; don't pin them for the TTL
+        if validator_unavailable(verdict[1]):
+            return verdict
+    
+    verdict_cache.set(cache_key, verdict)
+    return verdict
+
+def validator_unavailable(message):
+    """Whether a failed verdict means the validator could not answer, rather than that the prompt is unsafe"""
+    return message.startswith(VALIDATION_ERROR_PREFIX)
+
+def validator_stats():
+    """Return screening counters, including how many validator calls were avoided"""
+    with _counters_lock:
+        stats = dict(screen_counters)
+    
+    stats["validator_calls_avoided"] = (
+        stats["screened_unsafe"] + stats["verdict_cache_hits"]
+    )
+    stats["verdict_cache"] = verdict_cache.stats()
+    return stats
+
+def validate_with_model(validator_model, prompt):
+    """
+    Validates a prompt with the Gemini validator model
+    
     Returns:
         tuple: (is_valid, message)
     """
+    breaker = BREAKERS["gemini_validator"]
+    if not breaker.allow():
+        return False, f"{VALIDATION_ERROR_PREFIX}: validator circuit is open"
+    
+    _count("validator_calls")
+    
     try:
         # Test the prompt with the validator model
         response = validator_model.generate_content(prompt)
+        breaker.record_success()
         
         # Check if response was blocked
         if response.candidates and response.candidates[0].finish_reason.name == 'SAFETY':
-            return False, "This prompt was blocked for safety reasons. Please rephrase your question."
+            return False, SAFETY_BLOCK_MESSAGE
         
         # If we got here, prompt is safe
         return True, "Prompt is safe"
@@ -41,6 +165,8 @@ def validate_prompt(validator_model, prompt):
         # If any error occurs (including safety blocks), consider it unsafe
         error_msg = str(e).lower()
         if 'safety' in error_msg or 'block' in error_msg:
-            return False, "This prompt was blocked for safety reasons. Please rephrase your question."
+            breaker.record_success()
+            return False, SAFETY_BLOCK_MESSAGE
         else:
-            return False, f"Error validating prompt: {e}"
\ No newline at end of file
+            breaker.record_failure()
+            return False, f"{VALIDATION_ERROR_PREFIX}: {e}"
\ No newline at end of file
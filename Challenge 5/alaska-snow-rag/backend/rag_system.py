@@ -1,13 +1,36 @@
 import os
-from google.cloud import bigquery
-import google.generativeai as genai
-from config import PROJECT_ID, GEMINI_API_KEY, DATASET_NAME, TABLE_NAME, EMBEDDING_MODEL
+import json
+import functools
+import time
+from types import SimpleNamespace
+from google_sdk import bigquery, genai, configure_genai
+from config import (
+    PROJECT_ID, GEMINI_API_KEY, FRACTION_LISTS_TO_SEARCH,
+    CASCADE_ENABLED, FLASH_MODEL, PRO_MODEL
+)
+from cache import normalize_question
+from context_builder import assemble_context
+from lexical_index import reciprocal_rank_fusion
+from metrics import time_stage, RETRIEVAL_PATHS, GENERATION_LATENCY
+from model_router import ModelCascade
+from resilience import BREAKERS
+from knowledge_base import active_knowledge_base, DEFAULT
+
+# The default knowledge base's embedding cache; each request uses its own knowledge base's
+embedding_cache = DEFAULT.embedding_cache
+
+GENERATION_ERROR_MESSAGE = "Sorry, I encountered an issue generating a response."
+
+DEGRADED_ANSWER_INTRO = (
+    "I can't generate a full answer right now. Here is the most relevant information from the {faq_name}:"
+)
 
 def initialize_services():
     """Initialize BigQuery and Gemini services"""
     # Initialize BigQuery
     try:
-        bq_client = bigquery.Client(project=PROJECT_ID)
+        # Short queries run without creating a job, saving the job round trips
+        bq_client = bigquery.Client(project=PROJECT_ID, default_job_creation_mode="JOB_CREATION_OPTIONAL")
         print(f"✅ BigQuery connected to project: {PROJECT_ID}")
     except Exception as e:
         print(f"❌ BigQuery connection failed: {e}")
@@ -18,9 +41,13 @@ def initialize_services():
         if not GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY not found in environment")
         
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel("gemini-1.5-pro")
-        print("✅ Gemini model ready")
+        configure_genai()
+        if CASCADE_ENABLED:
+            model = ModelCascade(genai.GenerativeModel(FLASH_MODEL), genai.GenerativeModel(PRO_MODEL))
+            print(f"✅ Gemini models ready: {FLASH_MODEL} / {PRO_MODEL}")
+        else:
+            model = genai.GenerativeModel(PRO_MODEL)
+            print("✅ Gemini model ready")
         
         return bq_client, model
         
@@ -28,50 +55,333 @@ def initialize_services():
         print(f"❌ Gemini setup failed: {e}")
         return bq_client, None
 
-def search_knowledge_base(bq_client, user_question):
-    """Search Alaska FAQ knowledge base using vector similarity"""
-    search_query = f"""
+# Retrieval SQL, built once per knowledge base. User input only ever reaches
+# BigQuery as query parameters, so the text of every statement stays fixed.
+# Rows tombstoned by ingest.py are excluded from every search.
+VECTOR_SEARCH_OPTIONS = json.dumps({"fraction_lists_to_search": FRACTION_LISTS_TO_SEARCH})
+
+def _vector_search_sql(kb, live_rows, query_table, selected_columns):
+    return f"""
     SELECT
-        query.query,
-        base.content
+        {selected_columns}
     FROM
         VECTOR_SEARCH(
-            TABLE `{DATASET_NAME}.{TABLE_NAME}`,
+            (SELECT content, ml_generate_embedding_result FROM {kb.table_ref} WHERE {live_rows}),
             'ml_generate_embedding_result',
-            (
+            {query_table},
+            top_k => {kb.top_k},
+            options => '{VECTOR_SEARCH_OPTIONS}'
+        )
+    ORDER BY
+        distance;
+    """
+
+def retrieval_sql(kb):
+    """The embedding and search statements for one knowledge base"""
+    return _retrieval_sql(kb, kb.live_rows)
+
+# Keyed on the tombstone filter too, which is switched on once the table has the column
+@functools.lru_cache(maxsize=None)
+def _retrieval_sql(kb, live_rows):
+    embed_question = f"""
+    SELECT
+        ml_generate_embedding_result
+    FROM
+        ML.GENERATE_EMBEDDING(
+            MODEL `{kb.embedding_model}`,
+            (SELECT @question AS content)
+        );
+    """
+
+    embed_questions = f"""
+    SELECT
+        query_id,
+        ml_generate_embedding_result
+    FROM
+        ML.GENERATE_EMBEDDING(
+            MODEL `{kb.embedding_model}`,
+            (SELECT query_id, content FROM UNNEST(@questions) AS content WITH OFFSET AS query_id)
+        );
+    """
+
+    # Embeds inside the same statement and returns the vector so it can be cached
+    search_by_question = _vector_search_sql(
+        kb,
+        live_rows,
+        f"""(
                 SELECT
-                    ml_generate_embedding_result,
-                    content AS query
+                    ml_generate_embedding_result
                 FROM
                     ML.GENERATE_EMBEDDING(
-                        MODEL `{EMBEDDING_MODEL}`,
-                        (SELECT '{user_question}' AS content)
+                        MODEL `{kb.embedding_model}`,
+                        (SELECT @question AS content)
                     )
-            ),
-            top_k => 1,
-            options => '{{"fraction_lists_to_search": 0.01}}'
-        );
+            )""",
+        "query.ml_generate_embedding_result AS query_embedding, base.content, distance"
+    )
+
+    search_by_embedding = _vector_search_sql(
+        kb,
+        live_rows,
+        "(SELECT @query_embedding AS ml_generate_embedding_result)",
+        "base.content, distance"
+    )
+
+    search_batch = _vector_search_sql(
+        kb,
+        live_rows,
+        f"""(
+                SELECT
+                    query_id,
+                    ml_generate_embedding_result
+                FROM
+                    ML.GENERATE_EMBEDDING(
+                        MODEL `{kb.embedding_model}`,
+                        (SELECT query_id, content FROM UNNEST(@questions) AS content WITH OFFSET AS query_id)
+                    )
+            )""",
+        "query.query_id, base.content, distance"
+    )
+
+    return SimpleNamespace(
+        embed_question=embed_question,
+        embed_questions=embed_questions,
+        search_by_question=search_by_question,
+        search_by_embedding=search_by_embedding,
+        search_batch=search_batch,
+    )
+
+def run_query(bq_client, query, query_parameters, max_results=None):
+    """
+    Run a parameterized query on BigQuery's short-query path
+
+    query_and_wait uses the jobs.query API, which returns the first page of
+    rows inline and, with JOB_CREATION_OPTIONAL on the client, skips creating
+    a job for short queries. Capping max_results keeps the whole result in
+    that first page, so no further page requests are made. Calls go through
+    the BigQuery circuit breaker.
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+    with BREAKERS["bigquery"].guard():
+        return bq_client.query_and_wait(query, job_config=job_config, max_results=max_results)
+
+def embed_query(bq_client, user_question, cached_only=False):
+    """
+    Embed a question with the BigQuery remote embedding model, reusing cached vectors
+
+    With cached_only, a question that is not cached returns None instead of
+    being embedded.
+    """
+    kb = active_knowledge_base()
+    cache_key = normalize_question(user_question)
+    cached_embedding = kb.embedding_cache.get(cache_key)
+    if cached_embedding is not None or cached_only:
+        return cached_embedding
+
+    try:
+        with time_stage("embed"):
+            results = run_query(
+                bq_client,
+                retrieval_sql(kb).embed_question,
+                [bigquery.ScalarQueryParameter("question", "STRING", user_question)],
+                max_results=1
+            )
+
+        for row in results:
+            query_embedding = list(row.ml_generate_embedding_result)
+            kb.embedding_cache.set(cache_key, query_embedding)
+            return query_embedding
+
+        return None
+
+    except Exception as e:
+        print(f"⚠️ Embedding error: {e}")
+        return None
+
+def embed_queries(bq_client, user_questions, cached_only=False):
+    """
+    Embed several questions with one ML.GENERATE_EMBEDDING query
+
+    Cached questions are not sent again; with cached_only, nothing is. Returns
+    a list aligned with user_questions, holding None where a question could
+    not be embedded.
+    """
+    kb = active_knowledge_base()
+    cache_keys = [normalize_question(question) for question in user_questions]
+    embeddings = [kb.embedding_cache.get(cache_key) for cache_key in cache_keys]
+
+    if cached_only:
+        return embeddings
+
+    # Uncached questions, deduplicated by normalized text
+    missing = {}
+    for cache_key, question, embedding in zip(cache_keys, user_questions, embeddings):
+        if embedding is None:
+            missing.setdefault(cache_key, question)
+
+    if not missing:
+        return embeddings
+
+    missing_keys = list(missing)
+
+    try:
+        with time_stage("embed"):
+            results = run_query(
+                bq_client,
+                retrieval_sql(kb).embed_questions,
+                [bigquery.ArrayQueryParameter("questions", "STRING", list(missing.values()))]
+            )
+
+        embedded = {}
+        for row in results:
+            cache_key = missing_keys[row.query_id]
+            embedded[cache_key] = list(row.ml_generate_embedding_result)
+            kb.embedding_cache.set(cache_key, embedded[cache_key])
+
+        return [e if e is not None else embedded.get(k) for k, e in zip(cache_keys, embeddings)]
+
+    except Exception as e:
+        print(f"⚠️ Batch embedding error: {e}")
+        return embeddings
+
+def distance_to_similarity(distance):
+    """
+    Convert a VECTOR_SEARCH euclidean distance to cosine similarity
+
+    The embedding model returns unit-length vectors, for which
+    cosine = 1 - distance^2 / 2, so BigQuery and local scores are comparable.
+    """
+    return 1.0 - (distance * distance) / 2.0
+
+def retrieve_passages(bq_client, user_question, vector_index=None, lexical_index=None):
+    """
+    Retrieve the top-k FAQ passages for a question
+
+    With a lexical index, BM25 runs first: a strong lexical match is returned
+    without embedding the question at all; otherwise the lexical and vector
+    rankings are fused by reciprocal rank.
+
+    Returns:
+        list: (content, score) tuples, best first
+    """
+    top_k = active_knowledge_base().top_k
+    lexical_passages = []
+
+    if lexical_index is not None:
+        with time_stage("lexical"):
+            lexical_passages = lexical_index.search(user_question, top_k=top_k)
+
+        if lexical_index.is_strong(lexical_passages):
+            RETRIEVAL_PATHS.inc(path="lexical")
+            return lexical_passages
+
+    vector_passages = retrieve_vector_passages(bq_client, user_question, vector_index)
+
+    if not lexical_passages:
+        RETRIEVAL_PATHS.inc(path="vector")
+        return vector_passages
+
+    RETRIEVAL_PATHS.inc(path="hybrid")
+    return reciprocal_rank_fusion([vector_passages, lexical_passages])[:top_k]
+
+def retrieve_vector_passages(bq_client, user_question, vector_index=None):
     """
+    Retrieve the top-k FAQ passages for a question by embedding similarity
+
+    With a local vector index only the question embedding is computed remotely;
+    otherwise the search runs as a BigQuery VECTOR_SEARCH query. Either way a
+    cached question embedding skips the ML.GENERATE_EMBEDDING round trip.
+
+    Returns:
+        list: (content, score) tuples, best first, scored by cosine similarity
+    """
+    kb = active_knowledge_base()
+
+    if vector_index is not None:
+        query_embedding = embed_query(bq_client, user_question)
+
+        if query_embedding is not None:
+            with time_stage("search"):
+                return vector_index.search(query_embedding, top_k=kb.top_k)
+
+    cache_key = normalize_question(user_question)
+    query_embedding = kb.embedding_cache.get(cache_key)
+
+    if query_embedding is not None:
+        # Search with the cached vector; no remote embedding needed
+        search_query = retrieval_sql(kb).search_by_embedding
+        query_parameters = [bigquery.ArrayQueryParameter("query_embedding", "FLOAT64", query_embedding)]
+    else:
+        search_query = retrieval_sql(kb).search_by_question
+        query_parameters = [bigquery.ScalarQueryParameter("question", "STRING", user_question)]
     
     try:
-        query_job = bq_client.query(search_query)
-        results = query_job.result()
+        # On a cache miss this statement also embeds the question
+        with time_stage("search"):
+            results = run_query(bq_client, search_query, query_parameters, max_results=kb.top_k)
         
+        passages = []
         for row in results:
-            return row.content
+            if query_embedding is None:
+                query_embedding = list(row.query_embedding)
+                kb.embedding_cache.set(cache_key, query_embedding)
+            passages.append((row.content, distance_to_similarity(row.distance)))
             
-        return None
+        return passages
         
     except Exception as e:
         print(f"⚠️ Search error: {e}")
+        return []
+
+def search_knowledge_base(bq_client, user_question, vector_index=None, lexical_index=None):
+    """
+    Search Alaska FAQ knowledge base using vector similarity, fused with BM25
+    when a lexical index is given
+
+    The top-k passages are deduplicated and packed into the context token
+    budget, best first.
+
+    Returns:
+        str: the assembled context, or None when nothing was found
+    """
+    return assemble_context(retrieve_passages(bq_client, user_question, vector_index, lexical_index))
+
+def search_knowledge_base_local(user_question, vector_index=None, lexical_index=None):
+    """
+    Search the in-memory indexes alone, without any BigQuery call
+
+    Works when the question has a strong lexical match, or when its embedding
+    is cached and there is a local vector index. The context is assembled as
+    search_knowledge_base would assemble it, so it finds the same cached answers.
+
+    Returns:
+        tuple: (query_embedding, context), or None when the search needs BigQuery
+    """
+    kb = active_knowledge_base()
+    lexical_passages = lexical_index.search(user_question, top_k=kb.top_k) if lexical_index is not None else []
+    query_embedding = kb.embedding_cache.get(normalize_question(user_question), count_miss=False)
+
+    if lexical_index is not None and lexical_index.is_strong(lexical_passages):
+        return query_embedding, assemble_context(lexical_passages)
+
+    if vector_index is None or query_embedding is None:
         return None
 
-def generate_response(model, user_question, context):
-    """Generate AI response using retrieved context"""
-    system_prompt = f"""
-You are an Alaska Department information assistant. Provide helpful answers using only the information below.
-If the answer isn't available in the provided content, politely say you don't have that information.
+    passages = vector_index.search(query_embedding, top_k=kb.top_k)
+    if lexical_passages:
+        passages = reciprocal_rank_fusion([passages, lexical_passages])[:kb.top_k]
+    return query_embedding, assemble_context(passages)
 
+def build_prompt(user_question, context, history=None):
+    """Build the grounded generation prompt, with the conversation so far for a session's follow-ups"""
+    conversation = f"""
+Conversation So Far:
+{history}
+""" if history else ""
+    return f"""
+You are an {active_knowledge_base().assistant} information assistant. Provide helpful answers using only the information below.
+If the answer isn't available in the provided content, politely say you don't have that information.
+{conversation}
 Available Information:
 {context}
 
@@ -79,11 +389,155 @@ User Question:
 {user_question}
 
 Response:"""
+
+def select_model(model, user_question, context, force_pro=False):
+    """
+    Resolve a ModelCascade to one tier's model; a single model is its own tier
+
+    Returns:
+        tuple: (tier, model)
+    """
+    if isinstance(model, ModelCascade):
+        return model.select(user_question, context, force_pro)
+    return "single", model
+
+def generate_response(model, user_question, context, force_pro=False, history=None):
+    """Generate AI response using retrieved context, routed to a model tier"""
+    system_prompt = build_prompt(user_question, context, history)
+    tier, model = select_model(model, user_question, context, force_pro)
     
     try:
-        response = model.generate_content(system_prompt)
+        with time_stage("generate"), BREAKERS["gemini"].guard():
+            start = time.perf_counter()
+            response = model.generate_content(system_prompt)
+            GENERATION_LATENCY.observe(time.perf_counter() - start, tier=tier)
         return response.text.strip()
         
     except Exception as e:
         print(f"⚠️ Response generation error: {e}")
-        return "Sorry, I encountered an issue generating a response."
\ No newline at end of file
+        return GENERATION_ERROR_MESSAGE
+
+def degraded_answer(context):
+    """Answer with the retrieved FAQ text alone, for when generation is unavailable"""
+    intro = DEGRADED_ANSWER_INTRO.format(faq_name=active_knowledge_base().faq_name)
+    return f"{intro}\n\n{context}"
+
+def search_lexical_only(user_question, lexical_index):
+    """Context from the local lexical index alone, for when vector search is unavailable"""
+    if lexical_index is None:
+        return None
+    return assemble_context(lexical_index.search(user_question, top_k=active_knowledge_base().top_k))
+
+def warm_up_model(model):
+    """Prime a Gemini model's connection (every tier of a cascade) with a one-token generation"""
+    models = model.tiers.values() if isinstance(model, ModelCascade) else [model]
+    for tier_model in models:
+        tier_model.generate_content("Reply with OK.", generation_config={"max_output_tokens": 1})
+
+def generate_response_stream(model, user_question, context, force_pro=False, history=None):
+    """
+    Generate AI response chunk by chunk as Gemini produces it
+
+    Errors propagate to the caller, which may already have sent earlier chunks.
+    """
+    system_prompt = build_prompt(user_question, context, history)
+    tier, model = select_model(model, user_question, context, force_pro)
+    
+    with time_stage("generate"), BREAKERS["gemini"].guard():
+        start = time.perf_counter()
+        for chunk in model.generate_content(system_prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+        GENERATION_LATENCY.observe(time.perf_counter() - start, tier=tier)
+
+def search_knowledge_base_batch(bq_client, user_questions, vector_index=None, lexical_index=None):
+    """
+    Search the knowledge base for several questions at once
+
+    With a lexical index, questions with a strong lexical match skip the
+    vector search and the rest are fused with their BM25 results, as in
+    retrieve_passages. Returns contexts aligned with user_questions.
+    """
+    if not user_questions:
+        return []
+
+    if lexical_index is None:
+        return [
+            assemble_context(passages) if passages is not None else None
+            for passages in retrieve_vector_passages_batch(bq_client, user_questions, vector_index)
+        ]
+
+    top_k = active_knowledge_base().top_k
+    with time_stage("lexical"):
+        lexical = [lexical_index.search(question, top_k=top_k) for question in user_questions]
+
+    contexts = [None] * len(user_questions)
+    remaining = []
+
+    for i, passages in enumerate(lexical):
+        if lexical_index.is_strong(passages):
+            RETRIEVAL_PATHS.inc(path="lexical")
+            contexts[i] = assemble_context(passages)
+        else:
+            remaining.append(i)
+
+    vector_results = retrieve_vector_passages_batch(bq_client, [user_questions[i] for i in remaining], vector_index)
+
+    for i, vector_passages in zip(remaining, vector_results):
+        if not lexical[i]:
+            RETRIEVAL_PATHS.inc(path="vector")
+            contexts[i] = assemble_context(vector_passages) if vector_passages is not None else None
+            continue
+
+        RETRIEVAL_PATHS.inc(path="hybrid")
+        fused = reciprocal_rank_fusion([vector_passages or [], lexical[i]])[:top_k]
+        contexts[i] = assemble_context(fused)
+
+    return contexts
+
+def retrieve_vector_passages_batch(bq_client, user_questions, vector_index=None):
+    """
+    Retrieve top-k passages by embedding similarity for several questions
+
+    With a local vector index the questions are embedded in one query and
+    matched with one matrix product; otherwise a single VECTOR_SEARCH runs
+    over a multi-row query table.
+
+    Returns:
+        list: per question, (content, score) tuples, or None when it could not be searched
+    """
+    if not user_questions:
+        return []
+
+    kb = active_knowledge_base()
+
+    if vector_index is not None:
+        query_embeddings = embed_queries(bq_client, user_questions)
+        embedded = [i for i, e in enumerate(query_embeddings) if e is not None]
+        results = [None] * len(user_questions)
+
+        if embedded:
+            with time_stage("search"):
+                matches = vector_index.search_batch([query_embeddings[i] for i in embedded], top_k=kb.top_k)
+            for i, passages in zip(embedded, matches):
+                results[i] = passages
+
+        return results
+
+    try:
+        with time_stage("search"):
+            results = run_query(
+                bq_client,
+                retrieval_sql(kb).search_batch,
+                [bigquery.ArrayQueryParameter("questions", "STRING", list(user_questions))]
+            )
+
+        passages = [[] for _ in user_questions]
+        for row in results:
+            passages[row.query_id].append((row.content, distance_to_similarity(row.distance)))
+
+        return passages
+
+    except Exception as e:
+        print(f"⚠️ Batch search error: {e}")
+        return [None] * len(user_questions)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Replay captured /ask traffic against a backend
+
+Reads the traffic logs written with TRAFFIC_CAPTURE_ENABLED (plain or
+gzipped JSON lines) and re-issues every request at its recorded arrival
+offset, divided by --speed, whether or not earlier requests have finished,
+so the replay keeps the real traffic's bursts. Conversation turns are sent
+in their original sessions. Targets a running backend (--url) or the app
+in-process with the seeded local BigQuery/Gemini stand-ins of load_test.py.
+Reports recorded and replayed latency percentiles per stage and outcome
+counts side by side; --output writes the report, and --baseline compares
+against the report of an earlier build.
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import time
+import httpx
+
+from metrics import percentile
+from traffic import response_outcome, TRAFFIC_FILE
+
+STAGES = ("validate", "lexical", "embed", "search", "generate", "total", "client")
+
+def trace_files(paths):
+    """Log files named or found in the given directories, oldest rotation first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # traffic.jsonl.2.gz is older than traffic.jsonl.1.gz, which is older than traffic.jsonl
+            rotated = glob.glob(os.path.join(path, TRAFFIC_FILE + ".*.gz"))
+            rotated.sort(key=lambda name: int(name.rsplit(".", 2)[-2]), reverse=True)
+            files.extend(rotated)
+            if os.path.exists(os.path.join(path, TRAFFIC_FILE)):
+                files.append(os.path.join(path, TRAFFIC_FILE))
+        else:
+            files.append(path)
+    return files
+
+def read_trace(paths, limit=None):
+    """Captured requests in arrival order; lines without a question are skipped"""
+    records = []
+    for path in trace_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    if record.get("question"):
+                        records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit is not None else records
+
+def last_sse_event(body, event):
+    """The data of the last `event` in a Server-Sent Events body, or None"""
+    data = None
+    for block in body.split("\n\n"):
+        lines = block.strip().splitlines()
+        if len(lines) == 2 and lines[0] == f"event: {event}" and lines[1].startswith("data: "):
+            data = json.loads(lines[1][len("data: "):])
+    return data
+
+def parse_server_timing(header):
+    """Read a Server-Timing header back into stage -> milliseconds"""
+    timings = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+async def replay(client, records, speed=1.0):
+    """
+    Send every record at its arrival offset / speed
+
+    Returns:
+        list: per request {"stages": ms by stage, "outcome", "status", "lag_ms"},
+        in trace order; lag_ms is how late the request was sent
+    """
+    # Recorded session hash -> the session id the target gave that conversation
+    session_ids = {}
+    session_locks = {}
+    results = [None] * len(records)
+    t0 = records[0]["t"] if records else 0.0
+
+    async def send(i, record):
+        body = {"question": record["question"], "force_pro": record.get("force_pro", False)}
+        if record.get("kb"):
+            body["knowledge_base"] = record["kb"]
+
+        session = record.get("session")
+        lock = session_locks.setdefault(session, asyncio.Lock()) if session else None
+        if lock is not None:
+            # Turns of one conversation go in order, each after the previous answer
+            await lock.acquire()
+            body["session_id"] = session_ids.get(session, "")
+
+        try:
+            sent = time.perf_counter()
+            response = await client.post(record.get("endpoint", "/ask"), json=body)
+            if record.get("endpoint") == "/ask/stream" and response.status_code == 200:
+                answer = last_sse_event(response.text, "done")
+            else:
+                answer = response.json() if response.status_code == 200 else None
+            client_ms = (time.perf_counter() - sent) * 1000
+
+            if session and answer and answer.get("session_id"):
+                session_ids[session] = answer["session_id"]
+        finally:
+            if lock is not None:
+                lock.release()
+
+        stages = parse_server_timing(response.headers.get("Server-Timing", ""))
+        stages["client"] = client_ms
+        results[i] = {
+            "stages": stages,
+            "status": response.status_code,
+            "outcome": response_outcome(response.status_code, answer),
+            "lag_ms": (sent - start) * 1000 - (record["t"] - t0) / speed * 1000,
+        }
+
+    tasks = []
+    start = time.perf_counter()
+    for i, record in enumerate(records):
+        delay = (record["t"] - t0) / speed - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(i, record)))
+
+    await asyncio.gather(*tasks)
+    return results
+
+def latency_table(stage_samples):
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50), 1),
+            "p95_ms": round(percentile(values, 0.95), 1),
+            "p99_ms": round(percentile(values, 0.99), 1),
+        }
+        for stage, values in stage_samples.items() if values
+    }
+
+def summarize(records, results, speed, seconds):
+    """Recorded vs replayed latency percentiles and outcome counts"""
+    recorded = {stage: [] for stage in STAGES}
+    replayed = {stage: [] for stage in STAGES}
+    for record in records:
+        for stage, ms in record.get("stages", {}).items():
+            recorded.setdefault(stage, []).append(ms)
+        recorded["client"].append(record["ms"])
+    for result in results:
+        for stage, ms in result["stages"].items():
+            replayed.setdefault(stage, []).append(ms)
+
+    def outcomes(items):
+        counts = {}
+        for item in items:
+            counts[item["outcome"]] = counts.get(item["outcome"], 0) + 1
+        return dict(sorted(counts.items()))
+
+    span = records[-1]["t"] - records[0]["t"] if records else 0.0
+    return {
+        "requests": len(records),
+        "speed": speed,
+        "recorded_seconds": round(span, 3),
+        "replay_seconds": round(seconds, 3),
+        "max_send_lag_ms": round(max((result["lag_ms"] for result in results), default=0.0), 1),
+        "recorded": {"outcomes": outcomes(records), "stages": latency_table(recorded)},
+        "replayed": {"outcomes": outcomes(results), "stages": latency_table(replayed)},
+    }
+
+def print_report(report, baseline=None):
+    """
+    Print recorded and replayed percentiles per stage
+
+    With a baseline report, the replayed columns of both builds are compared instead.
+    """
+    left, left_name = (baseline["replayed"], "baseline") if baseline else (report["recorded"], "recorded")
+    right = report["replayed"]
+
+    print(f"\n{'='*72}")
+    print(f"Replayed {report['requests']} requests at {report['speed']}x in {report['replay_seconds']}s "
+          f"(recorded over {report['recorded_seconds']}s, max send lag {report['max_send_lag_ms']} ms)")
+    print(f"Outcomes {left_name}: {left['outcomes']}")
+    print(f"Outcomes replayed: {right['outcomes']}\n")
+    print(f"   {'stage':<10} {left_name + ' p50/p95/p99 ms':>28} {'replayed p50/p95/p99 ms':>28}")
+    for stage in STAGES:
+        if stage not in left["stages"] and stage not in right["stages"]:
+            continue
+        columns = []
+        for side in (left, right):
+            row = side["stages"].get(stage)
+            columns.append(f"{row['p50_ms']}/{row['p95_ms']}/{row['p99_ms']}" if row else "-")
+        print(f"   {stage:<10} {columns[0]:>28} {columns[1]:>28}")
+
+async def replay_trace(records, url=None, speed=1.0):
+    """Replay against url, or the in-process app once install_backends has run"""
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=None)
+    else:
+        import main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://replay", timeout=None)
+
+    async with client:
+        start = time.perf_counter()
+        results = await replay(client, records, speed)
+        return results, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("traces", nargs="+", help="traffic log files or capture directories")
+    parser.add_argument("--speed", type=float, default=1.0, help="arrival rate multiplier (2 = twice as fast)")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--url", help="backend to replay against (default: in-process app with local stand-ins)")
+    parser.add_argument("--bigquery-ms", type=float, default=80.0, help="median local BigQuery latency")
+    parser.add_argument("--gemini-ms", type=float, default=600.0, help="median local generation latency")
+    parser.add_argument("--validator-ms", type=float, default=150.0, help="median local validator latency")
+    parser.add_argument("--sigma", type=float, default=0.3, help="log-normal latency spread (0 = constant)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--direct-answers", action="store_true", help="answer FAQ questions with the stored answer")
+    parser.add_argument("--baseline", help="report JSON of an earlier replay to compare against")
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    records = read_trace(args.traces, args.limit)
+    if not records:
+        raise SystemExit("❌ No captured requests found")
+
+    if not args.url:
+        from load_test import install_backends
+        install_backends(
+            bigquery_ms=args.bigquery_ms, gemini_ms=args.gemini_ms, validator_ms=args.validator_ms,
+            sigma=args.sigma, seed=args.seed, direct_answers=args.direct_answers
+        )
+
+    print(f"🚀 Replaying {len(records)} requests at {args.speed}x against {args.url or 'local stand-ins'}...")
+    results, seconds = asyncio.run(replay_trace(records, args.url, args.speed))
+
+    if not args.url:
+        from concurrency import shutdown_executors
+        shutdown_executors()
+
+    report = summarize(records, results, args.speed, seconds)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Report written to {args.output}")
@@ -0,0 +1,279 @@
+"""
+Deadlines, hedged stage calls, upstream in-flight limits and circuit breakers
+
+Each /ask request carries an end-to-end deadline in a context variable; a
+stage may use its fraction of the total, capped by what is left. Blocking
+calls on executor threads cannot be interrupted, so a stage that runs out of
+time is abandoned and its late result dropped, as with discard_task. Time
+spent waiting for a free upstream slot counts against the stage's budget.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from config import (
+    STAGE_DEADLINE_FRACTIONS, HEDGE_STAGES, HEDGE_MIN_SAMPLES, HEDGE_WINDOW,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+from concurrency import run_stage, discard_task
+from admission import upstream_gate, reset_admission
+from metrics import percentile, HEDGED_CALLS, DEADLINE_EXCEEDED, CIRCUIT_REJECTIONS, UPSTREAM_ERRORS
+
+class StageTimeoutError(Exception):
+    """A stage did not finish within its share of the request deadline"""
+
+class CircuitOpenError(Exception):
+    """An upstream call was refused because its circuit breaker is open"""
+
+class Deadline:
+    """Absolute end time of a request"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_budget(self, stage):
+        """Seconds a stage may take: its fraction of the total, capped by what is left"""
+        return min(self.remaining(), self.seconds * STAGE_DEADLINE_FRACTIONS.get(stage, 1.0))
+
+_deadline = ContextVar("deadline", default=None)
+
+def start_deadline(seconds):
+    """Set the deadline for the current request"""
+    deadline = Deadline(seconds)
+    _deadline.set(deadline)
+    return deadline
+
+def current_deadline():
+    return _deadline.get()
+
+# Recent latencies of stage calls that reached their upstream, for the hedging
+# threshold. Calls settled locally (verdict cache, screener, lexical fast path,
+# cached embeddings) finish in microseconds and would drag the p95 far below a
+# real round trip, hedging most upstream calls.
+_stage_latencies = {}
+_latencies_lock = threading.Lock()
+
+class UpstreamCall:
+    """Marks whether one stage call attempt reached its upstream"""
+
+    def __init__(self):
+        self.reached = False
+
+# The current call_stage attempt; executor threads see it through the copied context
+_upstream_call = ContextVar("upstream_call", default=None)
+
+def mark_upstream_call():
+    """Note that the current stage call attempt is calling its upstream"""
+    call = _upstream_call.get()
+    if call is not None:
+        call.reached = True
+
+def record_stage_latency(stage, seconds):
+    with _latencies_lock:
+        _stage_latencies.setdefault(stage, deque(maxlen=HEDGE_WINDOW)).append(seconds)
+
+def hedge_delay(stage):
+    """The recent p95 latency of a stage, or None until enough calls have been seen"""
+    if stage not in HEDGE_STAGES:
+        return None
+    with _latencies_lock:
+        latencies = list(_stage_latencies.get(stage, ()))
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return percentile(latencies, 0.95)
+
+async def run_limited(stage, func, *args):
+    """
+    Run a blocking call on its stage's executor once its upstream has a free slot
+
+    The slot is held until the call itself finishes, even if the caller
+    stops waiting for it, so abandoned calls still count against the limit.
+    """
+    gate = upstream_gate(stage)
+    if gate is None:
+        return await run_stage(stage, func, *args)
+
+    await gate.acquire()
+    start = time.monotonic()
+    call = asyncio.ensure_future(run_stage(stage, func, *args))
+
+    def release(task):
+        gate.release(time.monotonic() - start)
+        if not task.cancelled():
+            task.exception()
+
+    call.add_done_callback(release)
+    return await asyncio.shield(call)
+
+@asynccontextmanager
+async def upstream_slot(stage):
+    """Hold a slot of a stage's upstream for the enclosed block, waiting at most the stage's budget"""
+    gate = upstream_gate(stage)
+    if gate is None:
+        yield
+        return
+
+    deadline = current_deadline()
+    budget = deadline.stage_budget(stage) if deadline is not None else None
+    try:
+        await asyncio.wait_for(gate.acquire(), budget)
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise StageTimeoutError(f"no free {gate.name} slot within {budget:.1f}s") from None
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        gate.release(time.monotonic() - start)
+
+async def call_stage(stage, func, *args):
+    """
+    Run a blocking call on its stage's executor within the request deadline
+
+    If the call is still running at the stage's recent p95, one duplicate is
+    sent (unless the upstream is already at its in-flight limit) and whichever
+    finishes first wins. Only calls that reached the upstream feed the p95.
+    Raises StageTimeoutError once the stage's budget is spent; without a
+    deadline the call may run unbounded.
+    """
+    deadline = current_deadline()
+    budget = deadline.stage_budget(stage) if deadline is not None else None
+    delay = hedge_delay(stage)
+    gate = upstream_gate(stage)
+
+    attempts = {}
+
+    def attempt():
+        upstream_call = UpstreamCall()
+        token = _upstream_call.set(upstream_call)
+        try:
+            task = asyncio.ensure_future(run_limited(stage, func, *args))
+        finally:
+            _upstream_call.reset(token)
+        attempts[task] = upstream_call
+        return task
+
+    start = time.perf_counter()
+    first = attempt()
+    tasks = {first}
+
+    try:
+        if delay is not None and (budget is None or delay < budget):
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and not (gate is not None and gate.saturated):
+                HEDGED_CALLS.inc(stage=stage, outcome="sent")
+                tasks.add(attempt())
+
+        timeout = None if budget is None else max(0.0, budget - (time.perf_counter() - start))
+        done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        if not done:
+            DEADLINE_EXCEEDED.inc(stage=stage)
+            raise StageTimeoutError(f"{stage} did not finish within {budget:.1f}s")
+
+        winner = done.pop()
+        if winner is not first:
+            HEDGED_CALLS.inc(stage=stage, outcome="won")
+        result = winner.result()
+        if attempts[winner].reached:
+            record_stage_latency(stage, time.perf_counter() - start)
+        return result
+
+    finally:
+        for task in tasks:
+            discard_task(task)
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream
+
+    Closed: calls go through. After failure_threshold consecutive failures the
+    circuit opens and calls fail fast. After reset_seconds one probe call is
+    let through (half-open); its success closes the circuit, its failure
+    reopens it.
+    """
+
+    def __init__(self, upstream, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Whether a call may go through now; a half-open circuit admits one probe"""
+        with self._lock:
+            if self.opened_at is None:
+                mark_upstream_call()
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self._probing:
+                self._probing = True
+                mark_upstream_call()
+                return True
+
+        CIRCUIT_REJECTIONS.inc(upstream=self.upstream)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        UPSTREAM_ERRORS.inc(upstream=self.upstream)
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"⚠️ {self.upstream} circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+    @contextmanager
+    def guard(self):
+        """Run the enclosed upstream call through the breaker, raising CircuitOpenError when open"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.upstream} circuit is open")
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        else:
+            self.record_success()
+        finally:
+            # A call abandoned part way (e.g. a closed stream) releases its probe
+            with self._lock:
+                self._probing = False
+
+BREAKERS = {upstream: CircuitBreaker(upstream) for upstream in ("bigquery", "gemini", "gemini_validator")}
+
+def reset_resilience():
+    """Close every circuit, forget stage latencies and empty the admission gates"""
+    for breaker in BREAKERS.values():
+        breaker.reset()
+    with _latencies_lock:
+        _stage_latencies.clear()
+    reset_admission()
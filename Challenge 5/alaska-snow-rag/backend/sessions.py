@@ -0,0 +1,216 @@
+"""
+Server-side conversation sessions for follow-up questions
+
+A follow-up such as "and residential streets?" is rewritten into a
+standalone retrieval query by attaching it to the conversation's last
+standalone question. The last few turns are kept verbatim; older turns are
+folded into a short extractive summary, so the history added to the prompt
+stays within a fixed token budget however long the conversation runs.
+"""
+
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    SESSION_TTL_SECONDS, SESSION_MAX_SESSIONS, SESSION_MEMORY_LIMIT_MB,
+    SESSION_RECENT_TURNS, SESSION_HISTORY_TOKENS, SESSION_TURN_MAX_CHARS
+)
+from context_builder import estimate_tokens, CHARS_PER_TOKEN
+from lexical_index import tokenize
+
+# "and residential streets?", "what about sidewalks?"
+_FOLLOW_UP_LEAD = re.compile(r"^(?:and|also|what about|how about|what if|same for|and what about)\b[\s,]*", re.I)
+_REFERENCES = frozenset("it its they them their that those these".split())
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# Longest answer excerpt kept for a turn folded into the summary
+SUMMARY_ANSWER_CHARS = 160
+
+def is_follow_up(question):
+    """Whether a question leans on the previous turn for its topic"""
+    if _FOLLOW_UP_LEAD.match(question):
+        return True
+    words = _WORD.findall(question.lower())
+    return any(word in _REFERENCES for word in words) or len(tokenize(question)) < 2
+
+def _clip(text, max_chars):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 3].rstrip() + "..."
+
+def summarize_turn(question, answer):
+    """One summary line: the question and the first sentence of its answer"""
+    first_sentence = _SENTENCE_END.split(answer.strip(), maxsplit=1)[0]
+    return f"- Asked: {question} Answered: {_clip(first_sentence, SUMMARY_ANSWER_CHARS)}"
+
+class Session:
+    """One conversation's recent turns, summary of older turns and current topic"""
+
+    def __init__(self, session_id, recent_turns=SESSION_RECENT_TURNS, history_tokens=SESSION_HISTORY_TOKENS):
+        self.session_id = session_id
+        self.recent_turns = recent_turns
+        self.history_tokens = history_tokens
+        # (question, answer) pairs, oldest first
+        self.turns = []
+        self.summary = []
+        # Last question that stood on its own, anchoring follow-ups
+        self.topic = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        """Approximate text held, in bytes"""
+        turns = sum(len(question) + len(answer) for question, answer in self.turns)
+        return turns + sum(len(line) for line in self.summary) + len(self.topic or "")
+
+    def standalone_query(self, question):
+        """The retrieval query for a question: follow-ups are prefixed with the topic"""
+        if self.topic is None or not is_follow_up(question):
+            return question
+        remainder = _FOLLOW_UP_LEAD.sub("", question).strip() or question
+        return f"{self.topic.rstrip('?!. ')} {remainder}"
+
+    def history(self):
+        """Summary and recent turns as prompt text, within history_tokens; empty for a new session"""
+        lines = []
+        if self.summary:
+            lines.append("Earlier in this conversation:")
+            lines.extend(self.summary)
+        for question, answer in self.turns:
+            lines.append(f"User: {question}")
+            lines.append(f"Assistant: {answer}")
+        return "\n".join(lines)
+
+    def add_turn(self, question, answer):
+        """Record an answered question and compact the history back under budget"""
+        with self._lock:
+            if not is_follow_up(question) or self.topic is None:
+                self.topic = _clip(question, SESSION_TURN_MAX_CHARS)
+            self.turns.append((_clip(question, SESSION_TURN_MAX_CHARS), _clip(answer, SESSION_TURN_MAX_CHARS)))
+            self._compact()
+
+    def _compact(self):
+        while len(self.turns) > self.recent_turns:
+            self.summary.append(summarize_turn(*self.turns.pop(0)))
+
+        # Fold further turns, then forget the oldest summary lines, until the history fits
+        while estimate_tokens(self.history()) > self.history_tokens:
+            if len(self.turns) > 1:
+                self.summary.append(summarize_turn(*self.turns.pop(0)))
+            elif self.summary:
+                self.summary.pop(0)
+            else:
+                question, answer = self.turns[0]
+                budget = self.history_tokens * CHARS_PER_TOKEN - len(question) - 20
+                self.turns[0] = (question, _clip(answer, max(budget, 0)))
+                break
+
+class SessionStore:
+    """
+    Sessions by id in least recently used order
+
+    Sessions idle for ttl_seconds expire. Beyond max_sessions, or once the
+    text they hold exceeds memory_limit_bytes, the least recently used are
+    evicted. The text held is kept as a running total, updated as sessions
+    are added, grow, expire or are evicted, so no request walks every session.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS,
+                 memory_limit_bytes=SESSION_MEMORY_LIMIT_MB * 1e6):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.memory_limit_bytes = memory_limit_bytes
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        # session id -> (session, last used, bytes counted for it)
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self):
+        """Start a new session with a random id"""
+        session = Session(secrets.token_urlsafe(16))
+        with self._lock:
+            self._sessions[session.session_id] = (session, time.monotonic(), session.nbytes)
+            self._bytes += session.nbytes
+            self.created += 1
+            self._evict_over_limit()
+        return session
+
+    def get(self, session_id):
+        """Return a live session, or None when unknown or expired"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+
+            session, last_used, nbytes = entry
+            if last_used + self.ttl_seconds <= time.monotonic():
+                self._remove(session_id)
+                self.expired += 1
+                return None
+
+            self._sessions[session_id] = (session, time.monotonic(), nbytes)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def open(self, session_id):
+        """Return the session, or a new one (with a new id) if it is unknown or expired"""
+        return (self.get(session_id) if session_id else None) or self.create()
+
+    def record(self, session, question, answer):
+        """Add a turn to a session and enforce the memory limit"""
+        session.add_turn(question, answer)
+        nbytes = session.nbytes
+        with self._lock:
+            entry = self._sessions.get(session.session_id)
+            if entry is not None:
+                self._bytes += nbytes - entry[2]
+                self._sessions[session.session_id] = (session, time.monotonic(), nbytes)
+                self._sessions.move_to_end(session.session_id)
+            self._evict_over_limit()
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._remove(session_id) is not None
+
+    def memory_bytes(self):
+        return self._bytes
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "memory_mb": round(self.memory_bytes() / 1e6, 3),
+            "memory_limit_mb": round(self.memory_limit_bytes / 1e6, 3),
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def _remove(self, session_id):
+        # Called with self._lock held
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+        return entry
+
+    def _evict_over_limit(self):
+        # Called with self._lock held
+        now = time.monotonic()
+        while self._sessions:
+            session_id, (_, last_used, _) = next(iter(self._sessions.items()))
+            if last_used + self.ttl_seconds > now:
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.memory_limit_bytes):
+            self._remove(next(iter(self._sessions)))
+            self.evicted += 1
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the Alaska FAQ RAG API
+
+Each run starts a fresh interpreter, times `import main`, then runs the app's
+startup and polls /ready until initialization finishes. Reports the median
+import time, time to ready and per-step startup timings over several runs.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+RUN_ONCE = """
+import json, time
+start = time.perf_counter()
+import main
+import_seconds = time.perf_counter() - start
+
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    while not main.startup_task.done():
+        time.sleep(0.005)
+    ready = client.get("/ready")
+ready_seconds = time.perf_counter() - start
+
+print(json.dumps({
+    "import_seconds": import_seconds,
+    "ready_seconds": ready_seconds,
+    "ready": ready.status_code == 200,
+    "startup_timings": ready.json()["startup_timings"],
+}))
+"""
+
+def run_once():
+    """Measure one cold start in a fresh interpreter"""
+    completed = subprocess.run(
+        [sys.executable, "-c", RUN_ONCE],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_benchmark(runs):
+    """Run several cold starts and print median timings"""
+    print(f"🚀 Measuring {runs} cold starts...\n")
+
+    results = []
+    for i in range(runs):
+        result = run_once()
+        results.append(result)
+        print(f"   Run {i + 1}: import {result['import_seconds']:.3f}s, "
+              f"ready {result['ready_seconds']:.3f}s (ready={result['ready']})")
+
+    print(f"\n{'='*60}")
+    print(f"Median import time:   {statistics.median(r['import_seconds'] for r in results):.3f}s")
+    print(f"Median time to ready: {statistics.median(r['ready_seconds'] for r in results):.3f}s")
+
+    steps = sorted({step for r in results for step in r["startup_timings"]})
+    for step in steps:
+        values = [r["startup_timings"][step] for r in results if step in r["startup_timings"]]
+        print(f"   {step:<24} {statistics.median(values):.3f}s")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    args = parser.parse_args()
+
+    run_benchmark(args.runs)
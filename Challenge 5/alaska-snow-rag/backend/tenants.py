@@ -0,0 +1,117 @@
+"""
+Lazily loaded, LRU-evicted per-tenant indexes
+
+The default knowledge base is loaded at startup and never evicted. Any other
+knowledge base is loaded on its first request; once the loaded tenants
+together exceed the memory ceiling, the least recently used ones are dropped
+along with their caches and reload on their next request.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from metrics import TENANT_EVENTS
+
+def index_nbytes(index):
+    return index.nbytes if index is not None else 0
+
+class Tenant:
+    """A knowledge base's loaded indexes"""
+
+    def __init__(self, kb, vector_index, lexical_index, direct_answers=None):
+        self.kb = kb
+        self.vector_index = vector_index
+        self.lexical_index = lexical_index
+        self.direct_answers = direct_answers
+        self.loaded_at = time.time()
+
+    @property
+    def nbytes(self):
+        return (
+            index_nbytes(self.vector_index) + index_nbytes(self.lexical_index) + index_nbytes(self.direct_answers)
+        )
+
+class TenantRegistry:
+    """
+    Loaded tenants in least recently used order
+
+    loader(kb) builds a Tenant and may block; concurrent first requests for
+    the same knowledge base wait for one load.
+    """
+
+    def __init__(self, loader, memory_limit_bytes):
+        self.loader = loader
+        self.memory_limit_bytes = memory_limit_bytes
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def __contains__(self, name):
+        return name in self._tenants
+
+    def peek(self, name):
+        """The loaded tenant, without loading it or changing its recency"""
+        return self._tenants.get(name)
+
+    def get(self, kb):
+        """Return a knowledge base's tenant, loading it (and evicting others) if needed"""
+        with self._lock:
+            tenant = self._tenants.get(kb.name)
+            if tenant is not None:
+                self._tenants.move_to_end(kb.name)
+                return tenant
+            load_lock = self._load_locks.setdefault(kb.name, threading.Lock())
+
+        with load_lock:
+            tenant = self._tenants.get(kb.name)
+            if tenant is not None:
+                return tenant
+
+            start = time.perf_counter()
+            tenant = self.loader(kb)
+            TENANT_EVENTS.inc(knowledge_base=kb.name, event="load")
+            print(f"✅ Knowledge base {kb.name} loaded: {tenant.nbytes / 1e6:.1f} MB "
+                  f"in {time.perf_counter() - start:.2f}s")
+
+            with self._lock:
+                self._tenants[kb.name] = tenant
+                self._evict_over_limit(keep=kb.name)
+
+            return tenant
+
+    def evict(self, name):
+        """Drop a tenant's indexes and caches"""
+        with self._lock:
+            tenant = self._tenants.pop(name, None)
+        if tenant is not None:
+            self._drop(tenant)
+
+    def memory_bytes(self):
+        return sum(tenant.nbytes for tenant in list(self._tenants.values()))
+
+    def stats(self):
+        return {
+            "loaded": list(self._tenants),
+            "memory_mb": round(self.memory_bytes() / 1e6, 2),
+            "memory_limit_mb": round(self.memory_limit_bytes / 1e6, 2),
+        }
+
+    def _evict_over_limit(self, keep):
+        # Called with self._lock held
+        total = sum(tenant.nbytes for tenant in self._tenants.values())
+        for name in list(self._tenants):
+            if total <= self.memory_limit_bytes:
+                break
+            if name == keep:
+                continue
+            tenant = self._tenants.pop(name)
+            total -= tenant.nbytes
+            self._drop(tenant)
+
+    def _drop(self, tenant):
+        tenant.kb.clear_caches()
+        TENANT_EVENTS.inc(knowledge_base=tenant.kb.name, event="evict")
+        print(f"⚠️ Knowledge base {tenant.kb.name} evicted ({tenant.nbytes / 1e6:.1f} MB)")
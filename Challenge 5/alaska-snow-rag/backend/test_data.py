@@ -23,6 +23,42 @@ MOCK_FAQ_CONTENT = {
     - Include location and type of hazard"""
 }
 
+# Question/answer rows for the local BigQuery stand-in (same shape as alaska.alaska_faq)
+SAMPLE_FAQ_ROWS = [
+    {
+        "question": "How quickly are main roads cleared after snowfall?",
+        "answer": "Main roads are cleared within 4 hours of snowfall, with priority given to emergency routes."
+    },
+    {
+        "question": "When are residential streets plowed?",
+        "answer": "Residential areas are cleared within 24 hours after main roads and emergency routes."
+    },
+    {
+        "question": "What is applied to icy roads?",
+        "answer": "Salt and sand are applied to icy conditions on priority routes first."
+    },
+    {
+        "question": "When do emergency shelters open?",
+        "answer": "Emergency shelters open when the temperature drops below -20°F."
+    },
+    {
+        "question": "What should I do in a life-threatening winter emergency?",
+        "answer": "Call 911 for life-threatening emergencies and keep an emergency kit with food, water and blankets."
+    },
+    {
+        "question": "Who do I call about a power outage?",
+        "answer": "Report power outages to your utility company."
+    },
+    {
+        "question": "How do I report hazardous road conditions?",
+        "answer": "Call the DOT hotline at 1-800-478-7253 or report via 511.alaska.gov, including the location and type of hazard."
+    },
+    {
+        "question": "Where can I get real-time road updates?",
+        "answer": "Use the 511 Alaska app for real-time road condition updates."
+    }
+]
+
 # Test questions for unit testing
 UNIT_TEST_QUESTIONS = [
     {
@@ -0,0 +1,201 @@
+"""
+Opt-in capture of /ask traffic for offline replay
+
+Each captured request becomes one compact JSON line: arrival time, question,
+knowledge base, stage timings, ids of the retrieved passages and outcome.
+Lines are handed to a background thread that appends them to a size-rotated
+log file; rotated files are gzipped and only the newest few are kept, so
+capture stays cheap on the request path and bounded on disk. replay.py
+re-issues a captured trace.
+"""
+
+import contextvars
+import gzip
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from config import (
+    TRAFFIC_CAPTURE_ENABLED, TRAFFIC_CAPTURE_DIR, TRAFFIC_CAPTURE_MAX_MB, TRAFFIC_CAPTURE_FILES,
+    TRAFFIC_CAPTURE_SAMPLE_RATE
+)
+
+TRAFFIC_FILE = "traffic.jsonl"
+
+_capture = contextvars.ContextVar("traffic_capture", default=None)
+
+def passage_id(passage):
+    """Short id of a retrieved passage: the prefix of its content hash, as stored by ingest.py"""
+    return hashlib.sha256(passage.encode("utf-8")).hexdigest()[:16]
+
+def response_outcome(status_code, response=None):
+    """
+    Classify a finished request
+
+    Args:
+        status_code: HTTP status
+        response: the QuestionResponse as a dict, for a 200
+
+    Returns:
+        str: answered, direct, cache_hit, degraded, no_context, blocked,
+        shed, timeout or error
+    """
+    if status_code in (429, 503):
+        return "shed"
+    if status_code == 504:
+        return "timeout"
+    if status_code != 200 or response is None:
+        return "error"
+    if response.get("validation_status") == "blocked":
+        return "blocked"
+    if response.get("validation_status") != "passed":
+        return "error"
+    if response.get("direct_answer"):
+        return "direct"
+    if response.get("cache_hit"):
+        return "cache_hit"
+    if response.get("degraded"):
+        return "degraded"
+    if not response.get("context_found"):
+        return "no_context"
+    return "answered"
+
+class TrafficRecord:
+    """One request being captured; fields are filled in as the pipeline runs"""
+
+    def __init__(self, endpoint, timings):
+        self.endpoint = endpoint
+        self.timings = timings
+        self.arrived = time.time()
+        self.start = time.perf_counter()
+        self.fields = {}
+        # Set by /ask/stream: the record is written when the stream ends
+        self.deferred = False
+
+    def to_json(self, status_code):
+        record = {
+            "t": round(self.arrived, 3),
+            "endpoint": self.endpoint,
+            **self.fields,
+            "status": status_code,
+            "ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "stages": {stage: round(seconds * 1000, 1) for stage, seconds in self.timings.items()},
+        }
+        record.setdefault("outcome", response_outcome(status_code))
+        return json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+
+def _gzip_rotated(source, destination):
+    with open(source, "rb") as f_in, gzip.open(destination, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+class TrafficRecorder:
+    """
+    Writes captured requests to TRAFFIC_FILE in directory, rotating at max_bytes
+
+    Records are queued and written by a background listener thread, started
+    on first use. Rotated files are gzipped (traffic.jsonl.1.gz, ...) and at
+    most backup_count of them are kept.
+    """
+
+    def __init__(self, directory=TRAFFIC_CAPTURE_DIR, max_bytes=TRAFFIC_CAPTURE_MAX_MB * 1e6,
+                 backup_count=TRAFFIC_CAPTURE_FILES, sample_rate=TRAFFIC_CAPTURE_SAMPLE_RATE,
+                 enabled=TRAFFIC_CAPTURE_ENABLED):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.backup_count = backup_count
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.recorded = 0
+        self._logger = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._logger is not None:
+                return self._logger
+
+            os.makedirs(self.directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.directory, TRAFFIC_FILE), maxBytes=self.max_bytes,
+                backupCount=self.backup_count, encoding="utf-8"
+            )
+            handler.namer = lambda name: name + ".gz"
+            handler.rotator = _gzip_rotated
+            handler.setFormatter(logging.Formatter("%(message)s"))
+
+            records = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(records, handler)
+            self._listener.start()
+
+            logger = logging.getLogger(f"traffic.{id(self)}")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(logging.handlers.QueueHandler(records))
+            self._logger = logger
+            print(f"✅ Capturing traffic to {os.path.join(self.directory, TRAFFIC_FILE)}")
+            return logger
+
+    def begin(self, endpoint, timings):
+        """Start capturing the current request if capture is on and it is sampled; returns the record or None"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        record = TrafficRecord(endpoint, timings)
+        _capture.set(record)
+        return record
+
+    def write(self, record, status_code):
+        """Queue a finished request's line; requests that never reached the pipeline are skipped"""
+        if "question" not in record.fields:
+            return
+        (self._logger or self._start()).info(record.to_json(status_code))
+        self.recorded += 1
+
+    def close(self):
+        """Flush queued lines and stop the writer thread"""
+        with self._lock:
+            if self._listener is not None:
+                self._listener.stop()
+                for handler in self._listener.handlers:
+                    handler.close()
+            self._logger = None
+            self._listener = None
+
+    def stats(self):
+        return {"enabled": self.enabled, "recorded": self.recorded, "directory": self.directory}
+
+def current_record():
+    """The current request's capture record, or None when it is not captured"""
+    return _capture.get()
+
+def note_request(question, knowledge_base, force_pro=False, session_id=None):
+    """Record what was asked; the session id is hashed so replay can group turns without storing it"""
+    record = _capture.get()
+    if record is None:
+        return
+    record.fields.update(question=question, kb=knowledge_base)
+    if force_pro:
+        record.fields["force_pro"] = True
+    if session_id is not None:
+        record.fields["session"] = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:12]
+
+def note_context(context):
+    """Record the ids of the passages packed into the context"""
+    record = _capture.get()
+    if record is not None and context:
+        record.fields["context_ids"] = [passage_id(passage) for passage in context.split("\n\n")]
+
+def note_response(response):
+    """Record a successful response's outcome"""
+    record = _capture.get()
+    if record is not None:
+        record.fields["outcome"] = response_outcome(200, response.model_dump())
+
+TRAFFIC = TrafficRecorder()
@@ -0,0 +1,176 @@
+"""
+In-process vector index for an FAQ knowledge base
+"""
+
+import os
+import time
+import numpy as np
+from knowledge_base import active_knowledge_base
+
+class TopKSearch:
+    """
+    Top-k cosine search shared by the index implementations
+
+    Subclasses provide `contents` and `score(queries)`, which returns the
+    cosine similarity of each unit-length query against every row.
+    """
+
+    def search(self, query_embedding, top_k=1):
+        """
+        Find the rows closest to a query embedding
+
+        Returns:
+            list: (content, score) tuples ordered by descending cosine similarity
+        """
+        return self.search_batch([query_embedding], top_k)[0]
+
+    def search_batch(self, query_embeddings, top_k=1):
+        """
+        Find the closest rows for several query embeddings with one matrix product
+
+        Returns:
+            list: one list of (content, score) tuples per query
+        """
+        return [
+            [(self.contents[i], score) for i, score in ranked]
+            for ranked in self.rank_batch(query_embeddings, top_k)
+        ]
+
+    def rank_batch(self, query_embeddings, top_k=1):
+        """
+        Rank rows for several query embeddings
+
+        Returns:
+            list: one list of (row number, score) tuples per query, best first
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        top_k = min(top_k, len(self))
+        if top_k == 0:
+            return [[] for _ in queries]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        norms[empty] = 1.0
+
+        scores = self.score(queries / norms)
+
+        # argpartition is O(n); only the k survivors per query need a full sort
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+
+        results = []
+        for row, row_candidates in enumerate(candidates):
+            if empty[row]:
+                results.append([])
+                continue
+
+            row_scores = scores[row, row_candidates]
+            ranked = row_candidates[np.argsort(-row_scores)]
+            results.append([(int(i), float(scores[row, i])) for i in ranked])
+
+        return results
+
+class VectorIndex(TopKSearch):
+    """Float32 snapshot of the FAQ embeddings answering top-k cosine queries"""
+
+    def __init__(self, contents, embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0:
+            matrix = matrix.reshape(0, 0)
+        if matrix.ndim != 2 or matrix.shape[0] != len(contents):
+            raise ValueError("contents and embeddings must have the same number of rows")
+
+        # Normalize once so a single matrix product yields cosine similarities
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+
+        self.contents = list(contents)
+        self.matrix = matrix / norms
+
+    def __len__(self):
+        return len(self.contents)
+
+    @property
+    def dimensions(self):
+        return self.matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes of the matrix and the UTF-8 contents"""
+        return self.matrix.nbytes + sum(len(content.encode("utf-8")) for content in self.contents)
+
+    def save(self, path):
+        """Write the index to an .npz file that load_vector_index can read"""
+        np.savez(path, contents=np.asarray(self.contents, dtype=str), embeddings=self.matrix)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save"""
+        with np.load(path) as data:
+            return cls(data["contents"].tolist(), data["embeddings"])
+
+    def score(self, queries):
+        return queries @ self.matrix.T
+
+def snapshot_sql(kb):
+    return f"""
+    SELECT
+        content,
+        ml_generate_embedding_result
+    FROM
+        {kb.table_ref}
+    WHERE
+        ARRAY_LENGTH(ml_generate_embedding_result) > 0
+        AND {kb.live_rows};
+    """
+
+def load_vector_index(bq_client, index_path=None, kb=None):
+    """
+    Load the local index of a knowledge base (the active one by default)
+
+    An index written by ingest.py is used when index_path (by default the
+    knowledge base's index_path) exists: a store directory is memory-mapped
+    (see embedding_store), an .npz file is read into memory. Otherwise the
+    embedded FAQ table is snapshotted from BigQuery.
+    """
+    kb = kb or active_knowledge_base()
+    if index_path is None:
+        index_path = kb.index_path
+
+    if index_path and os.path.exists(index_path):
+        try:
+            start = time.perf_counter()
+            if os.path.isdir(index_path):
+                # Imported here: embedding_store builds on this module
+                from embedding_store import EmbeddingStore
+                index = EmbeddingStore(index_path)
+            else:
+                index = VectorIndex.load(index_path)
+            elapsed = time.perf_counter() - start
+            print(f"✅ Vector index loaded from {index_path}: {len(index)} rows in {elapsed:.2f}s")
+            return index
+        except Exception as e:
+            print(f"⚠️ Vector index file {index_path} unreadable, snapshotting BigQuery: {e}")
+
+    return snapshot_vector_index(bq_client, kb)
+
+def snapshot_vector_index(bq_client, kb=None):
+    """Snapshot a knowledge base's embedded FAQ table from BigQuery into a local index"""
+    kb = kb or active_knowledge_base()
+    try:
+        start = time.perf_counter()
+        rows = bq_client.query_and_wait(snapshot_sql(kb))
+
+        contents = []
+        embeddings = []
+        for row in rows:
+            contents.append(row.content)
+            embeddings.append(row.ml_generate_embedding_result)
+
+        index = VectorIndex(contents, embeddings)
+        elapsed = time.perf_counter() - start
+        print(f"✅ Vector index loaded: {len(index)} rows in {elapsed:.2f}s")
+        return index
+
+    except Exception as e:
+        print(f"❌ Vector index load failed, falling back to BigQuery search: {e}")
+        return None
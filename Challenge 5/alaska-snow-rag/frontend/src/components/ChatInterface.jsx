@@ -58,6 +58,19 @@ const ChatInterface = () => {
         }
     };
 
+    const parseEvent = (raw) => {
+        let event = 'message';
+        let data = '';
+        for (const line of raw.split('\n')) {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data += line.slice(5).trim();
+            }
+        }
+        return { event, data: data ? JSON.parse(data) : {} };
+    };
+
     const scrollToBottom = () => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
     };
@@ -80,7 +93,7 @@ const ChatInterface = () => {
         setLoading(true);
 
         try {
-            const response = await fetch(API_URL + '/ask', {
+            const response = await fetch(API_URL + '/ask/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -88,19 +101,54 @@ const ChatInterface = () => {
                 body: JSON.stringify({ question: userMessage })
             });
 
-            const data = await response.json();
-
-            if (response.ok) {
-                setMessages(prev => [...prev, { 
-                    type: 'assistant', 
-                    content: data.answer,
-                    contextFound: data.context_found,
-                    validationStatus: data.validation_status,
-                    timestamp: new Date().toISOString()
-                }]);
-            } else {
+            if (!response.ok || !response.body) {
+                const data = await response.json().catch(() => ({}));
                 throw new Error(data.detail || 'Failed to get response');
             }
+
+            // Render the answer as Server-Sent Events arrive from /ask/stream
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let streaming = false;
+
+            const updateAnswer = (update) => {
+                if (!streaming) {
+                    streaming = true;
+                    setMessages(prev => [...prev, {
+                        type: 'assistant',
+                        content: '',
+                        timestamp: new Date().toISOString()
+                    }]);
+                }
+                setMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, ...update(last) }];
+                });
+            };
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                for (const { event, data } of events.map(parseEvent)) {
+                    if (event === 'chunk') {
+                        updateAnswer(last => ({ content: last.content + data.text }));
+                    } else if (event === 'done') {
+                        updateAnswer(() => ({
+                            content: data.answer,
+                            contextFound: data.context_found,
+                            validationStatus: data.validation_status
+                        }));
+                    } else if (event === 'error') {
+                        throw new Error(data.error);
+                    }
+                }
+            }
         } catch (err) {
             setError('Failed to connect to the service. Please try again.');
             setMessages(prev => [...prev, { 
@@ -174,7 +222,7 @@ const ChatInterface = () => {
                         ))
                     )}
                     
-                    {loading && (
+                    {loading && messages[messages.length - 1]?.type === 'user' && (
                         <div className="message assistant">
                             <div className="message-avatar">AI</div>
                             <div className="message-content">